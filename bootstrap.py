@@ -11,6 +11,8 @@ DEVPATH = osp.dirname(osp.abspath(__file__))
 sys.path.insert(0, DEVPATH)
 print("01. Added %s to sys.path" % DEVPATH)
 
-# Run the app
-from conda_manager.app import main
-main()
+# Run the app, not in the worker processes importing this script as their
+# main module
+if __name__ == '__main__':
+    from conda_manager.app import main
+    main()
@@ -9,8 +9,6 @@
 
 # Standard library imports
 from collections import deque
-import bz2
-import json
 import logging
 import os
 import time
@@ -22,10 +20,10 @@ import binstar_client
 
 # Local imports
 from conda_manager.api.conda_api import CondaAPI
+from conda_manager.api.repodata import INDEX_CACHE_FILENAME, RepodataIndex
 from conda_manager.utils import constants as C
 from conda_manager.utils import sort_versions
 from conda_manager.utils.logs import logger
-from conda_manager.utils.py3compat import to_text_string
 
 
 class ClientWorker(QObject):
@@ -82,6 +80,7 @@ class _ClientAPI(QObject):
         self._workers = []
         self._timer = QTimer()
         self._conda_api = CondaAPI()
+        self._repodata_index = RepodataIndex()
 
         self._timer.setInterval(1000)
         self._timer.timeout.connect(self._clean)
@@ -122,89 +121,30 @@ class _ClientAPI(QObject):
         self._start()
         return worker
 
-    @staticmethod
-    def _load_repodata(filepaths, extra_data=None, metadata=None):
+    def _load_repodata(self, filepaths, extra_data=None, metadata=None,
+                       cache_dir=None, parallel=True):
         """Load all the available pacakges information.
 
         For downloaded repodata files (repo.continuum.io), additional
         data provided (anaconda cloud), and additional metadata and merge into
         a single set of packages and apps.
+
+        Each file is streamed and reduced to the few fields used by the
+        package manager, so the full decoded repodata is never kept in memory.
+        If `cache_dir` is given, the merged index is cached there until any of
+        the files change. Files are parsed in worker processes unless
+        `parallel` is False. Only the packages of files that were added or
+        removed since the last call are merged again.
+
+        Packages and apps are returned as compact `PackageIndex` mappings.
         """
         extra_data = extra_data if extra_data else {}
-        metadata = metadata if metadata else {}
-        repodata = []
-        for filepath in filepaths:
-            compressed = filepath.endswith('.bz2')
-            mode = 'rb' if filepath.endswith('.bz2') else 'r'
-
-            if os.path.isfile(filepath):
-                with open(filepath, mode) as f:
-                    raw_data = f.read()
-
-                if compressed:
-                    data = bz2.decompress(raw_data)
-                else:
-                    data = raw_data
-
-                try:
-                    data = json.loads(to_text_string(data, 'UTF-8'))
-                except Exception as error:
-                    logger.error(str(error))
-                    data = {}
-
-                repodata.append(data)
-
-        all_packages = {}
-        for data in repodata:
-            packages = data.get('packages', {})
-            for canonical_name in packages:
-                data = packages[canonical_name]
-                name, version, b = tuple(canonical_name.rsplit('-', 2))
-
-                if name not in all_packages:
-                    all_packages[name] = {'versions': set(),
-                                          'size': {},
-                                          'type': {},
-                                          'app_entry': {},
-                                          'app_type': {},
-                                          }
-                elif name in metadata:
-                    temp_data = all_packages[name]
-                    temp_data['home'] = metadata[name].get('home', '')
-                    temp_data['license'] = metadata[name].get('license', '')
-                    temp_data['summary'] = metadata[name].get('summary', '')
-                    temp_data['latest_version'] = metadata[name].get('version')
-                    all_packages[name] = temp_data
-
-                all_packages[name]['versions'].add(version)
-                all_packages[name]['size'][version] = data.get('size', '')
-
-                # Only the latest builds will have the correct metadata for
-                # apps, so only store apps that have the app metadata
-                if data.get('type'):
-                    all_packages[name]['type'][version] = data.get('type')
-                    all_packages[name]['app_entry'][version] = data.get(
-                        'app_entry')
-                    all_packages[name]['app_type'][version] = data.get(
-                        'app_type')
-
-        all_apps = {}
-        for name in all_packages:
-            versions = sort_versions(list(all_packages[name]['versions']))
-            all_packages[name]['versions'] = versions[:]
-
-            for version in versions:
-                has_type = all_packages[name].get('type')
-                # Has type in this case implies being an app
-                if has_type:
-                    all_apps[name] = all_packages[name].copy()
-                    # Remove all versions that are not apps!
-                    versions = all_apps[name]['versions'][:]
-                    types = all_apps[name]['type']
-                    app_versions = [v for v in versions if v in types]
-                    all_apps[name]['versions'] = app_versions
-
-        return all_packages, all_apps
+        cache_path = None
+        if cache_dir:
+            cache_path = os.path.join(cache_dir, INDEX_CACHE_FILENAME)
+        return self._repodata_index.load(filepaths, metadata=metadata,
+                                         cache_path=cache_path,
+                                         parallel=parallel)
 
     @staticmethod
     def _prepare_model_data(packages, linked, pip=None,
@@ -319,18 +259,21 @@ class _ClientAPI(QObject):
         method = self._anaconda_client_api.remove_authentication
         return self._create_worker(method)
 
-    def load_repodata(self, filepaths, extra_data=None, metadata=None):
+    def load_repodata(self, filepaths, extra_data=None, metadata=None,
+                      cache_dir=None, parallel=True):
         """
         Load all the available pacakges information for downloaded repodata.
 
         Files include repo.continuum.io, additional data provided (anaconda
         cloud), and additional metadata and merge into a single set of packages
-        and apps.
+        and apps. The merged result is cached in `cache_dir` if provided.
+        Set `parallel` to False to parse the files in-process.
         """
         logger.debug(str((filepaths)))
         method = self._load_repodata
         return self._create_worker(method, filepaths, extra_data=extra_data,
-                                   metadata=metadata)
+                                   metadata=metadata, cache_dir=cache_dir,
+                                   parallel=parallel)
 
     def prepare_model_data(self, packages, linked, pip=None,
                            private_packages=None):
@@ -12,19 +12,26 @@ This also add some extra methods to the original conda-api.
 """
 
 # Standard library imports
-from collections import deque
+from collections import OrderedDict, deque, namedtuple
+from functools import partial
 from os.path import abspath, basename, expanduser, isdir, join
+import copy
+import hashlib
 import json
 import os
 import platform
 import re
 import sys
+import time
 
 # Third party imports
-from qtpy.QtCore import QByteArray, QObject, QProcess, QTimer, Signal
+from qtpy.QtCore import (QByteArray, QObject, QProcess, QProcessEnvironment,
+                         QTimer, Signal)
 import yaml
 
 # Local imports
+from conda_manager.api import conda_info
+from conda_manager.utils.condahelper import HELPER_SCRIPT
 from conda_manager.utils.findpip import PIP_LIST_SCRIPT
 from conda_manager.utils.logs import logger
 from conda_manager.utils.py3compat import is_text_string
@@ -92,12 +99,107 @@ def handle_qbytearray(obj, encoding):
     return to_text_string(obj, encoding=encoding)
 
 
+# --- Progress
+# -----------------------------------------------------------------------------
+# Progress notifications of a worker per second, at most
+PROGRESS_FPS = 30
+
+# Kinds of progress events
+PROGRESS_FETCH = 'fetch'
+PROGRESS_LINK = 'link'
+PROGRESS_OTHER = 'other'
+
+# `progress` and `maxval` are None if the record does not have them, the
+# record is the decoded JSON document (or text)
+ProgressEvent = namedtuple('ProgressEvent',
+                           ['kind', 'name', 'progress', 'maxval', 'record'])
+
+
+def progress_event(record):
+    """Return the ProgressEvent of a record of conda output."""
+    if not isinstance(record, dict):
+        return ProgressEvent(PROGRESS_OTHER, None, None, None, record)
+
+    if record.get('name'):
+        kind, name = PROGRESS_LINK, record['name']
+    elif record.get('fetch'):
+        kind, name = PROGRESS_FETCH, record['fetch']
+    else:
+        kind, name = PROGRESS_OTHER, None
+
+    return ProgressEvent(kind, name, record.get('progress'),
+                         record.get('maxval'), record)
+
+
+class StreamParser(object):
+    """
+    Incremental parser of the output of conda.
+
+    With `--json` conda writes its progress as JSON documents ending with a
+    NUL character, then the result. Chunks of output do not line up with
+    records, an incomplete record is kept until the rest of it arrives.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        """Incremental parser of the output of conda."""
+        self.encoding = encoding
+        self._chunks = []
+        self._record = []
+
+    def _decode(self, record):
+        """Return the JSON document, or text, of the bytes `record`."""
+        text = record.decode(self.encoding, 'replace').strip()
+        if not text:
+            return None
+
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text
+
+    def feed(self, data):
+        """Add the bytes `data` and return the records completed by it."""
+        if not data:
+            return []
+
+        self._chunks.append(data)
+        parts = data.split(b'\0')
+        self._record.append(parts[0])
+        if len(parts) == 1:
+            return []
+
+        records = [b''.join(self._record)] + parts[1:-1]
+        self._record = [parts[-1]]
+        records = [self._decode(record) for record in records]
+        return [record for record in records if record is not None]
+
+    def has_output(self):
+        """Return True if any output was fed."""
+        return bool(self._chunks)
+
+    def output(self):
+        """Return all the output fed, as text."""
+        return b''.join(self._chunks).decode(self.encoding, 'replace')
+
+
+def result_text(stdout):
+    """Return the result of the conda output `stdout`, its last record."""
+    if '\0' not in stdout:
+        return stdout
+
+    records = [record for record in stdout.split('\0') if record.strip()]
+    return records[-1] if records else ''
+
+
 class ProcessWorker(QObject):
     """Conda worker based on a QProcess for non blocking UI."""
 
     sig_finished = Signal(object, object, object)
     sig_partial = Signal(object, object, object)
 
+    # worker, ProgressEvent
+    sig_progress = Signal(object, object)
+
     def __init__(self, cmd_list, parse=False, pip=False, callback=None,
                  extra_kwargs=None):
         """Conda worker based on a QProcess for non blocking UI.
@@ -124,12 +226,20 @@ class ProcessWorker(QObject):
         self._callback = callback
         self._fired = False
         self._communicate_first = False
-        self._partial_stdout = None
+        self._parser = StreamParser(_CondaAPI.UTF8)
+        self._last_record = None
         self._extra_kwargs = extra_kwargs if extra_kwargs else {}
 
         self._timer = QTimer()
         self._process = QProcess()
 
+        # Progress is notified at most PROGRESS_FPS times per second, with
+        # the last record received
+        self._progress_timer = QTimer()
+        self._progress_timer.setSingleShot(True)
+        self._progress_timer.setInterval(1000 // PROGRESS_FPS)
+        self._progress_timer.timeout.connect(self._emit_progress)
+
         self._timer.setInterval(150)
 
         self._timer.timeout.connect(self._communicate)
@@ -138,21 +248,23 @@ class ProcessWorker(QObject):
 
     def _partial(self):
         """Callback for partial output."""
-        raw_stdout = self._process.readAllStandardOutput()
-        stdout = handle_qbytearray(raw_stdout, _CondaAPI.UTF8)
-
-        json_stdout = stdout.replace('\n\x00', '')
-        try:
-            json_stdout = json.loads(json_stdout)
-        except Exception:
-            json_stdout = stdout
-
-        if self._partial_stdout is None:
-            self._partial_stdout = stdout
-        else:
-            self._partial_stdout += stdout
-
-        self.sig_partial.emit(self, json_stdout, None)
+        self._feed(self._process.readAllStandardOutput().data())
+
+    def _feed(self, data):
+        """Keep the bytes `data` of output, and the last record completed."""
+        records = self._parser.feed(data)
+        if records:
+            self._last_record = records[-1]
+            if not self._progress_timer.isActive():
+                self._progress_timer.start()
+
+    def _emit_progress(self):
+        """Notify the last record of output received."""
+        self._progress_timer.stop()
+        if self._last_record is not None:
+            record, self._last_record = self._last_record, None
+            self.sig_partial.emit(self, record, None)
+            self.sig_progress.emit(self, progress_event(record))
 
     def _communicate(self):
         """Callback for communicate."""
@@ -167,14 +279,16 @@ class ProcessWorker(QObject):
         self._communicate_first = True
         self._process.waitForFinished()
 
-        if self._partial_stdout is None:
-            raw_stdout = self._process.readAllStandardOutput()
-            stdout = handle_qbytearray(raw_stdout, _CondaAPI.UTF8)
-        else:
-            stdout = self._partial_stdout
+        self._feed(self._process.readAllStandardOutput().data())
+        stdout = self._parser.output()
 
         raw_stderr = self._process.readAllStandardError()
         stderr = handle_qbytearray(raw_stderr, _CondaAPI.UTF8)
+        return self._finish(stdout, stderr)
+
+    def _finish(self, stdout, stderr):
+        """Process the output of the command and notify the result."""
+        self._emit_progress()
         result = [stdout.encode(_CondaAPI.UTF8), stderr.encode(_CondaAPI.UTF8)]
 
         # FIXME: Why does anaconda client print to stderr???
@@ -190,7 +304,7 @@ class ProcessWorker(QObject):
 
         if self._parse and stdout:
             try:
-                result = json.loads(stdout), result[-1]
+                result = json.loads(result_text(stdout)), result[-1]
             except Exception as error:
                 result = stdout, str(error)
 
@@ -236,8 +350,371 @@ class ProcessWorker(QObject):
                                      'per method call.')
 
 
+class CachedWorker(QObject):
+    """Worker finishing right away with the cached result of a call."""
+
+    sig_finished = Signal(object, object, object)
+    sig_partial = Signal(object, object, object)
+    sig_progress = Signal(object, object)
+
+    def __init__(self, cmd_list, result):
+        """Worker finishing right away with the cached result of a call."""
+        super(CachedWorker, self).__init__()
+        self._cmd_list = cmd_list
+        self._result = result
+        self._fired = False
+
+    def _emit(self):
+        """Notify the result, once."""
+        if not self._fired:
+            self._fired = True
+            self.sig_finished.emit(self, self._result[0], self._result[-1])
+
+    def communicate(self):
+        """Retrieve information."""
+        self._emit()
+        return self._result
+
+    def close(self):
+        """Nothing is running."""
+        pass
+
+    def is_finished(self):
+        """Return True if worker has finished processing."""
+        return self._fired
+
+    def start(self):
+        """Notify the result once the caller had a chance to connect."""
+        logger.debug('cached: ' + ' '.join(self._cmd_list))
+
+        # The lambda keeps the worker alive until it has notified
+        QTimer.singleShot(0, lambda w=self: w._emit())
+
+
+# --- Conda helper
+# -----------------------------------------------------------------------------
+# Helper processes exiting in a row without serving a request before falling
+# back to a new conda process per command
+HELPER_MAX_FAILURES = 3
+
+
+class CondaHelperWorker(ProcessWorker):
+    """Conda worker running its command in the persistent conda helper."""
+
+    def __init__(self, helper, cmd_list, args, parse=False, callback=None,
+                 extra_kwargs=None):
+        """
+        Conda worker running its command in the persistent conda helper.
+
+        `args` are the conda arguments of `cmd_list`. If the helper is not
+        available the worker runs `cmd_list` in a new process instead.
+        """
+        super(CondaHelperWorker, self).__init__(cmd_list, parse=parse,
+                                                callback=callback,
+                                                extra_kwargs=extra_kwargs)
+        self.request_id = None
+        self._helper = helper
+        self._args = args
+        self._stderr = []
+        self._spawned = False
+
+    def _helper_output(self, name, text):
+        """Callback for output of the command."""
+        if name == 'stdout':
+            self._feed(text.encode(_CondaAPI.UTF8))
+        else:
+            self._stderr.append(text)
+
+    def _helper_done(self, returncode, error):
+        """Callback for the end of the command."""
+        stderr = ''.join(self._stderr)
+        if error:
+            stderr += error
+        self._finish(self._parser.output(), stderr)
+
+    def _helper_failed(self, error):
+        """Callback for a command that could not complete."""
+        logger.error(str((' '.join(self._cmd_list), error)))
+        self._progress_timer.stop()
+        self._result = None, error
+        self._fired = True
+        self.sig_finished.emit(self, None, error)
+
+    def _spawn(self):
+        """Run the command in a new process instead of the helper."""
+        self._spawned = True
+        ProcessWorker.start(self)
+
+    def communicate(self):
+        """Retrieve information."""
+        if not self._spawned:
+            self._helper.wait(self)
+        if self._spawned:
+            return ProcessWorker.communicate(self)
+        return self._result
+
+    def close(self):
+        """Cancel the command."""
+        if self._spawned:
+            ProcessWorker.close(self)
+        elif not self._fired:
+            self._helper.cancel(self)
+
+    def is_finished(self):
+        """Return True if worker has finished processing."""
+        if self._spawned:
+            return ProcessWorker.is_finished(self)
+        return self._fired
+
+    def start(self):
+        """Send the command to the helper."""
+        if self._fired or self.request_id is not None:
+            raise CondaProcessWorker('A Conda ProcessWorker can only run once '
+                                     'per method call.')
+
+        logger.debug(str(' '.join(self._cmd_list)))
+        self._helper.request(self)
+
+
+class _CondaHelper(QObject):
+    """
+    Persistent conda process serving the commands of a root prefix.
+
+    Conda is imported once by the helper and each command is a JSON request
+    on its stdin, answered on its stdout (see `condahelper`). Commands run
+    one at a time, in order. A running command is cancelled by killing the
+    helper, which is started again for the next command, as it is when it
+    exits unexpectedly or when the packages of the root prefix (conda
+    itself among them) change. If conda can not be imported by the helper,
+    or the helper keeps exiting, commands run in a new conda process each.
+    """
+
+    def __init__(self, python, env=None):
+        """Persistent conda process serving the commands of a root prefix."""
+        super(_CondaHelper, self).__init__()
+        self.python = python
+        self._env = env
+        self._process = None
+        self._conda_meta_mtime = None
+        self._buffer = b''
+        self._queue = deque()
+        self._current = None
+        self._next_id = 1
+        self._ready = False
+        self._available = True
+        self._cancelled = False
+        self._failures = 0
+
+    def _start_process(self):
+        """Start the helper process."""
+        process = QProcess()
+        if self._env:
+            environment = QProcessEnvironment.systemEnvironment()
+            for key, value in self._env.items():
+                environment.insert(key, value)
+            process.setProcessEnvironment(environment)
+
+        # Command output is sent on stdout, anything else is discarded
+        process.setStandardErrorFile(QProcess.nullDevice())
+        process.readyReadStandardOutput.connect(self._read)
+        process.finished.connect(partial(self._process_finished, process))
+
+        self._buffer = b''
+        self._ready = False
+        self._cancelled = False
+        self._process = process
+        self._conda_meta_mtime = self._get_conda_meta_mtime()
+        process.start(self.python, ['-u', HELPER_SCRIPT])
+
+    def _get_conda_meta_mtime(self):
+        """Return the modification time of the root prefix conda-meta."""
+        root_prefix = os.path.dirname(self.python)
+        if sys.platform != 'win32':
+            root_prefix = os.path.dirname(root_prefix)
+        try:
+            return os.stat(join(root_prefix, 'conda-meta')).st_mtime
+        except OSError:
+            return None
+
+    def _read(self):
+        """Callback for output of the helper."""
+        if self._process is None:
+            return
+
+        self._buffer += self._process.readAllStandardOutput().data()
+        lines = self._buffer.split(b'\n')
+        self._buffer = lines.pop()
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line.decode(_CondaAPI.UTF8))
+            except ValueError as error:
+                logger.error(str((line, error)))
+                continue
+            self._handle(message)
+
+    def _handle(self, message):
+        """Handle a message of the helper."""
+        request_id = message.get('id')
+        if request_id is None:
+            if message.get('ready'):
+                self._ready = True
+                self._send_next()
+            elif message.get('error'):
+                # Conda can not be imported by the helper
+                logger.error(message['error'])
+                self._available = False
+                self._spawn_queued()
+            return
+
+        worker = self._current
+        if worker is None or worker.request_id != request_id:
+            return
+
+        for name in ['stdout', 'stderr']:
+            if name in message:
+                worker._helper_output(name, message[name])
+
+        if message.get('done'):
+            self._current = None
+            self._failures = 0
+            if self._get_conda_meta_mtime() != self._conda_meta_mtime:
+                # The conda imported by the helper may have been updated
+                self.shutdown()
+            worker._helper_done(message.get('returncode'),
+                                message.get('error'))
+            self._send_next()
+
+    def _send_next(self):
+        """Send the next queued command to the helper."""
+        if self._current is not None or not self._ready or not self._queue:
+            return
+
+        worker = self._queue.popleft()
+        self._current = worker
+        request = {'id': worker.request_id, 'args': worker._args}
+        self._process.write((json.dumps(request) + '\n').encode('utf-8'))
+
+    def _spawn_queued(self):
+        """Run the queued commands in new processes."""
+        queue, self._queue = self._queue, deque()
+        for worker in queue:
+            worker._spawn()
+
+    def _process_finished(self, process, *args):
+        """Callback for the end of the helper process."""
+        if process is not self._process:
+            return
+
+        # Killed to cancel a command is no failure of the helper
+        failed = not self._cancelled and (self._current is not None or
+                                          not self._ready)
+        worker = self._current
+        self._process = None
+        self._current = None
+        self._ready = False
+
+        if failed:
+            self._failures += 1
+        if worker is not None:
+            worker._helper_failed('The conda helper exited')
+
+        if self._failures >= HELPER_MAX_FAILURES:
+            logger.error('The conda helper keeps exiting, not used anymore')
+            self._available = False
+            self._spawn_queued()
+        elif self._queue:
+            self._start_process()
+
+    def request(self, worker):
+        """Queue the command of `worker`."""
+        worker.request_id = self._next_id
+        self._next_id += 1
+
+        if not self._available:
+            worker._spawn()
+            return
+
+        self._queue.append(worker)
+        if self._process is None:
+            self._start_process()
+        self._send_next()
+
+    def cancel(self, worker):
+        """Cancel the command of `worker`."""
+        if worker in self._queue:
+            self._queue.remove(worker)
+        elif worker is self._current:
+            # Commands can not be interrupted in process, the helper is
+            # started again for the next command
+            self._current = None
+            self._ready = False
+            self._cancelled = True
+            self._process.kill()
+        else:
+            return
+
+        worker._helper_failed('Cancelled')
+
+    def wait(self, worker):
+        """Block until the command of `worker` has finished."""
+        while not worker.is_finished() and not worker._spawned:
+            process = self._process
+            if process is None:
+                break
+            if not process.waitForReadyRead(100):
+                if process.state() == QProcess.NotRunning:
+                    self._process_finished(process)
+
+    def is_available(self):
+        """Return True unless commands run in new processes instead."""
+        return self._available
+
+    def is_busy(self):
+        """Return True if a command is running or queued in the helper."""
+        return self._current is not None or bool(self._queue)
+
+    def shutdown(self):
+        """Stop the helper process, it is started again when needed."""
+        if self._process is not None:
+            process = self._process
+            process.closeWriteChannel()
+            if not process.waitForFinished(1000):
+                process.kill()
+                process.waitForFinished(1000)
+            self._process_finished(process)
+
+
+CONDA_HELPERS = {}
+
+
+def CondaHelper(python, env=None):
+    """Persistent conda helper process for the root prefix of `python`."""
+    if python not in CONDA_HELPERS:
+        CONDA_HELPERS[python] = _CondaHelper(python, env=env)
+
+    return CONDA_HELPERS[python]
+
+
 # --- API
 # -----------------------------------------------------------------------------
+# Read-only calls (info, search, dry runs, pip list) running at the same time
+MAX_READ_ONLY_CALLS = 4
+
+# Lock of the mutating calls that must run alone, on all the other locks
+ALL_LOCKS = '*'
+
+# Wait times kept for the queue statistics
+QUEUE_STATS_SIZE = 100
+
+# Seconds between checks of the files invalidating the `conda info` snapshot
+INFO_CHECK_INTERVAL = 1.0
+
+# Dependency solves (dry runs) kept in the solve cache
+SOLVE_CACHE_SIZE = 64
+
+
 class _CondaAPI(QObject):
     """Conda API to connect to conda in a non blocking way via QProcess."""
 
@@ -246,6 +723,9 @@ class _CondaAPI(QObject):
     DEFAULT_CHANNELS = ['https://repo.continuum.io/pkgs/pro',
                         'https://repo.continuum.io/pkgs/free']
 
+    # The `conda info` snapshot was refreshed
+    sig_info_updated = Signal(object)
+
     def __init__(self, parent=None):
         """Conda API to connect to conda in a non blocking way via QProcess."""
         super(_CondaAPI, self).__init__()
@@ -254,11 +734,24 @@ class _CondaAPI(QObject):
         self._timer = QTimer()
         self._current_worker = None
         self._workers = []
+        self._running = []
+        self._wait_times = deque(maxlen=QUEUE_STATS_SIZE)
+        self._use_helper = False
+        self.max_read_only_calls = MAX_READ_ONLY_CALLS
+
+        # Dependency solves, cached and running, see `dependencies`
+        self._solve_cache = OrderedDict()
+        self._solve_states = {}
+        self._solves = {}
 
         self._timer.setInterval(1000)
         self._timer.timeout.connect(self._clean)
 
         self.ROOT_PREFIX = None
+        self._info = {}
+        self._info_checked = 0
+        self._info_stamps = None
+        self._info_worker = None
         self.set_root_prefix()
 
         # Set config files path
@@ -275,12 +768,133 @@ class _CondaAPI(QObject):
             self._current_worker = None
             self._timer.stop()
 
+    def _env_prefix(self, name):
+        """
+        Return the prefix of the environment `name`, as conda finds it.
+
+        That is in the first of the `envs_dirs` having it, or in the `envs`
+        folder of the root prefix if none has it (yet).
+        """
+        for envs_dir in self.get_envs_dirs():
+            prefix = join(envs_dir, name)
+            if isdir(join(prefix, 'conda-meta')):
+                return prefix
+        return join(self.ROOT_PREFIX, 'envs', name)
+
+    def _lock_key(self, name=None, prefix=None):
+        """Return the key locked by calls on environment `name` or `prefix`."""
+        if name and name != 'root':
+            prefix = self._env_prefix(name)
+        elif not prefix:
+            # The root environment, with the package cache
+            prefix = self.ROOT_PREFIX
+        return os.path.normcase(abspath(prefix))
+
+    def _queue_worker(self, worker, lock=None, mutating=False):
+        """
+        Queue `worker` and start it as soon as possible.
+
+        Read-only calls run at the same time, up to `max_read_only_calls`.
+        A `mutating` call runs alone on its `lock`, the key of the
+        environment (or config file) it changes, and calls on the same
+        `lock` run in the order they were made. A mutating call on
+        `ALL_LOCKS` waits for all the mutating calls made before it, and no
+        other mutating call starts until it has finished.
+        """
+        worker._lock = lock
+        worker._mutating = mutating
+        worker._queued_time = time.time()
+        worker.sig_finished.connect(self._worker_finished)
+        self._queue.append(worker)
+        self._start()
+
+        return worker
+
+    def _worker_finished(self, worker, output, error):
+        """Callback for a finished worker, start the next queued ones."""
+        if worker in self._running:
+            self._running.remove(worker)
+        self._start()
+
     def _start(self):
-        if len(self._queue) == 1:
-            self._current_worker = self._queue.popleft()
-            self._workers.append(self._current_worker)
-            self._current_worker.start()
-            self._timer.start()
+        """Start the queued workers that can run, in order."""
+        read_only = len([w for w in self._running if not w._mutating])
+        locked = dict((w._lock, w._mutating) for w in self._running
+                      if w._lock is not None)
+        waiting = {}
+
+        for worker in list(self._queue):
+            lock = worker._lock
+            if worker._fired:
+                # Forced with communicate before it could start
+                self._queue.remove(worker)
+                continue
+
+            if worker._mutating and lock == ALL_LOCKS:
+                can_start = (not any(locked.values()) and
+                             not any(waiting.values()))
+            elif worker._mutating:
+                can_start = (lock not in locked and lock not in waiting and
+                             ALL_LOCKS not in locked and
+                             ALL_LOCKS not in waiting)
+            else:
+                can_start = (read_only < self.max_read_only_calls and
+                             not locked.get(lock) and not waiting.get(lock))
+
+            if not can_start:
+                if lock is not None:
+                    waiting[lock] = waiting.get(lock) or worker._mutating
+                continue
+
+            self._queue.remove(worker)
+            self._run(worker)
+            if worker._mutating:
+                locked[lock] = True
+            else:
+                read_only += 1
+                if lock is not None:
+                    locked.setdefault(lock, False)
+
+    def _run(self, worker):
+        """Start `worker` and record how long it was queued."""
+        wait_time = time.time() - worker._queued_time
+        self._wait_times.append(wait_time)
+        if wait_time > 1:
+            logger.debug('{0} waited {1:.2f}s, {2} queued'.format(
+                ' '.join(worker._cmd_list), wait_time, len(self._queue)))
+
+        self._current_worker = worker
+        self._running.append(worker)
+        self._workers.append(worker)
+
+        # The helper runs one command at a time, a read-only call does not
+        # wait for it
+        if (isinstance(worker, CondaHelperWorker) and
+                not worker._mutating and worker._helper.is_busy()):
+            worker._spawn()
+        else:
+            worker.start()
+        self._timer.start()
+
+    def queue_stats(self):
+        """
+        Return the depth and wait times of the queue of calls.
+
+        Wait times, in seconds, are those of the last calls started.
+        """
+        wait_times = list(self._wait_times)
+        return {
+            'queued': len(self._queue),
+            'running': len(self._running),
+            'running_mutating': len([w for w in self._running
+                                     if w._mutating]),
+            'oldest_wait': max([time.time() - w._queued_time
+                                for w in self._queue] or [0]),
+            'last_wait': wait_times[-1] if wait_times else 0,
+            'mean_wait': (sum(wait_times) / len(wait_times)
+                          if wait_times else 0),
+            'max_wait': max(wait_times or [0]),
+        }
 
     def is_active(self):
         """Check if a worker is still active."""
@@ -291,15 +905,38 @@ class _CondaAPI(QObject):
         for worker in self._workers:
             worker.close()
 
+    def cancel(self, worker):
+        """
+        Cancel the call of `worker`, queued or running.
+
+        A queued call finishes right away with a 'Cancelled' error.
+        """
+        if worker in self._queue:
+            self._queue.remove(worker)
+            worker._fired = True
+            worker.sig_finished.emit(worker, None, 'Cancelled')
+        elif not worker.is_finished():
+            worker.close()
+
+    def set_conda_helper(self, value):
+        """
+        Run conda commands in a persistent helper process of the root prefix.
+
+        Conda is imported once instead of on every command. Disabled by
+        default.
+        """
+        self._use_helper = bool(value)
+
     # --- Conda api
     # -------------------------------------------------------------------------
     def _call_conda(self, extra_args, abspath=True, parse=False,
-                    callback=None):
+                    callback=None, lock=None, mutating=False):
         """
         Call conda with the list of extra arguments, and return the worker.
 
         The result can be force by calling worker.communicate(), which returns
-        the tuple (stdout, stderr).
+        the tuple (stdout, stderr). A `mutating` call changes the environment
+        or file of `lock` (see `_queue_worker`).
         """
         if abspath:
             if sys.platform == 'win32':
@@ -316,17 +953,22 @@ class _CondaAPI(QObject):
 
         cmd_list.extend(extra_args)
 
-        process_worker = ProcessWorker(cmd_list, parse=parse,
-                                       callback=callback)
-        process_worker.sig_finished.connect(self._start)
-        self._queue.append(process_worker)
-        self._start()
+        if abspath and self._use_helper:
+            process_worker = CondaHelperWorker(CondaHelper(python), cmd_list,
+                                               extra_args, parse=parse,
+                                               callback=callback)
+        else:
+            process_worker = ProcessWorker(cmd_list, parse=parse,
+                                           callback=callback)
 
-        return process_worker
+        return self._queue_worker(process_worker, lock=lock,
+                                  mutating=mutating)
 
-    def _call_and_parse(self, extra_args, abspath=True, callback=None):
+    def _call_and_parse(self, extra_args, abspath=True, callback=None,
+                        lock=None, mutating=False):
         return self._call_conda(extra_args, abspath=abspath, parse=True,
-                                callback=callback)
+                                callback=callback, lock=lock,
+                                mutating=mutating)
 
     @staticmethod
     def _setup_install_commands_from_kwargs(kwargs, keys=tuple()):
@@ -358,15 +1000,96 @@ class _CondaAPI(QObject):
         Set the prefix to the root environment (default is /opt/anaconda).
 
         This function should only be called once (right after importing
-        conda_api).
+        conda_api). Without `prefix` the `conda info` snapshot is used, or
+        the conda found on the environment while `conda info` runs in the
+        background. Conda is only waited for if neither is found.
         """
         if prefix:
             self.ROOT_PREFIX = prefix
+            return
+
+        info = conda_info.load_snapshot()
+        if info is not None:
+            self.ROOT_PREFIX = info['root_prefix']
+            self._info = info
+            self._info_checked = time.time()
+            self._info_stamps = self._get_info_stamps()
+            return
+
+        self.ROOT_PREFIX = conda_info.find_root_prefix()
+        if self.ROOT_PREFIX is not None:
+            self.refresh_info()
         else:
             # Find some conda instance, and then use info to get 'root_prefix'
             worker = self._call_and_parse(['info', '--json'], abspath=False)
-            info = worker.communicate()[0]
-            self.ROOT_PREFIX = info['root_prefix']
+            self._set_info(worker.communicate()[0])
+
+    def _get_info_stamps(self):
+        """Return the stamps of the files invalidating the info snapshot."""
+        return conda_info.stamps(conda_info.watched_paths(self.ROOT_PREFIX))
+
+    def _set_info(self, info, saved_stamps=None):
+        """Keep and save `info`, the output of `conda info --json`."""
+        if not isinstance(info, dict) or 'root_prefix' not in info:
+            logger.error(str(('invalid conda info', info)))
+            return
+
+        self._info = conda_info.save_snapshot(info, saved_stamps=saved_stamps)
+        if self._info['root_prefix'] != self.ROOT_PREFIX:
+            self.ROOT_PREFIX = self._info['root_prefix']
+            self.sys_rc_path = join(self.ROOT_PREFIX, '.condarc')
+        self._info_stamps = self._get_info_stamps()
+        self._info_checked = time.time()
+        self.sig_info_updated.emit(self._info)
+
+    def _info_finished(self, worker, output, error):
+        """Callback for the `conda info` run by `refresh_info`."""
+        if worker is self._info_worker:
+            self._info_worker = None
+        self._set_info(output, saved_stamps=worker._info_stamps)
+
+    def refresh_info(self):
+        """
+        Run `conda info` to refresh the snapshot, and return the worker.
+
+        `sig_info_updated` is emitted with the new info.
+        """
+        if self._info_worker is None:
+            # Taken before running conda, changes made meanwhile invalidate
+            # the snapshot
+            stamps = self._get_info_stamps()
+            worker = self.info()
+            worker._info_stamps = stamps
+            worker.sig_finished.connect(self._info_finished)
+            self._info_worker = worker
+        return self._info_worker
+
+    def get_info(self):
+        """
+        Return the `conda info` snapshot, without waiting for conda.
+
+        It has the `root_prefix`, `default_prefix`, `envs_dirs`, `pkgs_dirs`,
+        `platform` and `conda_version` of the output of `conda info`, or is
+        empty if conda has not answered yet. When the condarc files or the
+        root environment change it is refreshed in the background.
+        """
+        now = time.time()
+        if now - self._info_checked > INFO_CHECK_INTERVAL:
+            self._info_checked = now
+            if (self._info_stamps is None or
+                    self._get_info_stamps() != self._info_stamps):
+                self.refresh_info()
+        return self._info
+
+    def get_envs_dirs(self):
+        """Return the directories where named environments are created."""
+        envs_dirs = self.get_info().get('envs_dirs')
+        if envs_dirs is None:
+            # No snapshot yet
+            output = self.info().communicate()[0]
+            if isinstance(output, dict):
+                envs_dirs = output.get('envs_dirs')
+        return envs_dirs or [join(self.ROOT_PREFIX, 'envs')]
 
     def get_conda_version(self):
         """Return the version of conda being used (invoked) as a string."""
@@ -493,7 +1216,8 @@ class _CondaAPI(QObject):
         """
         logger.debug(str((name, yamlfile)))
         cmd_list = ['env', 'create', '-n', name, '-f', yamlfile, '--json']
-        return self._call_and_parse(cmd_list)
+        return self._call_and_parse(cmd_list, lock=self._lock_key(name=name),
+                                    mutating=True)
 
     def create(self, name=None, prefix=None, pkgs=None, channels=None):
         """Create an environment with a specified set of packages."""
@@ -508,8 +1232,7 @@ class _CondaAPI(QObject):
         cmd_list = ['create', '--yes', '--json', '--mkdir']
         if name:
             ref = name
-            search = [os.path.join(d, name) for d in
-                      self.info().communicate()[0]['envs_dirs']]
+            search = [os.path.join(d, name) for d in self.get_envs_dirs()]
             cmd_list.extend(['--name', name])
         elif prefix:
             ref = prefix
@@ -537,7 +1260,9 @@ class _CondaAPI(QObject):
                 cmd_list.extend(['--channel'])
                 cmd_list.extend([channel])
 
-        return self._call_and_parse(cmd_list)
+        return self._call_and_parse(cmd_list,
+                                    lock=self._lock_key(name, prefix),
+                                    mutating=True)
 
     def parse_token_channel(self, channel, token):
         """
@@ -598,7 +1323,9 @@ class _CondaAPI(QObject):
         if not dep:
             cmd_list.extend(['--no-deps'])
 
-        return self._call_and_parse(cmd_list)
+        return self._call_and_parse(cmd_list,
+                                    lock=self._lock_key(name, prefix),
+                                    mutating=True)
 
     def update(self, *pkgs, **kwargs):
         """Update package(s) (in an environment) by name."""
@@ -608,6 +1335,8 @@ class _CondaAPI(QObject):
             raise TypeError("Must specify at least one package to update, or "
                             "all=True.")
 
+        lock = self._lock_key(kwargs.get('env'), kwargs.get('prefix'))
+        mutating = not kwargs.get('dry_run')
         cmd_list.extend(
             self._setup_install_commands_from_kwargs(
                 kwargs,
@@ -618,7 +1347,8 @@ class _CondaAPI(QObject):
         cmd_list.extend(pkgs)
 
         return self._call_and_parse(cmd_list, abspath=kwargs.get('abspath',
-                                                                 True))
+                                                                 True),
+                                    lock=lock, mutating=mutating)
 
     def remove(self, name=None, prefix=None, pkgs=None, all_=False):
         """
@@ -650,7 +1380,9 @@ class _CondaAPI(QObject):
         else:
             cmd_list.extend(pkgs)
 
-        return self._call_and_parse(cmd_list)
+        return self._call_and_parse(cmd_list,
+                                    lock=self._lock_key(name, prefix),
+                                    mutating=True)
 
     def remove_environment(self, name=None, path=None, **kwargs):
         """
@@ -684,7 +1416,9 @@ class _CondaAPI(QObject):
                  'no_default_packages')))
 
         return self._call_and_parse(cmd_list, abspath=kwargs.get('abspath',
-                                                                 True))
+                                                                 True),
+                                    lock=self._lock_key(name, prefix),
+                                    mutating=not kwargs.get('dry_run'))
 
     # FIXME:
 #    def process(self, name=None, prefix=None, cmd=None):
@@ -736,6 +1470,16 @@ class _CondaAPI(QObject):
 
         return cmd_list
 
+    def _config_lock_key(self, kwargs):
+        """Return the key locked by config calls with `kwargs`."""
+        if 'file' in kwargs:
+            path = kwargs['file']
+        elif 'system' in kwargs:
+            path = self.sys_rc_path
+        else:
+            path = self.user_rc_path
+        return os.path.normcase(abspath(path))
+
 #    def config_path(self, **kwargs):
 #        """Get the path to the config file."""
 #        cmd_list = ['config', '--get']
@@ -786,7 +1530,8 @@ class _CondaAPI(QObject):
         return self._call_and_parse(
             cmd_list,
             abspath=kwargs.get('abspath', True),
-            callback=lambda o, e: o.get('warnings', []))
+            callback=lambda o, e: o.get('warnings', []),
+            lock=self._config_lock_key(kwargs), mutating=True)
 
     def config_remove(self, key, value, **kwargs):
         """
@@ -800,7 +1545,8 @@ class _CondaAPI(QObject):
         return self._call_and_parse(
             cmd_list,
             abspath=kwargs.get('abspath', True),
-            callback=lambda o, e: o.get('warnings', []))
+            callback=lambda o, e: o.get('warnings', []),
+            lock=self._config_lock_key(kwargs), mutating=True)
 
 #    def config_delete(self, key, **kwargs):
 #        """
@@ -829,9 +1575,65 @@ class _CondaAPI(QObject):
 
     # --- Additional methods
     # -----------------------------------------------------------------------------
+    def _prefix_state(self, prefix):
+        """Return a hash of the conda-meta files of `prefix`, or None."""
+        try:
+            names = sorted(os.listdir(join(prefix, 'conda-meta')))
+        except OSError:
+            return None
+        return hashlib.sha1('\n'.join(names).encode('utf-8')).hexdigest()
+
+    def _solve_key(self, name, prefix, pkgs, channels, dep):
+        """
+        Return the key of a dependency solve in the solve cache, or None.
+
+        The key includes the state of the environment, and the solves of an
+        environment are dropped when its packages change.
+        """
+        if not (name or prefix):
+            # The current environment, whatever that is
+            return None
+
+        prefix = self._lock_key(name, prefix)
+        state = self._prefix_state(prefix)
+        if state is None:
+            return None
+
+        if self._solve_states.get(prefix) != state:
+            self._solve_states[prefix] = state
+            for key in list(self._solve_cache):
+                if key[0] == prefix:
+                    self._solve_cache.pop(key)
+
+        return (prefix, state, tuple(pkgs), tuple(channels or ()), bool(dep))
+
+    def _solve_finished(self, key, worker, output, error):
+        """Callback for a dependency solve, cache its result."""
+        if self._solves.get(key) is worker:
+            self._solves.pop(key)
+
+        # Cancelled or failed solves are not kept
+        if error or not isinstance(output, dict) or 'error' in output:
+            return
+
+        self._solve_cache[key] = (output, error)
+        while len(self._solve_cache) > SOLVE_CACHE_SIZE:
+            self._solve_cache.popitem(last=False)
+
+    def clear_solve_cache(self):
+        """Forget the cached dependency solves."""
+        self._solve_cache.clear()
+        self._solve_states.clear()
+
     def dependencies(self, name=None, prefix=None, pkgs=None, channels=None,
                      dep=True):
-        """Get dependenciy list for packages to be installed in an env."""
+        """
+        Get dependenciy list for packages to be installed in an env.
+
+        Solves are cached until the packages of the environment change, a
+        cached solve is returned by a worker finishing right away, and the
+        worker of a solve already running is shared.
+        """
         if not pkgs or not isinstance(pkgs, (list, tuple)):
             raise TypeError('must specify a list of one or more packages to '
                             'install into existing environment')
@@ -858,7 +1660,23 @@ class _CondaAPI(QObject):
                 cmd_list.extend(['--channel'])
                 cmd_list.extend([channel])
 
-        return self._call_and_parse(cmd_list)
+        key = self._solve_key(name, prefix, pkgs, channels, dep)
+        if key in self._solve_cache:
+            result = self._solve_cache.pop(key)
+            self._solve_cache[key] = result
+            worker = CachedWorker(cmd_list, copy.deepcopy(result))
+            worker.start()
+            return worker
+        elif key in self._solves:
+            return self._solves[key]
+
+        # A dry run, it does not wait for calls on other environments
+        worker = self._call_and_parse(cmd_list,
+                                      lock=self._lock_key(name, prefix))
+        if key is not None:
+            self._solves[key] = worker
+            worker.sig_finished.connect(partial(self._solve_finished, key))
+        return worker
 
     def environment_exists(self, name=None, prefix=None, abspath=True,
                            log=True):
@@ -884,7 +1702,11 @@ class _CondaAPI(QObject):
     def clear_lock(self, abspath=True):
         """Clean any conda lock in the system."""
         cmd_list = ['clean', '--lock', '--json']
-        return self._call_and_parse(cmd_list, abspath=abspath)
+
+        # Lock files are in the package caches and environments, no other
+        # conda command may change them in the meantime
+        return self._call_and_parse(cmd_list, abspath=abspath,
+                                    lock=ALL_LOCKS, mutating=True)
 
     def package_version(self, prefix=None, name=None, pkg=None, build=False):
         """Get installed package version in a given env."""
@@ -987,17 +1809,16 @@ class _CondaAPI(QObject):
     # --- Pip commands
     # -------------------------------------------------------------------------
     def _call_pip(self, name=None, prefix=None, extra_args=None,
-                  callback=None):
+                  callback=None, mutating=False):
         """Call pip in QProcess worker."""
         cmd_list = self._pip_cmd(name=name, prefix=prefix)
         cmd_list.extend(extra_args)
 
         process_worker = ProcessWorker(cmd_list, pip=True, callback=callback)
-        process_worker.sig_finished.connect(self._start)
-        self._queue.append(process_worker)
-        self._start()
 
-        return process_worker
+        return self._queue_worker(process_worker,
+                                  lock=self._lock_key(name, prefix),
+                                  mutating=mutating)
 
     def _pip_cmd(self, name=None, prefix=None):
         """Get pip location based on environment `name` or `prefix`."""
@@ -1033,11 +1854,9 @@ class _CondaAPI(QObject):
         process_worker = ProcessWorker(cmd_list, pip=True, parse=True,
                                        callback=self._pip_list,
                                        extra_kwargs={'prefix': prefix})
-        process_worker.sig_finished.connect(self._start)
-        self._queue.append(process_worker)
-        self._start()
 
-        return process_worker
+        return self._queue_worker(process_worker,
+                                  lock=self._lock_key(prefix=prefix))
 
     def _pip_list(self, stdout, stderr, prefix=None):
         """Callback for `pip_list`."""
@@ -1076,7 +1895,8 @@ class _CondaAPI(QObject):
 
         extra_args = ['uninstall', '--yes', pkg]
 
-        return self._call_pip(name=name, prefix=prefix, extra_args=extra_args)
+        return self._call_pip(name=name, prefix=prefix, extra_args=extra_args,
+                              mutating=True)
 
     def pip_search(self, search_string=None):
         """Search for pip packages in PyPI matching `search_string`."""
@@ -1150,5 +1970,188 @@ def test():  # pragma : no cover
     app.exec_()
 
 
+def _write_fake_conda(folder, import_delay=1.0):  # pragma : no cover
+    """
+    Write a fake `conda` package to `folder`, and a conda script using it.
+
+    Importing it takes `import_delay` seconds, and its commands print their
+    arguments, and `folder` as root prefix, as JSON. The `sleep` command
+    takes the given seconds, commands changing environments take one second
+    and the `crash` command exits the process. `folder` is laid out like a
+    root prefix, with `bin/python` and `bin/conda`.
+    """
+    os.makedirs(join(folder, 'conda', 'cli'))
+    with open(join(folder, 'conda', '__init__.py'), 'w') as f:
+        f.write('import time\ntime.sleep({0})\n'.format(import_delay))
+    with open(join(folder, 'conda', 'cli', '__init__.py'), 'w') as f:
+        f.write('')
+    with open(join(folder, 'conda', 'cli', 'python_api.py'), 'w') as f:
+        f.write('''import json, os, sys, time
+
+
+def run_command(command, *arguments, **kwargs):
+    stdout = kwargs.get('stdout') or sys.stdout
+    if command == 'sleep':
+        time.sleep(float(arguments[0]))
+    elif command in ['create', 'install', 'remove', 'update']:
+        time.sleep(1)
+    elif command == 'crash':
+        os._exit(1)
+    stdout.write(json.dumps({'command': command,
+                             'arguments': list(arguments),
+                             'root_prefix': %r}))
+    return '', '', 0
+''' % folder)
+
+    os.makedirs(join(folder, 'bin'))
+    os.symlink(sys.executable, join(folder, 'bin', 'python'))
+    script = join(folder, 'bin', 'conda')
+    with open(script, 'w') as f:
+        f.write('''#!{0}
+import sys
+sys.path.insert(0, {1!r})
+from conda.cli.python_api import run_command
+run_command(sys.argv[1], *sys.argv[2:])
+'''.format(sys.executable, folder))
+    os.chmod(script, 0o755)
+    return script
+
+
+def test_helper(n_calls=5):  # pragma : no cover
+    """Compare the conda helper against a process per call, on fake conda."""
+    import tempfile
+    import time
+
+    from conda_manager.utils.qthelpers import qapplication
+
+    app = qapplication()
+    folder = tempfile.mkdtemp()
+    script = _write_fake_conda(folder)
+    helper = _CondaHelper(sys.executable, env={'PYTHONPATH': folder})
+
+    def call(args, use_helper=True, start=True):
+        cmd_list = [sys.executable, script] + args
+        if use_helper:
+            worker = CondaHelperWorker(helper, cmd_list, args, parse=True)
+        else:
+            worker = ProcessWorker(cmd_list, parse=True)
+        if start:
+            worker.start()
+        return worker
+
+    t0 = time.time()
+    for i in range(n_calls):
+        call(['info', '--json'], use_helper=False).communicate()
+    print('{0} processes: {1:.2f}s'.format(n_calls, time.time() - t0))
+
+    t0 = time.time()
+    for i in range(n_calls):
+        output = call(['info', '--json']).communicate()
+    print('helper: {0:.2f}s'.format(time.time() - t0), output)
+
+    # A running command is cancelled, the next one is served by a new helper
+    t0 = time.time()
+    slow = call(['sleep', '10'])
+    queued = call(['list', '--json'])
+    while time.time() - t0 < 0.5:
+        app.processEvents()
+    slow.close()
+    print('cancelled', slow.communicate(), queued.communicate(),
+          '{0:.2f}s'.format(time.time() - t0))
+
+    # Cancelling commands does not make the helper look broken
+    for i in range(HELPER_MAX_FAILURES):
+        slow = call(['sleep', '10'])
+        while helper._current is not slow:
+            app.processEvents()
+        slow.close()
+        slow.communicate()
+    print('cancelled {0} times'.format(HELPER_MAX_FAILURES),
+          call(['list', '--json']).communicate(), helper.is_available())
+
+    print('crashed', call(['crash']).communicate(),
+          call(['list', '--json']).communicate())
+    helper.shutdown()
+
+    # Conda can not be imported, commands run in new processes
+    helper = _CondaHelper(sys.executable)
+    print('fallback', call(['info', '--json']).communicate(),
+          helper.is_available())
+    app.quit()
+
+
+def test_queue():  # pragma : no cover
+    """Run read-only and mutating calls on fake conda, print their timings."""
+    import tempfile
+
+    from conda_manager.utils.qthelpers import qapplication
+
+    app = qapplication()
+    folder = tempfile.mkdtemp()
+    _write_fake_conda(folder, import_delay=0)
+    os.environ['PATH'] = join(folder, 'bin') + os.pathsep + os.environ['PATH']
+    api = _CondaAPI()
+    t0 = time.time()
+
+    def finished(label):
+        def callback(worker, output, error):
+            print('{0}: {1:.2f}s'.format(label, time.time() - t0))
+            if not api._running and not api._queue:
+                print(api.queue_stats())
+                app.quit()
+        return callback
+
+    # The dry run does not block the calls after it, the installs in the
+    # same environment run one after the other
+    calls = [
+        ('dry run', api.dependencies(name='env', pkgs=['numpy'])),
+        ('install env', api.install(name='env', pkgs=['numpy'])),
+        ('install env again', api.install(name='env', pkgs=['scipy'])),
+        ('install other', api.install(name='other', pkgs=['numpy'])),
+        ('info', api.info()),
+        ('clean lock', api.clear_lock()),
+        ('search', api.search('numpy')),
+    ]
+    for label, worker in calls:
+        worker.sig_finished.connect(finished(label))
+    app.exec_()
+
+
+def test_progress(n_records=2000, delay=0.001):  # pragma : no cover
+    """Count the progress notifications of a command writing progress."""
+    import tempfile
+
+    from conda_manager.utils.qthelpers import qapplication
+
+    app = qapplication()
+    fd, script = tempfile.mkstemp(suffix='.py')
+    with os.fdopen(fd, 'w') as f:
+        f.write('''import json, sys, time
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+for i in range({0}):
+    record = json.dumps({{'fetch': 'pkg', 'finished': False, 'maxval': {0},
+                         'progress': i}}).encode('utf-8') + b'\\n\\0'
+    # Records split across writes
+    out.write(record[:10])
+    out.flush()
+    out.write(record[10:])
+    out.flush()
+    time.sleep({1})
+out.write(json.dumps({{'success': True}}).encode('utf-8'))
+'''.format(n_records, delay))
+
+    events = []
+    worker = ProcessWorker([sys.executable, script], parse=True)
+    worker.sig_progress.connect(lambda w, event: events.append(event))
+    worker.sig_finished.connect(lambda w, output, error: app.quit())
+    t0 = time.time()
+    worker.start()
+    app.exec_()
+    print('{0} records, {1} notifications in {2:.2f}s, result {3}'.format(
+        n_records, len(events), time.time() - t0, worker._result[0]))
+    print(events[-1])
+    os.remove(script)
+
+
 if __name__ == '__main__':  # pragma : no cover
     test()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Snapshot of `conda info`, kept on disk between sessions.
+
+`conda info --json` takes seconds, but what the manager needs from it (the
+root prefix, envs and package dirs, platform and conda version) only
+changes with the conda configuration files or the packages of the root
+environment. The snapshot keeps the modification times of those, the
+conda executable found and the environment variables changing the
+configuration, and is only used while none of them has changed.
+
+When there is no valid snapshot, the root prefix is found from the
+environment (`CONDA_EXE` or `conda` on the PATH) without running conda.
+"""
+
+# Standard library imports
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Local imports
+from conda_manager.api import http_cache
+from conda_manager.utils import get_conf_path
+from conda_manager.utils.logs import logger
+
+
+SNAPSHOT_PATH = get_conf_path('conda_info.json')
+SNAPSHOT_VERSION = 2
+
+# Keys of the output of `conda info --json` kept in the snapshot
+INFO_KEYS = ('root_prefix', 'default_prefix', 'envs_dirs', 'pkgs_dirs',
+             'platform', 'conda_version')
+
+# Environment variables changing the configuration of conda
+ENV_VARS = ('CONDARC', 'CONDA_ENVS_PATH', 'CONDA_PKGS_DIRS')
+
+
+def rc_paths(root_prefix):
+    """
+    Return the user and system condarc paths of `root_prefix`.
+
+    The file given by the `CONDARC` environment variable comes first.
+    """
+    paths = [os.path.abspath(os.path.expanduser('~/.condarc')),
+             os.path.join(root_prefix, '.condarc')]
+    if os.environ.get('CONDARC'):
+        paths.insert(0, os.path.abspath(os.environ['CONDARC']))
+    return paths
+
+
+def watched_paths(root_prefix):
+    """Return the paths that invalidate the snapshot when they change."""
+    return rc_paths(root_prefix) + [os.path.join(root_prefix, 'conda-meta')]
+
+
+def stamps(paths):
+    """Return the modification time of `paths`, None if missing."""
+    result = {}
+    for path in paths:
+        try:
+            result[path] = os.stat(path).st_mtime
+        except OSError:
+            result[path] = None
+    return result
+
+
+def environment():
+    """Return the conda executable and the conda environment variables."""
+    return {'conda': find_conda(),
+            'env': dict((name, os.environ.get(name)) for name in ENV_VARS)}
+
+
+def is_valid(snapshot):
+    """
+    Return True if what `snapshot` depends on did not change.
+
+    That is the files it depends on, the conda executable found and the
+    conda environment variables.
+    """
+    try:
+        root_prefix = snapshot['info']['root_prefix']
+        saved_stamps = snapshot['stamps']
+    except (KeyError, TypeError):
+        return False
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        return False
+
+    if snapshot.get('environment') != environment():
+        return False
+
+    paths = watched_paths(root_prefix)
+    return (set(saved_stamps) == set(paths) and
+            stamps(paths) == saved_stamps)
+
+
+def load_snapshot(path=None):
+    """Return the info of the snapshot at `path`, None if invalid."""
+    path = path or SNAPSHOT_PATH
+    if not os.path.isfile(path):
+        return None
+
+    try:
+        with open(path, 'r') as f:
+            snapshot = json.load(f)
+    except Exception as error:
+        logger.error(str((path, error)))
+        return None
+
+    if is_valid(snapshot):
+        return snapshot['info']
+    return None
+
+
+def save_snapshot(info, path=None, saved_stamps=None):
+    """
+    Write `info`, the output of `conda info --json`, to `path`.
+
+    `saved_stamps` are the stamps of the watched paths taken before running
+    conda, so changes made while it ran invalidate the snapshot. Returns the
+    info kept.
+    """
+    path = path or SNAPSHOT_PATH
+    info = dict((key, info[key]) for key in INFO_KEYS if key in info)
+    paths = watched_paths(info['root_prefix'])
+    if saved_stamps is None or set(saved_stamps) != set(paths):
+        saved_stamps = stamps(paths)
+    snapshot = {'version': SNAPSHOT_VERSION,
+                'time': time.time(),
+                'info': info,
+                'environment': environment(),
+                'stamps': saved_stamps}
+
+    folder = os.path.dirname(path)
+    try:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        http_cache.replace_file(temp_path, path)
+    except (IOError, OSError) as error:
+        logger.error(str((path, error)))
+
+    return info
+
+
+def _which(name):
+    """Return the path of the executable `name` on the PATH, or None."""
+    extensions = ['']
+    if sys.platform == 'win32':
+        extensions += os.environ.get('PATHEXT', '.EXE;.BAT').lower().split(';')
+
+    for folder in os.environ.get('PATH', '').split(os.pathsep):
+        for extension in extensions:
+            path = os.path.join(folder, name + extension)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+    return None
+
+
+def find_conda():
+    """
+    Return the path of the conda executable on the environment, or None.
+
+    Uses `CONDA_EXE` (set by conda activation) or the `conda` executable on
+    the PATH, in `bin`, `Scripts` or `condabin` of the root prefix.
+    """
+    for conda in [os.environ.get('CONDA_EXE'), _which('conda')]:
+        if not conda:
+            continue
+        conda = os.path.realpath(conda)
+        root_prefix = os.path.dirname(os.path.dirname(conda))
+        if os.path.isdir(os.path.join(root_prefix, 'conda-meta')):
+            return conda
+    return None
+
+
+def find_root_prefix():
+    """Return the root prefix of the conda on the environment, or None."""
+    conda = find_conda()
+    if conda is None:
+        return None
+    return os.path.dirname(os.path.dirname(conda))
@@ -13,15 +13,18 @@ import json
 import os
 import re
 import sys
+import threading
+import time
 
 # Third party imports
 from qtpy.QtCore import QByteArray, QObject, QThread, QTimer, QUrl, Signal
 from qtpy.QtNetwork import (QNetworkAccessManager, QNetworkProxy,
                             QNetworkProxyFactory, QNetworkRequest)
-import requests
 
 # Local imports
+from conda_manager.api import http_cache, jlap, shards
 from conda_manager.api.conda_api import CondaAPI
+from conda_manager.api.http_session import HTTPSession
 from conda_manager.utils.logs import logger
 from conda_manager.utils.py3compat import to_text_string
 
@@ -29,6 +32,16 @@ PROXY_RE = re.compile(r'(?P<scheme>.*?)://'
                       '((?P<username>.*):(?P<password>.*)@)?'
                       '(?P<host_port>.*)')
 
+# Environment variables with proxy servers, both spellings are in use
+PROXY_ENV_VARS = ('HTTP_PROXY', 'HTTPS_PROXY', 'NO_PROXY',
+                  'http_proxy', 'https_proxy', 'no_proxy')
+
+# Seconds between checks for changes of the conda configuration files
+RC_CHECK_INTERVAL = 1.0
+
+# Seconds a finished download is shared with new requests of the same file
+DOWNLOAD_RESULT_TTL = 10
+
 
 def handle_qbytearray(obj, encoding):
     """Qt/Python3 compatibility helper."""
@@ -38,6 +51,28 @@ def handle_qbytearray(obj, encoding):
     return to_text_string(obj, encoding=encoding)
 
 
+def _getenv(name):
+    """Return the environment variable `name`, in upper or lower case."""
+    return os.environ.get(name) or os.environ.get(name.lower())
+
+
+def _bypass_proxy(host):
+    """Return True if `host` is excluded from proxies by `NO_PROXY`."""
+    host = host.lower()
+    for entry in (_getenv('NO_PROXY') or '').split(','):
+        entry = entry.strip().lower().lstrip('.')
+        if entry == '*' or (entry and (host == entry or
+                                       host.endswith('.' + entry))):
+            return True
+    return False
+
+
+def download_key(url, path):
+    """Return the key of the download of `url` to `path`."""
+    url = to_text_string(QUrl(url).toEncoded(), encoding='utf-8')
+    return url, os.path.abspath(path)
+
+
 def process_proxy_servers(proxy_settings):
     """Split the proxy conda configuration to be used by the proxy factory."""
     proxy_settings_dic = {}
@@ -64,10 +99,65 @@ class NetworkProxyFactory(QNetworkProxyFactory):
     """Proxy factory to handle different proxy configuration."""
 
     def __init__(self, *args, **kwargs):
-        """Proxy factory to handle different proxy configuration."""
+        """
+        Proxy factory to handle different proxy configuration.
+
+        The proxies resolved for each scheme and host are cached until the
+        proxy environment variables or the modification time of one of the
+        `rc_paths` configuration files change. `rc_paths` is a list, or a
+        function returning it if the paths may change.
+        """
         self._load_rc_func = kwargs.pop('load_rc_func', None)
+        self._rc_paths = kwargs.pop('rc_paths', None) or []
         super(NetworkProxyFactory, self).__init__(*args, **kwargs)
 
+        # scheme://host -> list of QNetworkProxy
+        self._proxies = {}
+        self._proxies_env = None
+        self._rc_mtimes = None
+        self._rc_checked = 0
+
+        # Proxies may be queried from the network threads of Qt
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtime(path):
+        """Return the modification time of `path`, None if missing."""
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def _rc_changed(self):
+        """Return True if the conda configuration files changed."""
+        now = time.time()
+        if (self._rc_mtimes is not None and
+                now - self._rc_checked < RC_CHECK_INTERVAL):
+            return False
+
+        self._rc_checked = now
+        rc_paths = self._rc_paths
+        if callable(rc_paths):
+            rc_paths = rc_paths()
+        mtimes = [(path, self._mtime(path)) for path in rc_paths]
+        changed = mtimes != self._rc_mtimes
+        self._rc_mtimes = mtimes
+        return changed
+
+    def _check_proxies(self):
+        """Clear the resolved proxies if the proxy configuration changed."""
+        env = tuple(os.environ.get(name) for name in PROXY_ENV_VARS)
+        rc_changed = self._rc_changed()
+        if rc_changed or env != self._proxies_env:
+            self._proxies_env = env
+            self._proxies = {}
+
+    def clear_cache(self):
+        """Resolve the proxies again on the next queries."""
+        with self._lock:
+            self._proxies = {}
+            self._rc_mtimes = None
+
     @property
     def proxy_servers(self):
         """
@@ -80,8 +170,8 @@ class NetworkProxyFactory(QNetworkProxyFactory):
         if self._load_rc_func is None:
             return proxy_servers
         else:
-            HTTP_PROXY = os.environ.get('HTTP_PROXY')
-            HTTPS_PROXY = os.environ.get('HTTPS_PROXY')
+            HTTP_PROXY = _getenv('HTTP_PROXY')
+            HTTPS_PROXY = _getenv('HTTPS_PROXY')
 
             if HTTP_PROXY:
                 proxy_servers['http'] = HTTP_PROXY
@@ -124,11 +214,26 @@ class NetworkProxyFactory(QNetworkProxyFactory):
     def queryProxy(self, query):
         """Override Qt method."""
         # Query is a QNetworkProxyQuery
-        valid_proxies = []
-
         query_scheme = query.url().scheme()
         query_host = query.url().host()
         query_scheme_host = '{0}://{1}'.format(query_scheme, query_host)
+
+        with self._lock:
+            self._check_proxies()
+            valid_proxies = self._proxies.get(query_scheme_host)
+            if valid_proxies is None:
+                valid_proxies = self._resolve_proxies(query_scheme,
+                                                      query_scheme_host)
+                self._proxies[query_scheme_host] = valid_proxies
+
+        return valid_proxies
+
+    def _resolve_proxies(self, query_scheme, query_scheme_host):
+        """Return the proxies to use for a scheme and host."""
+        valid_proxies = []
+        if _bypass_proxy(query_scheme_host.split('://', 1)[-1]):
+            return [QNetworkProxy(QNetworkProxy.NoProxy)]
+
         proxy_servers = process_proxy_servers(self.proxy_servers)
 #        print(proxy_servers)
 
@@ -149,15 +254,6 @@ class NetworkProxyFactory(QNetworkProxyFactory):
         else:
             valid_proxies.append(QNetworkProxy(QNetworkProxy.DefaultProxy))
 
-#        print('factoy', query.url().toString())
-#        print(valid_proxies)
-#        for pr in valid_proxies:
-#            user = pr.user()
-#            password = pr.password()
-#            host = pr.hostName()
-#            port = pr.port()
-#            print(query.url(), user, password, host, port)
-#        print('\n')
         return valid_proxies
 
 
@@ -178,26 +274,158 @@ class DownloadWorker(QObject):
         self.path = path
         self.finished = False
 
+        # HTTP status code of the response, None if there was no response
+        self.status = None
+
+    def is_finished(self):
+        """Return True if worker status is finished otherwise return False."""
+        return self.finished
+
+
+class CoalescedDownloadWorker(QObject):
+    """Download worker shared by the requests of the same file."""
+
+    # url, path
+    sig_download_finished = Signal(str, str)
+
+    # url, path, progress_size, total_size
+    sig_download_progress = Signal(str, str, int, int)
+    sig_finished = Signal(object, object, object)
+
+    def __init__(self, url, path):
+        """Download worker shared by the requests of the same file."""
+        super(CoalescedDownloadWorker, self).__init__()
+        self.url = url
+        self.path = path
+        self.finished = False
+        self.finished_time = None
+        self.output = None
+        self.error = None
+
+        # HTTP status code of the response, if known
+        self.status = None
+
     def is_finished(self):
         """Return True if worker status is finished otherwise return False."""
         return self.finished
 
+    def _download_progress(self, url, path, progress_size, total_size):
+        """Relay the progress of the download."""
+        self.sig_download_progress.emit(url, path, progress_size, total_size)
+
+    def _download_finished(self, url, path):
+        """Relay the end of the download."""
+        self.sig_download_finished.emit(url, path)
+
+    def _finished(self, worker, output, error):
+        """Keep the result of the download and relay it."""
+        self.status = getattr(worker, 'status', None)
+        self.output = output
+        self.error = error
+        self.finished = True
+        self.finished_time = time.time()
+        self.sig_finished.emit(self, output, error)
+
+    def _replay(self):
+        """Notify the result of a download that already finished."""
+        self.sig_download_finished.emit(self.url, self.path)
+        self.sig_finished.emit(self, self.output, self.error)
+
+
+class _DownloadCoalescer(QObject):
+    """
+    Share downloads of the same url and destination between callers.
+
+    Concurrent requests for the same file, through any of the download APIs,
+    get the worker of the transfer in flight, and the result of a successful
+    download is given to new requests for `ttl` seconds.
+    """
+
+    def __init__(self, ttl=DOWNLOAD_RESULT_TTL):
+        """Share downloads of the same url and destination between callers."""
+        super(_DownloadCoalescer, self).__init__()
+        self.ttl = ttl
+
+        # (url, path) -> CoalescedDownloadWorker, in flight or finished
+        self._downloads = {}
+
+    def _expire(self):
+        """Forget the downloads that finished more than `ttl` seconds ago."""
+        now = time.time()
+        for key, worker in list(self._downloads.items()):
+            if worker.is_finished() and (worker.error is not None or
+                                         now - worker.finished_time >
+                                         self.ttl):
+                self._downloads.pop(key)
+
+    def download(self, url, path, download_func, force=False):
+        """
+        Return a worker for the download of `url` to `path`.
+
+        `download_func()` starts the download and returns its worker, it is
+        only called if the file is not being downloaded already, or was not
+        downloaded less than `ttl` seconds ago. Use `force` to ignore the
+        result of a previous download.
+        """
+        self._expire()
+        key = download_key(url, path)
+        coalesced = self._downloads.get(key)
+
+        if coalesced is not None:
+            if not coalesced.is_finished():
+                return coalesced
+            elif not force and os.path.isfile(path):
+                worker = CoalescedDownloadWorker(url, path)
+                worker.status = coalesced.status
+                worker.output = coalesced.output
+                worker.finished = True
+                worker.finished_time = coalesced.finished_time
+
+                # Let the caller connect to the worker signals first
+                QTimer.singleShot(0, worker._replay)
+                return worker
+
+        worker = download_func()
+
+        # Methods of an object of this thread, so downloads finishing in
+        # other threads are relayed in the thread of the callers
+        coalesced = CoalescedDownloadWorker(url, path)
+        worker.sig_download_progress.connect(coalesced._download_progress)
+        worker.sig_download_finished.connect(coalesced._download_finished)
+        worker.sig_finished.connect(coalesced._finished)
+        self._downloads[key] = coalesced
+        return coalesced
+
+    def clear(self):
+        """Forget all downloads, the ones in flight are not shared anymore."""
+        self._downloads = {}
+
 
 class _DownloadAPI(QObject):
     """Download API based on QNetworkAccessManager."""
 
-    def __init__(self, chunk_size=1024, load_rc_func=None):
-        """Download API based on QNetworkAccessManager."""
+    def __init__(self, chunk_size=1024, load_rc_func=None, rc_paths=None):
+        """
+        Download API based on QNetworkAccessManager.
+
+        Proxies are read with `load_rc_func` and read again when one of the
+        `rc_paths` configuration files changes. `rc_paths` is a list, or a
+        function returning it.
+        """
         super(_DownloadAPI, self).__init__()
         self._chunk_size = chunk_size
-        self._head_requests = {}
+        # (url, path) -> state of the download, see download_key
         self._get_requests = {}
-        self._paths = {}
+        self._partials = {}
+        self._partial_files = {}
+        self._replies = {}
         self._workers = {}
 
         self._load_rc_func = load_rc_func
+        self._coalescer = DownloadCoalescer()
         self._manager = QNetworkAccessManager(self)
-        self._proxy_factory = NetworkProxyFactory(load_rc_func=load_rc_func)
+        self._proxy_factory = NetworkProxyFactory(load_rc_func=load_rc_func,
+                                                  rc_paths=rc_paths)
         self._timer = QTimer()
 
         # Setup
@@ -206,7 +434,6 @@ class _DownloadAPI(QObject):
         self._timer.timeout.connect(self._clean)
 
         # Signals
-        self._manager.finished.connect(self._request_finished)
         self._manager.sslErrors.connect(self._handle_ssl_errors)
         self._manager.proxyAuthenticationRequired.connect(
             self._handle_proxy_auth)
@@ -229,93 +456,95 @@ class _DownloadAPI(QObject):
     def _clean(self):
         """Check for inactive workers and remove their references."""
         if self._workers:
-            for url in self._workers.copy():
-                w = self._workers[url]
+            for key in self._workers.copy():
+                w = self._workers[key]
                 if w.is_finished():
-                    self._workers.pop(url)
-                    self._paths.pop(url)
-                    if url in self._get_requests:
-                        self._get_requests.pop(url)
+                    self._workers.pop(key)
+                    self._get_requests.pop(key, None)
 
         else:
             self._timer.stop()
 
-    def _request_finished(self, reply):
+    def _request_finished(self, key, reply):
         """Callback for download once the request has finished."""
-        url = to_text_string(reply.url().toEncoded(), encoding='utf-8')
-
-        if url in self._paths:
-            path = self._paths[url]
-        if url in self._workers:
-            worker = self._workers[url]
-
-        if url in self._head_requests:
-            error = reply.error()
-#            print(url, error)
-            if error:
-                logger.error(str(('Head Reply Error:', error)))
-                worker.sig_download_finished.emit(url, path)
-                worker.sig_finished.emit(worker, path, error)
-                return
-
-            self._head_requests.pop(url)
-            start_download = not bool(error)
-            header_pairs = reply.rawHeaderPairs()
-            headers = {}
-
-            for hp in header_pairs:
-                headers[to_text_string(hp[0]).lower()] = to_text_string(hp[1])
-
-            total_size = int(headers.get('content-length', 0))
-
-            # Check if file exists
-            if os.path.isfile(path):
-                file_size = os.path.getsize(path)
-
-                # Check if existing file matches size of requested file
-                start_download = file_size != total_size
-
-            if start_download:
-                # File sizes dont match, hence download file
-                qurl = QUrl(url)
-                request = QNetworkRequest(qurl)
-                self._get_requests[url] = request
-                reply = self._manager.get(request)
-
-                error = reply.error()
-                if error:
-                    logger.error(str(('Reply Error:', error)))
-
-                reply.downloadProgress.connect(
-                    lambda r, t, w=worker: self._progress(r, t, w))
-            else:
-                # File sizes match, dont download file or error?
-                worker.finished = True
-                worker.sig_download_finished.emit(url, path)
-                worker.sig_finished.emit(worker, path, None)
-        elif url in self._get_requests:
-            data = reply.readAll()
-            self._save(url, path, data)
-
-    def _save(self, url, path, data):
-        """Save `data` of downloaded `url` in `path`."""
-        worker = self._workers[url]
-        path = self._paths[url]
-
-        if len(data):
+        if key not in self._workers or self._replies.get(key) is not reply:
+            return
+
+        worker = self._workers[key]
+        url, path = worker.url, worker.path
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        headers = self._reply_headers(reply)
+        worker.status = status
+
+        error = None
+        if status == 416 and self._partials.get(key):
+            # The partial download can not be resumed, start over
+            reply.deleteLater()
+            self._replies.pop(key, None)
+            http_cache.remove_partial_file(path)
+            self._get(key, http_cache.load_cache_metadata(path, url))
+            return
+        elif status == 304:
+            # Not modified, the local copy is still valid
+            http_cache.refresh_cache_metadata(path, url, headers)
+        elif reply.error() or status not in (200, 206):
+            # Keep the local copy, if any, instead of the error body. Keep
+            # what was received of an interrupted download, to resume it
+            self._ready_read(key, reply)
+            error = reply.error() or status
+            logger.error(str(('Reply Error:', url, error)))
+        else:
             try:
-                with open(path, 'wb') as f:
-                    f.write(data)
-            except Exception:
-                logger.error((url, path))
+                self._ready_read(key, reply)
+                f = self._partial_files.pop(key)
+                http_cache.commit_partial_file(f, path)
+                http_cache.save_cache_metadata(path, url, headers)
+            except Exception as err:
+                error = err
+                logger.error(str((url, path, error)))
+
+        reply.deleteLater()
+        self._finish(key, error)
+
+    @staticmethod
+    def _reply_headers(reply):
+        """Return the headers of `reply` with lowercase names."""
+        headers = {}
+        for hp in reply.rawHeaderPairs():
+            key = handle_qbytearray(hp[0], 'utf-8').lower()
+            headers[key] = handle_qbytearray(hp[1], 'utf-8')
+        return headers
+
+    def _ready_read(self, key, reply):
+        """Write the data received so far for `key` to its partial file."""
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if status not in (200, 206) or key not in self._workers:
+            return
+
+        if key not in self._partial_files:
+            worker = self._workers[key]
+            self._partial_files[key] = http_cache.open_partial_file(
+                worker.path, worker.url, status, self._reply_headers(reply),
+                self._partials.get(key))[0]
+
+        f = self._partial_files[key]
+        f.write(reply.readAll().data())
+
+    def _finish(self, key, error=None):
+        """Notify the end of the download of `key` and clean up."""
+        worker = self._workers.pop(key)
+        self._get_requests.pop(key, None)
+        self._replies.pop(key, None)
+        self._partials.pop(key, None)
+
+        # Left over from an error or an aborted download, kept to be resumed
+        if key in self._partial_files:
+            http_cache.close_partial_file(self._partial_files.pop(key),
+                                          worker.path)
 
-        # Clean up
         worker.finished = True
-        worker.sig_download_finished.emit(url, path)
-        worker.sig_finished.emit(worker, path, None)
-        self._get_requests.pop(url)
-        self._workers.pop(url)
-        self._paths.pop(url)
+        worker.sig_download_finished.emit(worker.url, worker.path)
+        worker.sig_finished.emit(worker, worker.path, error)
 
     @staticmethod
     def _progress(bytes_received, bytes_total, worker):
@@ -324,17 +553,21 @@ class _DownloadAPI(QObject):
             worker.url, worker.path, bytes_received, bytes_total)
 
     def download(self, url, path):
-        """Download url and save data to path."""
-        # original_url = url
-#        print(url)
-        qurl = QUrl(url)
-        url = to_text_string(qurl.toEncoded(), encoding='utf-8')
+        """
+        Download url and save data to path.
 
-        logger.debug(str((url, path)))
-        if url in self._workers:
-            while not self._workers[url].finished:
-                return self._workers[url]
+        Requests for a file being downloaded, or just downloaded, share the
+        worker or result of that download.
+        """
+        return self._coalescer.download(
+            url, path, lambda: self._download(url, path))
+
+    def _download(self, url, path):
+        """Start the download of url to path, returns a worker."""
+        key = download_key(url, path)
+        url = key[0]
 
+        logger.debug(str((url, path)))
         worker = DownloadWorker(url, path)
 
         # Check download folder exists
@@ -342,18 +575,53 @@ class _DownloadAPI(QObject):
         if not os.path.isdir(folder):
             os.makedirs(folder)
 
-        request = QNetworkRequest(qurl)
-        self._head_requests[url] = request
-        self._paths[url] = path
-        self._workers[url] = worker
-        self._manager.head(request)
+        self._workers[key] = worker
         self._timer.start()
 
+        metadata = http_cache.load_cache_metadata(path, url)
+        if metadata and http_cache.is_fresh(metadata):
+            # Let the caller connect to the worker signals first
+            self._get_requests[key] = None
+            QTimer.singleShot(0, lambda key=key: self._finish(key))
+            return worker
+
+        self._get(key, metadata)
         return worker
 
+    def _get(self, key, metadata=None):
+        """Send the request of the download of `key`."""
+        worker = self._workers[key]
+
+        # A single conditional GET, answered by a 304 if nothing changed,
+        # resuming an interrupted download if there is one
+        partial = http_cache.load_partial(worker.path, worker.url)
+        headers = http_cache.conditional_headers(metadata)
+        headers.update(http_cache.range_headers(partial))
+        self._partials[key] = partial
+
+        request = QNetworkRequest(QUrl(worker.url))
+        for name, value in headers.items():
+            request.setRawHeader(name.encode('ascii'), value.encode('ascii'))
+
+        self._get_requests[key] = request
+        reply = self._manager.get(request)
+        self._replies[key] = reply
+
+        # Write data to disk as it arrives, instead of buffering it all
+        reply.setReadBufferSize(self._chunk_size * 64)
+        reply.readyRead.connect(
+            lambda key=key, reply=reply: self._ready_read(key, reply))
+        reply.finished.connect(
+            lambda key=key, reply=reply: self._request_finished(key, reply))
+        reply.downloadProgress.connect(
+            lambda r, t, w=worker: self._progress(r, t, w))
+
     def terminate(self):
         """Terminate all download workers and threads."""
-        pass
+        self._coalescer.clear()
+        for reply in list(self._replies.values()):
+            # The replies finish with an error and their data is discarded
+            reply.abort()
 
 
 class RequestsDownloadWorker(QObject):
@@ -402,6 +670,8 @@ class _RequestsDownloadAPI(QObject):
         """Download API based on requests."""
         super(QObject, self).__init__()
         self._conda_api = CondaAPI()
+        self._session = HTTPSession()
+        self._coalescer = DownloadCoalescer()
         self._queue = deque()
         self._threads = []
         self._workers = []
@@ -468,45 +738,47 @@ class _RequestsDownloadAPI(QObject):
         if not os.path.isdir(folder):
             os.makedirs(folder)
 
-        # Start actual download
+        def progress(progress_size, total_size):
+            self._sig_download_progress.emit(url, path, progress_size,
+                                             total_size)
+
+        # Start actual download, revalidating the local copy if any. Errors
+        # (HTTP error status included) are the error of the worker
         try:
-            r = requests.get(url, stream=True, proxies=self.proxy_servers)
-        except Exception as error:
-            print('ERROR', 'here', error)
-            logger.error(str(error))
-            # Break if error found!
-#            self._sig_download_finished.emit(url, path)
-#            return path
-
-        total_size = int(r.headers.get('Content-Length', 0))
-
-        # Check if file exists
-        if os.path.isfile(path) and not force:
-            file_size = os.path.getsize(path)
-
-            # Check if existing file matches size of requested file
-            if file_size == total_size:
-                self._sig_download_finished.emit(url, path)
-                return path
-
-        # File not found or file size did not match. Download file.
-        progress_size = 0
-        with open(path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=self._chunk_size):
-                if chunk:
-                    f.write(chunk)
-                    progress_size += len(chunk)
-                    self._sig_download_progress.emit(url, path,
-                                                     progress_size,
-                                                     total_size)
+            http_cache.fetch(url, path, force=force, session=self._session,
+                             chunk_size=self._chunk_size,
+                             progress_callback=progress,
+                             proxies=self.proxy_servers, raise_errors=True)
+        finally:
             self._sig_download_finished.emit(url, path)
+        return path
+
+    def _download_incremental(self, url, path):
+        """Callback for download_incremental."""
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
 
+        jlap.fetch(url, path, session=self._session,
+                   proxies=self.proxy_servers)
+        self._sig_download_finished.emit(url, path)
+        return path
+
+    def _download_shards(self, url, path, names, cache_dir=None):
+        """Callback for download_shards."""
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        shards.fetch(url, path, names=names, cache_dir=cache_dir,
+                     session=self._session, proxies=self.proxy_servers)
+        self._sig_download_finished.emit(url, path)
         return path
 
     def _is_valid_url(self, url):
         """Callback for is_valid_url."""
         try:
-            r = requests.head(url, proxies=self.proxy_servers)
+            r = self._session.head(url, proxies=self.proxy_servers)
             value = r.status_code in [200]
         except Exception as error:
             logger.error(str(error))
@@ -529,7 +801,7 @@ class _RequestsDownloadAPI(QObject):
         repodata_url = "{0}/{1}/{2}".format(url, plat, 'repodata.json')
 
         try:
-            r = requests.head(repodata_url, proxies=self.proxy_servers)
+            r = self._session.head(repodata_url, proxies=self.proxy_servers)
             value = r.status_code in [200]
         except Exception as error:
             logger.error(str(error))
@@ -542,7 +814,7 @@ class _RequestsDownloadAPI(QObject):
         # Check response is a JSON with ok: 1
         data = {}
         try:
-            r = requests.get(url, proxies=self.proxy_servers)
+            r = self._session.get(url, proxies=self.proxy_servers)
             content = to_text_string(r.content, encoding='utf-8')
             data = json.loads(content)
         except Exception as error:
@@ -553,18 +825,60 @@ class _RequestsDownloadAPI(QObject):
     # --- Public API
     # -------------------------------------------------------------------------
     def download(self, url, path=None, force=False):
-        """Download file given by url and save it to path."""
+        """
+        Download file given by url and save it to path.
+
+        Requests for a file being downloaded, or just downloaded, share the
+        worker or result of that download. Use `force` to download again a
+        file that was just downloaded.
+        """
         logger.debug(str((url, path, force)))
+        if path is None:
+            path = url.split('/')[-1]
+
         method = self._download
-        return self._create_worker(method, url, path=path, force=force)
+        return self._coalescer.download(
+            url, path,
+            lambda: self._create_worker(method, url, path=path, force=force),
+            force=force)
+
+    def download_incremental(self, url, path):
+        """
+        Update the repodata.json `url` in `path` from its jlap patch log.
+
+        Errors, including an HTTPStatusError if the channel has no patch
+        log, are given by the worker.
+        """
+        logger.debug(str((url, path)))
+        method = self._download_incremental
+        return self._create_worker(method, url, path)
+
+    def download_shards(self, url, path, names, cache_dir=None):
+        """
+        Update the repodata in `path` from the shard index `url`.
+
+        Only the shards of the package `names`, of the names of previous
+        updates and of their dependencies are fetched, and kept in
+        `cache_dir`. Errors, including an HTTPStatusError if the channel has
+        no shard index, are given by the worker.
+        """
+        logger.debug(str((url, path, names)))
+        method = self._download_shards
+        return self._create_worker(method, url, path, names,
+                                   cache_dir=cache_dir)
 
     def terminate(self):
         """Terminate all workers and threads."""
+        self._coalescer.clear()
         for t in self._threads:
             t.quit()
         self._thread = []
         self._workers = []
 
+    def connection_stats(self):
+        """Return the requests, connections and reused connections per host."""
+        return self._session.stats()
+
     def is_valid_url(self, url, non_blocking=True):
         """Check if url is valid."""
         logger.debug(str((url)))
@@ -599,7 +913,7 @@ class _RequestsDownloadAPI(QObject):
         """Query anaconda api info."""
         data = {}
         try:
-            r = requests.get(url, proxies=self.proxy_servers)
+            r = self._session.get(url, proxies=self.proxy_servers)
             content = to_text_string(r.content, encoding='utf-8')
             data = json.loads(content)
             if not data:
@@ -612,16 +926,28 @@ class _RequestsDownloadAPI(QObject):
         return data
 
 
+DOWNLOAD_COALESCER = None
 DOWNLOAD_API = None
 REQUESTS_DOWNLOAD_API = None
 
 
-def DownloadAPI(load_rc_func=None):
+def DownloadCoalescer():
+    """Download sharing between callers and download APIs."""
+    global DOWNLOAD_COALESCER
+
+    if DOWNLOAD_COALESCER is None:
+        DOWNLOAD_COALESCER = _DownloadCoalescer()
+
+    return DOWNLOAD_COALESCER
+
+
+def DownloadAPI(load_rc_func=None, rc_paths=None):
     """Downlaod API based on Qt."""
     global DOWNLOAD_API
 
     if DOWNLOAD_API is None:
-        DOWNLOAD_API = _DownloadAPI(load_rc_func=load_rc_func)
+        DOWNLOAD_API = _DownloadAPI(load_rc_func=load_rc_func,
+                                    rc_paths=rc_paths)
 
     return DOWNLOAD_API
 
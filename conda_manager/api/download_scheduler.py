@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Bounded concurrent download scheduler.
+
+Downloads are grouped in batches. Up to `max_in_flight` downloads run at the
+same time, at most `max_per_host` of them against the same host, and hosts
+take turns so a channel host with many files does not hold back the others.
+A batch notifies once when all its downloads have finished.
+"""
+
+# Standard library imports
+from collections import OrderedDict, deque
+
+try:
+    from urllib.parse import urlparse
+except ImportError:  # Python 2
+    from urlparse import urlparse
+
+# Third party imports
+from qtpy.QtCore import QObject, QTimer, Signal
+
+# Local imports
+from conda_manager.utils.logs import logger
+
+
+MAX_IN_FLIGHT = 8
+MAX_PER_HOST = 4
+
+
+class DownloadBatch(QObject):
+    """Group of downloads that finishes when all its downloads do."""
+
+    # url, path, error
+    sig_download_finished = Signal(str, str, object)
+
+    # batch, {url: path}, {url: error}
+    sig_finished = Signal(object, object, object)
+
+    def __init__(self, items):
+        """Group of downloads that finishes when all its downloads do."""
+        super(DownloadBatch, self).__init__()
+        self.paths = OrderedDict(items)
+        self.errors = {}
+        self.statuses = {}
+        self._pending = set(self.paths)
+
+    def is_finished(self):
+        """Return True if all the downloads of the batch have finished."""
+        return not self._pending
+
+    def _download_finished(self, url, error, status=None):
+        """Record the end of the download of `url`."""
+        if url not in self._pending:
+            return
+
+        self._pending.discard(url)
+        self.statuses[url] = status
+        if error:
+            self.errors[url] = error
+
+        self.sig_download_finished.emit(url, self.paths[url], error)
+        if not self._pending:
+            self.sig_finished.emit(self, self.paths, self.errors)
+
+
+class DownloadScheduler(QObject):
+    """Run downloads concurrently with a global and a per host limit."""
+
+    def __init__(self, download_func, max_in_flight=MAX_IN_FLIGHT,
+                 max_per_host=MAX_PER_HOST):
+        """
+        Run downloads concurrently with a global and a per host limit.
+
+        `download_func(url, path)` starts a download and returns a worker
+        emitting `sig_finished(worker, output, error)` when done. The HTTP
+        status code of the response, if the worker or the error have a
+        `status`, is kept in the `statuses` of the batch.
+        """
+        super(DownloadScheduler, self).__init__()
+        self._download_func = download_func
+        self.max_in_flight = max_in_flight
+        self.max_per_host = max_per_host
+
+        # host -> deque of (batch, url, path), hosts in round robin order
+        self._pending = OrderedDict()
+        self._in_flight = {}
+
+        # worker -> list of (host, batch, url), a worker is shared by the
+        # downloads of the same url
+        self._workers = {}
+
+    @staticmethod
+    def _host(url):
+        """Return the scheme and host part of `url`."""
+        parts = urlparse(url)
+        return '{0}://{1}'.format(parts.scheme, parts.netloc)
+
+    def _next(self):
+        """Pop the next download to start, taking hosts in turns."""
+        for host in list(self._pending):
+            queue = self._pending.pop(host)
+            if self._in_flight.get(host, 0) < self.max_per_host:
+                item = queue.popleft()
+                if queue:
+                    # Move the host to the end of the line
+                    self._pending[host] = queue
+                return host, item
+            self._pending[host] = queue
+        return None, None
+
+    def _pump(self):
+        """Start pending downloads while below the in flight limits."""
+        while sum(self._in_flight.values()) < self.max_in_flight:
+            host, item = self._next()
+            if item is None:
+                break
+
+            batch, url, path = item
+            self._in_flight[host] = self._in_flight.get(host, 0) + 1
+            try:
+                worker = self._download_func(url, path)
+            except Exception as error:
+                logger.error(str((url, error)))
+                self._download_finished(host, batch, url, error)
+                continue
+
+            # A method of this object, so workers finishing in other threads
+            # are handled in the thread of the scheduler
+            if worker not in self._workers:
+                self._workers[worker] = []
+                worker.sig_finished.connect(self._worker_finished)
+            self._workers[worker].append((host, batch, url))
+
+    def _worker_finished(self, worker, output, error):
+        """Callback for a finished download worker."""
+        if worker not in self._workers:
+            return
+
+        for host, batch, url in self._workers.pop(worker):
+            self._download_finished(host, batch, url, error, worker)
+
+    def _download_finished(self, host, batch, url, error, worker=None):
+        """Record the end of a download and start the next ones."""
+        self._in_flight[host] -= 1
+        if not self._in_flight[host]:
+            self._in_flight.pop(host)
+
+        status = getattr(worker, 'status', None)
+        if status is None:
+            status = getattr(error, 'status', None)
+        batch._download_finished(url, error, status)
+        self._pump()
+
+    # --- Public API
+    # -------------------------------------------------------------------------
+    def download(self, items):
+        """
+        Download a batch of `items`, given as (url, path) pairs.
+
+        Returns a DownloadBatch.
+        """
+        batch = DownloadBatch(items)
+        if batch.is_finished():
+            # Let the caller connect to the batch signals first
+            QTimer.singleShot(0, lambda b=batch: b.sig_finished.emit(
+                b, b.paths, b.errors))
+            return batch
+
+        for url, path in batch.paths.items():
+            host = self._host(url)
+            self._pending.setdefault(host, deque()).append((batch, url, path))
+
+        self._pump()
+        return batch
+
+    def in_flight(self):
+        """Return the number of downloads currently running."""
+        return sum(self._in_flight.values())
+
+
+# --- Local testing
+# -----------------------------------------------------------------------------
+def _three_round_trips(items):  # pragma: no cover
+    """Refresh `items` the way it was done before: HEAD, HEAD, then GET."""
+    import os
+    import threading
+
+    from conda_manager.api.http_session import HTTPSession
+
+    session = HTTPSession()
+
+    def refresh(url, path):
+        session.head(url)
+        r = session.head(url)
+        size = int(r.headers.get('Content-Length', 0))
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            with open(path, 'wb') as f:
+                f.write(session.get(url).content)
+
+    # The validity checks ran concurrently, then the downloads
+    threads = [threading.Thread(target=session.head, args=(url, ))
+               for url, __ in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    threads = [threading.Thread(target=refresh, args=item) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test(n_channels=8, delay=0.25):  # pragma: no cover
+    """Time a repodata refresh against a local server with latency."""
+    import os
+    import tempfile
+    import time
+
+    from conda_manager.api.download_api import _DownloadAPI
+    from conda_manager.api.http_cache import _serve
+    from conda_manager.utils.qthelpers import qapplication
+
+    app = qapplication()
+    served = tempfile.mkdtemp()
+    for i in range(n_channels):
+        os.makedirs(os.path.join(served, 'channel{0}'.format(i)))
+        with open(os.path.join(served, 'channel{0}'.format(i),
+                               'repodata.json'), 'w') as f:
+            f.write('{}')
+
+    server = _serve(served, delay=delay)
+    base = 'http://127.0.0.1:{0}'.format(server.server_port)
+
+    def items():
+        downloads = tempfile.mkdtemp()
+        return [('{0}/channel{1}/repodata.json'.format(base, i),
+                 os.path.join(downloads, '{0}.json'.format(i)))
+                for i in range(n_channels)]
+
+    def conditional_get(items, max_in_flight):
+        scheduler = DownloadScheduler(api.download,
+                                      max_in_flight=max_in_flight,
+                                      max_per_host=max_in_flight)
+        batch = scheduler.download(items)
+        batch.sig_finished.connect(lambda *args: app.quit())
+        app.exec_()
+
+    api = _DownloadAPI()
+    print('{0} channels, {1}s latency per request'.format(n_channels, delay))
+    for label, func in [('HEAD, HEAD, GET', _three_round_trips),
+                        ('conditional GET, serial',
+                         lambda items: conditional_get(items, 1)),
+                        ('conditional GET, concurrent',
+                         lambda items: conditional_get(items, n_channels)),
+                        ]:
+        channels = items()
+        for state in ['cold', 'warm']:
+            t0 = time.time()
+            func(channels)
+            print('{0} ({1}): {2:.2f}s'.format(label, state,
+                                               time.time() - t0))
+
+    server.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    test()
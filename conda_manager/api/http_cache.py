@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+HTTP cache validation for downloaded files.
+
+The validators sent by the server with a file (ETag, Last-Modified) and its
+Cache-Control header are stored in a json sidecar next to the file. They are
+sent back as If-None-Match and If-Modified-Since the next time the file is
+requested, so an unchanged file costs a 304 response with no body.
+
+Files are downloaded to a `.part` file that replaces the target only once
+complete. If the server supports ranges, an interrupted download is resumed
+from the `.part` file with a Range request, guarded by If-Range with a
+strong ETag so a file that changed in between is downloaded again from the
+start.
+"""
+
+# Standard library imports
+import json
+import os
+import re
+import time
+
+# Third party imports
+import requests
+
+# Local imports
+from conda_manager.utils.logs import logger
+
+
+CACHE_METADATA_SUFFIX = '.cache.json'
+PARTIAL_SUFFIX = '.part'
+MAX_AGE_RE = re.compile(r'max-age\s*=\s*(\d+)')
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class HTTPStatusError(IOError):
+    """Response with an unexpected HTTP status code."""
+
+    def __init__(self, url, status):
+        """Response with an unexpected HTTP status code."""
+        super(HTTPStatusError, self).__init__(
+            '{0} answered with status {1}'.format(url, status))
+        self.url = url
+        self.status = status
+
+
+def cache_metadata_path(path):
+    """Return the path of the cache metadata sidecar of `path`."""
+    return path + CACHE_METADATA_SUFFIX
+
+
+def _lower_headers(headers):
+    """Return a dictionary of `headers` with lowercase names."""
+    return dict((key.lower(), value) for key, value in headers.items())
+
+
+def load_cache_metadata(path, url=None):
+    """
+    Return the cache metadata stored for `path`.
+
+    An empty dictionary is returned if there is none, if the file is missing
+    or was modified after it was downloaded, or if it was downloaded from a
+    different `url`.
+    """
+    metadata_path = cache_metadata_path(path)
+    if not os.path.isfile(path) or not os.path.isfile(metadata_path):
+        return {}
+
+    try:
+        with open(metadata_path, 'r') as f:
+            metadata = json.load(f)
+    except Exception as error:
+        logger.error(str((metadata_path, error)))
+        return {}
+
+    if url is not None and metadata.get('url') != url:
+        return {}
+
+    if metadata.get('size') != os.path.getsize(path):
+        return {}
+
+    return metadata
+
+
+def _write_cache_metadata(path, metadata):
+    """Write the cache `metadata` sidecar of `path`."""
+    metadata_path = cache_metadata_path(path)
+    try:
+        with open(metadata_path, 'w') as f:
+            json.dump(metadata, f, sort_keys=True, indent=4)
+    except Exception as error:
+        logger.error(str((metadata_path, error)))
+
+
+def save_cache_metadata(path, url, headers):
+    """Store the validators of the response `headers` of `url` for `path`."""
+    headers = _lower_headers(headers)
+    metadata = {'url': url,
+                'etag': headers.get('etag'),
+                'last_modified': headers.get('last-modified'),
+                'cache_control': headers.get('cache-control'),
+                'checked': time.time(),
+                'size': os.path.getsize(path),
+                }
+    _write_cache_metadata(path, metadata)
+
+
+def refresh_cache_metadata(path, url, headers):
+    """Update the metadata of `path` after a 304 (not modified) response."""
+    metadata = load_cache_metadata(path, url)
+    if not metadata:
+        return
+
+    headers = _lower_headers(headers)
+    for key, header in (('etag', 'etag'),
+                        ('last_modified', 'last-modified'),
+                        ('cache_control', 'cache-control')):
+        if headers.get(header):
+            metadata[key] = headers[header]
+    metadata['checked'] = time.time()
+    _write_cache_metadata(path, metadata)
+
+
+def conditional_headers(metadata):
+    """Return the request headers to revalidate a file with `metadata`."""
+    headers = {}
+    if metadata.get('etag'):
+        headers['If-None-Match'] = metadata['etag']
+    if metadata.get('last_modified'):
+        headers['If-Modified-Since'] = metadata['last_modified']
+    return headers
+
+
+def is_fresh(metadata):
+    """
+    Return True if the file can be used without asking the server.
+
+    This is the case while the `max-age` of its Cache-Control header has not
+    expired, unless it is `no-cache` or `no-store`.
+    """
+    cache_control = (metadata.get('cache_control') or '').lower()
+    if not cache_control or 'no-cache' in cache_control or \
+            'no-store' in cache_control:
+        return False
+
+    match = MAX_AGE_RE.search(cache_control)
+    if match is None:
+        return False
+
+    age = time.time() - metadata.get('checked', 0)
+    return 0 <= age < int(match.group(1))
+
+
+def replace_file(src, dst):
+    """Move `src` over `dst` in a single step where the os supports it."""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2
+        if os.name == 'nt' and os.path.isfile(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def partial_path(path):
+    """Return the path of the partial download of `path`."""
+    return path + PARTIAL_SUFFIX
+
+
+def load_partial(path, url=None):
+    """
+    Return the state of an interrupted download of `url` to `path`.
+
+    The dictionary holds the `size` already downloaded and the `validator`
+    of the content it belongs to. It is empty if there is nothing to resume.
+    """
+    part_path = partial_path(path)
+    metadata_path = cache_metadata_path(part_path)
+    if not os.path.isfile(part_path) or not os.path.isfile(metadata_path):
+        return {}
+
+    try:
+        with open(metadata_path, 'r') as f:
+            partial = json.load(f)
+    except Exception as error:
+        logger.error(str((metadata_path, error)))
+        return {}
+
+    if url is not None and partial.get('url') != url:
+        return {}
+
+    if not _is_strong_etag(partial.get('validator')):
+        return {}
+
+    partial['size'] = os.path.getsize(part_path)
+    return partial
+
+
+def range_headers(partial):
+    """Return the request headers to resume the `partial` download."""
+    if not partial or not partial.get('size'):
+        return {}
+
+    return {'Range': 'bytes={0}-'.format(partial['size']),
+            'If-Range': partial['validator']}
+
+
+def _is_strong_etag(value):
+    """Return True if `value` is a strong entity tag."""
+    return bool(value) and value.startswith('"')
+
+
+def _range_validator(headers):
+    """
+    Return the If-Range validator of a response if it can be resumed.
+
+    Only strong entity tags guarantee that byte ranges of two responses
+    match, and content-encoded bodies are decoded on the fly, so the size
+    on disk is no offset of the encoded content.
+    """
+    if headers.get('accept-ranges', '').lower() != 'bytes':
+        return None
+
+    if headers.get('content-encoding', 'identity').lower() != 'identity':
+        return None
+
+    etag = headers.get('etag')
+    if _is_strong_etag(etag):
+        return etag
+    return None
+
+
+def open_partial_file(path, url, status, headers, partial=None):
+    """
+    Open the partial file of `path` to write the body of a response.
+
+    A 206 (partial content) response continuing the `partial` download is
+    appended to it, otherwise the download starts over. If the server
+    supports ranges, the response validator is stored so the download can
+    be resumed if it is interrupted.
+
+    Returns the file object and the size already in it.
+    """
+    part_path = partial_path(path)
+    headers = _lower_headers(headers)
+
+    if status == 206:
+        match = CONTENT_RANGE_RE.match(headers.get('content-range', ''))
+        offset = (partial or {}).get('size', 0)
+        if match is None or int(match.group(1)) != offset or not offset:
+            remove_partial_file(path)
+            raise IOError('Unexpected content range for {0}'.format(url))
+        return open(part_path, 'ab'), offset
+
+    validator = _range_validator(headers)
+    if validator:
+        _write_cache_metadata(part_path, {'url': url, 'validator': validator})
+    else:
+        remove_partial_file(path)
+
+    return open(part_path, 'wb'), 0
+
+
+def commit_partial_file(f, path):
+    """Flush the partial file `f` to disk and move it over `path`."""
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    replace_file(partial_path(path), path)
+    remove_partial_file(path)
+
+
+def close_partial_file(f, path):
+    """
+    Close the partial file `f` of an interrupted download.
+
+    It is kept to be resumed later if the server supports it, and removed
+    otherwise.
+    """
+    f.close()
+    if not load_partial(path):
+        remove_partial_file(path)
+
+
+def remove_partial_file(path):
+    """Remove the partial download of `path`, if any."""
+    part_path = partial_path(path)
+    for filepath in [part_path, cache_metadata_path(part_path)]:
+        try:
+            if os.path.isfile(filepath):
+                os.remove(filepath)
+        except Exception as error:
+            logger.error(str((filepath, error)))
+
+
+def fetch(url, path, force=False, session=None, chunk_size=1024,
+          progress_callback=None, raise_errors=False, **kwargs):
+    """
+    Download `url` to `path` unless the local copy is still valid.
+
+    The local copy is used as is while fresh, otherwise it is revalidated
+    with a conditional request. An interrupted download is resumed where it
+    stopped if the server supports it. Returns True if the file was
+    downloaded and False if the local copy was kept. Use `force` to always
+    download.
+
+    `session` is used to make the request (`requests` module by default) and
+    `kwargs` are passed to its `get` method. `progress_callback` is called
+    with the downloaded and total sizes as data arrives. An error status is
+    logged, or raised as an HTTPStatusError with `raise_errors`.
+    """
+    session = session if session is not None else requests
+    metadata = {} if force else load_cache_metadata(path, url)
+    if metadata and is_fresh(metadata):
+        return False
+
+    partial = load_partial(path, url)
+    headers = dict(kwargs.pop('headers', {}))
+    request_headers = dict(headers)
+    request_headers.update(conditional_headers(metadata))
+    request_headers.update(range_headers(partial))
+    r = session.get(url, stream=True, headers=request_headers, **kwargs)
+
+    try:
+        if r.status_code == 304:
+            refresh_cache_metadata(path, url, r.headers)
+            return False
+        elif r.status_code == 416 and partial:
+            # The partial download can not be resumed, start over
+            r.close()
+            remove_partial_file(path)
+            return fetch(url, path, force=force, session=session,
+                         chunk_size=chunk_size,
+                         progress_callback=progress_callback,
+                         raise_errors=raise_errors, headers=headers,
+                         **kwargs)
+        elif r.status_code not in (200, 206):
+            if raise_errors:
+                raise HTTPStatusError(url, r.status_code)
+            logger.error(str((url, r.status_code)))
+            return False
+
+        f, progress_size = open_partial_file(path, url, r.status_code,
+                                             r.headers, partial)
+        total_size = progress_size + int(r.headers.get('Content-Length', 0))
+        try:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    progress_size += len(chunk)
+                    if progress_callback is not None:
+                        progress_callback(progress_size, total_size)
+        except BaseException:
+            close_partial_file(f, path)
+            raise
+
+        commit_partial_file(f, path)
+        save_cache_metadata(path, url, r.headers)
+    finally:
+        r.close()
+
+    return True
+
+
+# --- Local testing
+# -----------------------------------------------------------------------------
+def _serve(directory, delay=0):  # pragma: no cover
+    """
+    Serve `directory` on localhost with ETag and Last-Modified validators.
+
+    Ranges are supported for resumed downloads. Each response is delayed by
+    `delay` seconds, to simulate the latency of a remote server. Returns the
+    server, running in a daemon thread. Its `log` lists the status code of
+    each response.
+    """
+    import hashlib
+    import threading
+
+    try:
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from socketserver import ThreadingMixIn
+    except ImportError:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        from SocketServer import ThreadingMixIn
+    from email.utils import formatdate, parsedate_tz, mktime_tz
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+        def handle_error(self, request, client_address):
+            # Clients dropping connections is expected
+            pass
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep connections alive
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_HEAD(self):
+            self.do_GET(body=False)
+
+        def do_GET(self, body=True):
+            time.sleep(delay)
+            path = os.path.join(directory, self.path.lstrip('/'))
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+
+            with open(path, 'rb') as f:
+                data = f.read()
+            mtime = int(os.path.getmtime(path))
+            etag = '"{0}"'.format(hashlib.md5(data).hexdigest())
+
+            since = self.headers.get('If-Modified-Since')
+            if self.headers.get('If-None-Match') == etag or (
+                    since and 'If-None-Match' not in self.headers and
+                    mktime_tz(parsedate_tz(since)) >= mtime):
+                self.log(304)
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            last_modified = formatdate(mtime, usegmt=True)
+            start = 0
+            match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+            if_range = self.headers.get('If-Range')
+            if match and if_range in (None, etag, last_modified):
+                start = int(match.group(1))
+                if start >= len(data):
+                    self.log(416)
+                    self.send_error(416)
+                    return
+
+            if start:
+                self.log(206)
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(
+                    start, len(data) - 1, len(data)))
+            else:
+                self.log(200)
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(data) - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Cache-Control', 'public, no-cache')
+            self.end_headers()
+            if body:
+                self.wfile.write(data[start:])
+
+        def log(self, status):
+            self.server.log.append(status)
+
+        def log_message(self, *args):
+            pass
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.log = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def test():  # pragma: no cover
+    """Download a file from a local server with validators and ranges."""
+    import tempfile
+
+    served = tempfile.mkdtemp()
+    downloads = tempfile.mkdtemp()
+    source = os.path.join(served, 'repodata.json')
+    with open(source, 'w') as f:
+        f.write('{"packages": {"a-1.0-0.tar.bz2": {}}}')
+
+    server = _serve(served)
+    url = 'http://127.0.0.1:{0}/repodata.json'.format(server.server_port)
+    path = os.path.join(downloads, 'repodata.json')
+
+    print('first download', fetch(url, path))
+    print('unchanged', fetch(url, path))
+
+    # Same size, different content
+    with open(source, 'w') as f:
+        f.write('{"packages": {"b-1.0-0.tar.bz2": {}}}')
+    os.utime(source, (time.time() + 10, time.time() + 10))
+    print('changed, same size', fetch(url, path))
+
+    # Interrupted download, resumed with a range request
+    data = os.urandom(2 ** 20)
+    with open(source, 'wb') as f:
+        f.write(data)
+    os.utime(source, (time.time() + 20, time.time() + 20))
+
+    def interrupt(progress_size, total_size):
+        if progress_size > total_size // 2:
+            raise IOError('Connection lost')
+
+    try:
+        fetch(url, path, chunk_size=2 ** 16, progress_callback=interrupt)
+    except IOError as error:
+        print('interrupted', error, os.path.getsize(partial_path(path)))
+    print('resumed', fetch(url, path), server.log[-2:])
+
+    with open(path, 'rb') as f:
+        print('complete', f.read() == data,
+              os.path.isfile(partial_path(path)))
+    server.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    test()
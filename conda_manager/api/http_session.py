@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Shared pooled HTTP session.
+
+Every requests based network call goes through a single `requests.Session`
+so connections (and their DNS, TCP and TLS setup) are kept alive and reused
+across calls and worker threads. The session retries failed connections and
+server errors, and applies a default timeout to every request.
+"""
+
+# Standard library imports
+import threading
+
+# Third party imports
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+
+# Local imports
+from conda_manager.utils.logs import logger
+
+
+# Connections kept alive per host
+MAX_CONNECTIONS_PER_HOST = 8
+
+# Number of hosts whose connection pools are kept
+MAX_HOSTS = 32
+
+# Retries on connection errors and on these status codes
+RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Connect and read timeouts in seconds
+TIMEOUT = (10, 60)
+
+
+def _retry(retries, backoff_factor):
+    """Return the retry policy for idempotent requests."""
+    kwargs = dict(total=retries, connect=retries, read=retries,
+                  status=retries, backoff_factor=backoff_factor,
+                  status_forcelist=RETRY_STATUS_CODES, raise_on_status=False)
+    try:
+        return Retry(allowed_methods=frozenset(['HEAD', 'GET']), **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=frozenset(['HEAD', 'GET']), **kwargs)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTP adapter with a default timeout and connection reuse counters."""
+
+    def __init__(self, timeout=TIMEOUT, **kwargs):
+        """HTTP adapter with a default timeout and connection counters."""
+        self.timeout = timeout
+        super(PooledHTTPAdapter, self).__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        """Override requests method to apply the default timeout."""
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(PooledHTTPAdapter, self).send(request, **kwargs)
+
+    def _pools(self):
+        """Return the live connection pools, direct and through proxies."""
+        managers = [self.poolmanager] + list(self.proxy_manager.values())
+        pools = []
+        for manager in managers:
+            container = manager.pools
+            for key in container.keys():
+                pool = container.get(key)
+                if pool is not None:
+                    pools.append(pool)
+        return pools
+
+    def stats(self):
+        """
+        Return the connection counters per host.
+
+        For each host the number of requests sent, connections opened and
+        requests that reused an open connection are given.
+        """
+        stats = {}
+        for pool in self._pools():
+            host = '{0}://{1}:{2}'.format(pool.scheme, pool.host, pool.port)
+            host_stats = stats.setdefault(host, {'requests': 0,
+                                                 'connections': 0,
+                                                 'reused': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['connections'] += pool.num_connections
+            host_stats['reused'] += max(pool.num_requests -
+                                        pool.num_connections, 0)
+        return stats
+
+
+class _HTTPSession(requests.Session):
+    """Thread safe requests session with pooled connections and retries."""
+
+    def __init__(self, max_connections_per_host=MAX_CONNECTIONS_PER_HOST,
+                 retries=RETRIES, backoff_factor=RETRY_BACKOFF,
+                 timeout=TIMEOUT):
+        """Thread safe requests session with pooled connections."""
+        super(_HTTPSession, self).__init__()
+        # Connection pools are thread safe, cookies and settings are not
+        # changed after creation
+        self._adapter = PooledHTTPAdapter(
+            timeout=timeout,
+            pool_connections=MAX_HOSTS,
+            pool_maxsize=max_connections_per_host,
+            pool_block=True,
+            max_retries=_retry(retries, backoff_factor),
+            )
+        self.mount('http://', self._adapter)
+        self.mount('https://', self._adapter)
+
+    def stats(self):
+        """Return the connection counters per host."""
+        return self._adapter.stats()
+
+    def log_stats(self):
+        """Log the connection counters per host."""
+        for host, host_stats in sorted(self.stats().items()):
+            logger.debug(str((host, host_stats)))
+
+
+HTTP_SESSION = None
+_HTTP_SESSION_LOCK = threading.Lock()
+
+
+def HTTPSession(**kwargs):
+    """Shared pooled HTTP session."""
+    global HTTP_SESSION
+
+    with _HTTP_SESSION_LOCK:
+        if HTTP_SESSION is None:
+            HTTP_SESSION = _HTTPSession(**kwargs)
+
+    return HTTP_SESSION
+
+
+# --- Local testing
+# -----------------------------------------------------------------------------
+def test():  # pragma: no cover
+    """Probe a local server from several threads and print the counters."""
+    import os
+    import tempfile
+    import time
+
+    from conda_manager.api.http_cache import _serve
+
+    served = tempfile.mkdtemp()
+    with open(os.path.join(served, 'repodata.json'), 'w') as f:
+        f.write('{}')
+
+    server = _serve(served)
+    url = 'http://127.0.0.1:{0}/repodata.json'.format(server.server_port)
+    session = HTTPSession()
+
+    def probe():
+        for __ in range(25):
+            session.get(url).close()
+
+    t0 = time.time()
+    threads = [threading.Thread(target=probe) for __ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print('pooled: {0:.2f}s'.format(time.time() - t0), session.stats())
+
+    t0 = time.time()
+    for __ in range(100):
+        requests.get(url).close()
+    print('bare: {0:.2f}s'.format(time.time() - t0))
+    server.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    test()
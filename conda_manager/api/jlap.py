@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Incremental repodata updates from jlap patch logs.
+
+Next to `repodata.json` a channel may publish `repodata.jlap`, a log of JSON
+Patch (RFC 6902) documents that grows as the repodata changes::
+
+    <initial hash>
+    {"from": <hash>, "to": <hash>, "patch": [...]}
+    ...
+    {"url": "repodata.json", "latest": <hash>}
+    <checksum>
+
+Each line is hashed with blake2b-256, keyed with the hash of the line before
+it, and the checksum is the hash of the metadata line. Repodata hashes are
+blake2b-256 digests of the `repodata.json` content.
+
+Once a channel was downloaded in full, only the new lines of its log are
+requested (with a Range request) and the patches leading from the local
+repodata to the latest one are applied to it. Any mismatch falls back to a
+full download.
+"""
+
+# Standard library imports
+import binascii
+import copy
+import hashlib
+import json
+import os
+import tempfile
+
+# Third party imports
+import requests
+
+# Local imports
+from conda_manager.api import http_cache
+from conda_manager.utils.logs import logger
+
+
+JLAP_STATE_SUFFIX = '.jlap.json'
+DIGEST_SIZE = 32
+JLAP_AVAILABLE = hasattr(hashlib, 'blake2b')
+
+
+class JLAPError(Exception):
+    """Invalid patch log, or no patches leading to the latest repodata."""
+
+    pass
+
+
+def jlap_url(url):
+    """Return the url of the patch log of the repodata.json `url`."""
+    return url[:-len('.json')] + '.jlap'
+
+
+def _keyed_hash(data, key):
+    """Return the blake2b-256 digest of `data`, keyed with `key`."""
+    return hashlib.blake2b(data, key=key, digest_size=DIGEST_SIZE).digest()
+
+
+def _hex(digest):
+    """Return `digest` as an hexadecimal string."""
+    return binascii.hexlify(digest).decode('ascii')
+
+
+def file_hash(path, chunk_size=2 ** 20):
+    """Return the blake2b-256 hexadecimal digest of the file at `path`."""
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_jlap(data, iv=None, offset=0):
+    """
+    Verify and parse the patch log `data`.
+
+    If `data` is the tail of a log starting at `offset`, `iv` is the hash
+    of the line before it, otherwise the first line gives the initial hash.
+
+    Returns the patches, the metadata, the offset of the metadata line and
+    the hash of the line before it, from where the next tail is verified.
+    """
+    lines = data.split(b'\n')
+    if lines and not lines[-1]:
+        lines.pop()
+
+    pos = offset
+    try:
+        if iv is None:
+            first = lines.pop(0)
+            iv = binascii.unhexlify(first.strip())
+            pos += len(first) + 1
+    except (IndexError, TypeError, ValueError):
+        raise JLAPError('Invalid initial hash')
+
+    if len(lines) < 2:
+        raise JLAPError('Truncated patch log')
+
+    key = iv
+    patch_lines, metadata_line, checksum = lines[:-2], lines[-2], lines[-1]
+    for line in patch_lines:
+        key = _keyed_hash(line, key)
+        pos += len(line) + 1
+
+    if _hex(_keyed_hash(metadata_line, key)) != \
+            checksum.strip().decode('ascii', 'replace'):
+        raise JLAPError('Checksum mismatch')
+
+    try:
+        patches = [json.loads(line.decode('utf-8')) for line in patch_lines]
+        metadata = json.loads(metadata_line.decode('utf-8'))
+    except ValueError as error:
+        raise JLAPError(str(error))
+
+    return patches, metadata, pos, key
+
+
+def find_patches(patches, have, latest):
+    """Return the patches leading from hash `have` to hash `latest`."""
+    by_target = dict((patch.get('to'), patch) for patch in patches)
+    chain = []
+    target = latest
+    while target != have:
+        patch = by_target.get(target)
+        if patch is None or len(chain) > len(patches):
+            raise JLAPError('No patches from {0} to {1}'.format(have,
+                                                                 latest))
+        chain.append(patch)
+        target = patch.get('from')
+
+    chain.reverse()
+    return chain
+
+
+# --- JSON Patch
+# -----------------------------------------------------------------------------
+def _pointer(path):
+    """Split a JSON pointer into its unescaped parts."""
+    if not path:
+        return []
+    if not path.startswith('/'):
+        raise JLAPError('Invalid JSON pointer {0!r}'.format(path))
+    return [part.replace('~1', '/').replace('~0', '~')
+            for part in path[1:].split('/')]
+
+
+def _child(value, part):
+    """Return the member or item `part` of `value`."""
+    if isinstance(value, list):
+        return value[int(part)]
+    return value[part]
+
+
+def _get(document, path):
+    """Return the value at `path` in `document`."""
+    value = document
+    for part in _pointer(path):
+        value = _child(value, part)
+    return value
+
+
+def _add(document, path, value):
+    """Add `value` at `path`, returns the updated document."""
+    parts = _pointer(path)
+    if not parts:
+        return value
+
+    parent = document
+    for part in parts[:-1]:
+        parent = _child(parent, part)
+
+    key = parts[-1]
+    if isinstance(parent, list):
+        if key == '-':
+            parent.append(value)
+        else:
+            index = int(key)
+            if not 0 <= index <= len(parent):
+                raise IndexError(index)
+            parent.insert(index, value)
+    else:
+        parent[key] = value
+    return document
+
+
+def _remove(document, path):
+    """Remove the value at `path`, returns it."""
+    parts = _pointer(path)
+    if not parts:
+        raise JLAPError('Can not remove the whole document')
+
+    parent = document
+    for part in parts[:-1]:
+        parent = _child(parent, part)
+
+    if isinstance(parent, list):
+        return parent.pop(int(parts[-1]))
+    return parent.pop(parts[-1])
+
+
+def apply_patch(document, operations):
+    """Apply the JSON Patch `operations` to `document`, returns it."""
+    for operation in operations:
+        op = operation.get('op')
+        path = operation.get('path', '')
+        try:
+            if op == 'add':
+                document = _add(document, path, operation['value'])
+            elif op == 'remove':
+                _remove(document, path)
+            elif op == 'replace':
+                if path:
+                    _remove(document, path)
+                document = _add(document, path, operation['value'])
+            elif op == 'move':
+                value = _remove(document, operation['from'])
+                document = _add(document, path, value)
+            elif op == 'copy':
+                value = copy.deepcopy(_get(document, operation['from']))
+                document = _add(document, path, value)
+            elif op == 'test':
+                if _get(document, path) != operation['value']:
+                    raise JLAPError('Test failed at {0!r}'.format(path))
+            else:
+                raise JLAPError('Unknown operation {0!r}'.format(op))
+        except (AttributeError, IndexError, KeyError, TypeError,
+                ValueError) as error:
+            raise JLAPError('Can not {0} {1!r}: {2!r}'.format(op, path, error))
+
+    return document
+
+
+# --- Local state
+# -----------------------------------------------------------------------------
+def state_path(path):
+    """Return the path of the patch log state of the repodata at `path`."""
+    return path + JLAP_STATE_SUFFIX
+
+
+def load_state(path, url):
+    """
+    Return the patch log state of the repodata at `path`.
+
+    The state holds the `hash` of the local repodata and the `pos` and `iv`
+    from where the log of `url` is read next. It is empty if unknown.
+    """
+    if not os.path.isfile(path) or not os.path.isfile(state_path(path)):
+        return {}
+
+    try:
+        with open(state_path(path), 'r') as f:
+            state = json.load(f)
+    except Exception as error:
+        logger.error(str((state_path(path), error)))
+        return {}
+
+    if state.get('url') != url:
+        return {}
+
+    return state
+
+
+def save_state(path, state):
+    """Store the patch log `state` of the repodata at `path`."""
+    try:
+        with open(state_path(path), 'w') as f:
+            json.dump(state, f, sort_keys=True, indent=4)
+    except Exception as error:
+        logger.error(str((state_path(path), error)))
+
+
+def remove_state(path):
+    """Forget the patch log state of the repodata at `path`."""
+    if os.path.isfile(state_path(path)):
+        os.remove(state_path(path))
+
+
+# --- Download
+# -----------------------------------------------------------------------------
+def _write_json(path, document):
+    """Write `document` to `path`, replacing it in a single step."""
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp',
+                                     prefix=os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(document, f)
+            f.flush()
+            os.fsync(f.fileno())
+        http_cache.replace_file(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    # The validators of the downloaded file do not apply any more
+    metadata_path = http_cache.cache_metadata_path(path)
+    if os.path.isfile(metadata_path):
+        os.remove(metadata_path)
+
+
+def _get_log(url, session, state=None, **kwargs):
+    """Fetch the patch log of `url`, only its new lines given a `state`."""
+    headers = {}
+    if state:
+        headers['Range'] = 'bytes={0}-'.format(state['pos'])
+
+    log_url = jlap_url(url)
+    r = session.get(log_url, headers=headers, **kwargs)
+    try:
+        if r.status_code == 206 and state:
+            return parse_jlap(r.content, binascii.unhexlify(state['iv']),
+                              state['pos'])
+        elif r.status_code == 200:
+            return parse_jlap(r.content)
+        elif r.status_code == 416:
+            raise JLAPError('The patch log was truncated')
+        raise http_cache.HTTPStatusError(log_url, r.status_code)
+    finally:
+        r.close()
+
+
+def _update(url, path, state, session, **kwargs):
+    """Patch the repodata at `path` up to the latest one."""
+    patches, metadata, pos, iv = _get_log(url, session, state, **kwargs)
+    latest = metadata.get('latest')
+
+    changed = latest != state['hash']
+    if changed:
+        chain = find_patches(patches, state['hash'], latest)
+        with open(path, 'rb') as f:
+            document = json.loads(f.read().decode('utf-8'))
+        for patch in chain:
+            document = apply_patch(document, patch.get('patch', []))
+        _write_json(path, document)
+
+    state.update(hash=latest, pos=pos, iv=_hex(iv))
+    save_state(path, state)
+    return changed
+
+
+def _download(url, path, session, **kwargs):
+    """Download the repodata at `url` in full and start following its log."""
+    # Without a patch log there is no point in the plain repodata
+    patches, metadata, pos, iv = _get_log(url, session, **kwargs)
+
+    changed = http_cache.fetch(url, path, session=session, raise_errors=True,
+                               **kwargs)
+    digest = file_hash(path)
+    state = {'url': url, 'hash': digest, 'pos': pos, 'iv': _hex(iv)}
+
+    try:
+        find_patches(patches, digest, metadata.get('latest'))
+    except JLAPError:
+        # Not in the log, patches could never be applied to it
+        remove_state(path)
+    else:
+        save_state(path, state)
+
+    return changed
+
+
+def fetch(url, path, session=None, **kwargs):
+    """
+    Update the repodata at `path` from the repodata.json `url`.
+
+    The repodata is patched with the new lines of its patch log if it is
+    known, and downloaded in full otherwise or if patching fails. Returns
+    True if the local repodata changed. An HTTPStatusError is raised if
+    the channel has no patch log.
+
+    `session` is used to make the requests (`requests` module by default)
+    and `kwargs` are passed to its `get` method.
+    """
+    session = session if session is not None else requests
+    state = load_state(path, url)
+
+    if state:
+        try:
+            return _update(url, path, state, session, **kwargs)
+        except JLAPError as error:
+            logger.error(str((url, error)))
+            remove_state(path)
+
+    try:
+        return _download(url, path, session, **kwargs)
+    except JLAPError as error:
+        logger.error(str((url, error)))
+        remove_state(path)
+        return http_cache.fetch(url, path, session=session,
+                                raise_errors=True, **kwargs)
+
+
+# --- Local testing
+# -----------------------------------------------------------------------------
+def _write_jlap(path, iv, patches, latest):  # pragma: no cover
+    """Write a patch log to `path`."""
+    lines = [_hex(iv).encode('ascii')]
+    lines += [json.dumps(patch).encode('utf-8') for patch in patches]
+    lines.append(json.dumps({'url': 'repodata.json',
+                             'latest': latest}).encode('utf-8'))
+
+    key = iv
+    for line in lines[1:]:
+        key = _keyed_hash(line, key)
+    lines.append(_hex(key).encode('ascii'))
+
+    with open(path, 'wb') as f:
+        f.write(b'\n'.join(lines) + b'\n')
+
+
+def test():  # pragma: no cover
+    """Follow the patch log of a synthetic channel on a local server."""
+    import random
+
+    served = tempfile.mkdtemp()
+    repodata_path = os.path.join(served, 'repodata.json')
+    jlap_path = os.path.join(served, 'repodata.jlap')
+    rnd = random.Random(0)
+
+    def record(i):
+        return {'name': 'pkg{0}'.format(i), 'version': '1.0',
+                'build': 'py_0', 'size': rnd.randint(1000, 10 ** 7),
+                'depends': ['python']}
+
+    def publish(document):
+        with open(repodata_path, 'w') as f:
+            json.dump(document, f, indent=1)
+        return file_hash(repodata_path)
+
+    document = {'info': {'subdir': 'noarch'},
+                'packages': dict(('pkg{0}-1.0-py_0.tar.bz2'.format(i),
+                                  record(i)) for i in range(20000))}
+    iv = os.urandom(DIGEST_SIZE)
+    patches = []
+    digest = publish(document)
+    _write_jlap(jlap_path, iv, patches, digest)
+
+    server = http_cache._serve(served)
+    url = 'http://127.0.0.1:{0}/repodata.json'.format(server.server_port)
+    path = os.path.join(tempfile.mkdtemp(), 'repodata.json')
+    print('full download', fetch(url, path), server.log,
+          os.path.getsize(path))
+
+    # Three new packages
+    operations = []
+    for i in range(20000, 20003):
+        filename = 'pkg{0}-1.0-py_0.tar.bz2'.format(i)
+        document['packages'][filename] = record(i)
+        operations.append({'op': 'add', 'path': '/packages/' + filename,
+                           'value': document['packages'][filename]})
+    new_digest = publish(document)
+    patches.append({'from': digest, 'to': new_digest, 'patch': operations})
+    _write_jlap(jlap_path, iv, patches, new_digest)
+
+    del server.log[:]
+    print('patched', fetch(url, path), server.log)
+    with open(path, 'r') as f:
+        print('same content', json.load(f) == document)
+
+    # A patch that does not lead to the local repodata
+    digest, new_digest = new_digest, _hex(os.urandom(DIGEST_SIZE))
+    patches.append({'from': _hex(os.urandom(DIGEST_SIZE)), 'to': new_digest,
+                    'patch': []})
+    document['packages'].pop('pkg0-1.0-py_0.tar.bz2')
+    publish(document)
+    _write_jlap(jlap_path, iv, patches, new_digest)
+
+    del server.log[:]
+    print('fallback', fetch(url, path), server.log)
+    with open(path, 'r') as f:
+        print('same content', json.load(f) == document)
+    server.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    test()
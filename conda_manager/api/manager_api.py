@@ -11,6 +11,7 @@
 import json
 import os
 import tempfile
+import time
 
 # Third party imports
 from qtpy.QtCore import QObject, Signal
@@ -19,6 +20,27 @@ from qtpy.QtCore import QObject, Signal
 from conda_manager.api.client_api import ClientAPI
 from conda_manager.api.conda_api import CondaAPI
 from conda_manager.api.download_api import DownloadAPI, RequestsDownloadAPI
+from conda_manager.api.download_scheduler import DownloadScheduler
+from conda_manager.api.jlap import JLAP_AVAILABLE
+from conda_manager.api.repodata import (INCREMENTAL_REPODATA_FORMATS,
+                                        repodata_formats)
+from conda_manager.api.shards import (SHARDS_AVAILABLE, SHARDS_INDEX_FILENAME,
+                                      SHARDS_REPODATA_FILENAME, index_path,
+                                      load_index)
+from conda_manager.utils.logs import logger
+
+
+# Repodata formats found missing per channel, see `_channel_formats`
+REPODATA_FORMATS_FILENAME = 'repodata_formats.json'
+
+# Look again for a missing format after this many seconds
+FORMAT_RECHECK_INTERVAL = 7 * 24 * 60 * 60
+
+# Status codes telling that a channel does not publish a format
+MISSING_STATUS_CODES = (404, 410)
+
+# Folder of the shards cache, shared by all channels
+SHARDS_DIRNAME = 'shards'
 
 
 class _ManagerAPI(QObject):
@@ -27,6 +49,9 @@ class _ManagerAPI(QObject):
     sig_repodata_updated = Signal(object)
     sig_repodata_errored = Signal()
 
+    # List of channels answered with an error status (invalid channels)
+    sig_repodata_invalid = Signal(object)
+
     def __init__(self):
         """Anaconda Manager API process worker."""
         super(_ManagerAPI, self).__init__()
@@ -34,17 +59,26 @@ class _ManagerAPI(QObject):
         # API's
         self._conda_api = CondaAPI()
         self._client_api = ClientAPI()
-        self._download_api = DownloadAPI(load_rc_func=self._conda_api.load_rc)
+        self._download_api = DownloadAPI(
+            load_rc_func=self._conda_api.load_rc,
+            rc_paths=self._rc_paths)
         self._requests_download_api = RequestsDownloadAPI(
             load_rc_func=self._conda_api.load_rc)
+        self._download_scheduler = DownloadScheduler(
+            self._download_repodata_url)
         self.ROOT_PREFIX = self._conda_api.ROOT_PREFIX
+        self._conda_api.sig_info_updated.connect(self._conda_info_updated)
 
         # Vars
-        self._checking_repos = None
         self._data_directory = None
-        self._files_downloaded = None
+        self._incremental = False
+        self._repodata_batch = None
         self._repodata_files = None
-        self._valid_repos = None
+        self._repodata_formats = None
+        self._repodata_invalid = None
+        self._repodata_pending = None
+        self._shard_names = set()
+        self._sharded = False
 
         # Expose some methods for convenient access. Methods return a worker
         self.conda_create = self._conda_api.create
@@ -61,6 +95,7 @@ class _ManagerAPI(QObject):
         self.pip_remove = self._conda_api.pip_remove
 
         # No workers are returned for these methods
+        self.conda_cancel = self._conda_api.cancel
         self.conda_clear_lock = self._conda_api.clear_lock
         self.conda_environment_exists = self._conda_api.environment_exists
         self.conda_get_envs = self._conda_api.get_envs
@@ -68,6 +103,10 @@ class _ManagerAPI(QObject):
         self.conda_get_prefix_envname = self._conda_api.get_prefix_envname
         self.conda_package_version = self._conda_api.package_version
         self.conda_platform = self._conda_api.get_platform
+        self.conda_set_helper = self._conda_api.set_conda_helper
+        self.conda_queue_stats = self._conda_api.queue_stats
+        self.conda_get_info = self._conda_api.get_info
+        self.conda_clear_solve_cache = self._conda_api.clear_solve_cache
 
         # These download methods return a worker
         get_api_info = self._requests_download_api.get_api_info
@@ -103,73 +142,148 @@ class _ManagerAPI(QObject):
 
     # --- Helper methods
     # -------------------------------------------------------------------------
-    def _set_repo_urls_from_channels(self, channels):
+    def _rc_paths(self):
+        """Return the current paths of the conda configuration files."""
+        return [self._conda_api.user_rc_path, self._conda_api.sys_rc_path]
+
+    def _conda_info_updated(self, info):
+        """Callback for a refreshed `conda info` snapshot."""
+        self.ROOT_PREFIX = self._conda_api.ROOT_PREFIX
+
+    def _set_repo_urls_from_channels(self, channels, latest_only=False):
         """
         Convert a channel into a normalized repo name including.
 
-        Channels are assumed in normalized url form.
+        Channels are assumed in normalized url form. The best repodata
+        format already downloaded for each channel is used, if any.
         """
         repos = []
-        sys_platform = self._conda_api.get_platform()
 
         for channel in channels:
-            url = '{0}/{1}/repodata.json.bz2'.format(channel, sys_platform)
+            candidates = self._repodata_candidates(channel, latest_only)
+            for url in candidates:
+                if os.path.isfile(self._repo_url_to_path(url)):
+                    break
+            else:
+                url = candidates[0]
             repos.append(url)
 
         return repos
 
-    def _check_repos(self, repos):
-        """Check if repodata urls are valid."""
-        self._checking_repos = []
-        self._valid_repos = []
-
-        for repo in repos:
-            worker = self.download_is_valid_url(repo)
-            worker.sig_finished.connect(self._repos_checked)
-            worker.repo = repo
-            self._checking_repos.append(repo)
-
-    def _repos_checked(self, worker, output, error):
-        """Callback for _check_repos."""
-        if worker.repo in self._checking_repos:
-            self._checking_repos.remove(worker.repo)
+    def _channel_formats_path(self):
+        """Return the path of the file with the missing repodata formats."""
+        return os.sep.join([self._data_directory, REPODATA_FORMATS_FILENAME])
 
-        if output:
-            self._valid_repos.append(worker.repo)
+    def _channel_formats(self):
+        """
+        Return the repodata formats known to be missing, per channel.
 
-        if len(self._checking_repos) == 0:
-            self._download_repodata(self._valid_repos)
+        Each channel maps the missing repodata filenames to the time they
+        were found missing.
+        """
+        if self._repodata_formats is None:
+            self._repodata_formats = {}
+            path = self._channel_formats_path()
+            if os.path.isfile(path):
+                try:
+                    with open(path, 'r') as f:
+                        self._repodata_formats = json.load(f)
+                except Exception as error:
+                    logger.error(str((path, error)))
+
+        return self._repodata_formats
+
+    def _save_channel_formats(self):
+        """Store the repodata formats known to be missing, per channel."""
+        path = self._channel_formats_path()
+        try:
+            with open(path, 'w') as f:
+                json.dump(self._channel_formats(), f, sort_keys=True,
+                          indent=4, separators=(',', ': '))
+        except Exception as error:
+            logger.error(str((path, error)))
+
+    def _repodata_candidates(self, channel, latest_only=False):
+        """Return the repodata urls to try for `channel`, best first."""
+        missing = self._channel_formats().get(channel, {})
+        platform = self._conda_api.get_platform()
+        now = time.time()
+        filenames = repodata_formats(latest_only=latest_only,
+                                     incremental=self._incremental)
+        if self._sharded:
+            # Without package names only the shard index is downloaded, its
+            # names are given by `sharded_package_names`
+            filenames = [SHARDS_INDEX_FILENAME] + filenames
+
+        candidates = []
+        for filename in filenames:
+            if now - missing.get(filename, 0) > FORMAT_RECHECK_INTERVAL:
+                candidates.append(filename)
+
+        # The last resort is always tried
+        if not candidates:
+            candidates = filenames[-1:]
+
+        return ['{0}/{1}/{2}'.format(channel, platform, filename)
+                for filename in candidates]
 
     def _repo_url_to_path(self, repo):
         """Convert a `repo` url to a file path for local storage."""
+        if repo.endswith(SHARDS_INDEX_FILENAME):
+            # The packages fetched from the shards are stored as repodata
+            repo = (repo[:-len(SHARDS_INDEX_FILENAME)] +
+                    SHARDS_REPODATA_FILENAME)
+
         repo = repo.replace('http://', '')
         repo = repo.replace('https://', '')
         repo = repo.replace('/', '_')
 
         return os.sep.join([self._data_directory, repo])
 
-    def _download_repodata(self, checked_repos):
-        """Dowload repodata."""
-        self._files_downloaded = []
+    def _download_repodata_url(self, url, path):
+        """Start the download of the repodata `url`, returns a worker."""
+        filename = url.split('/')[-1]
+        if filename == SHARDS_INDEX_FILENAME:
+            cache_dir = os.sep.join([self._data_directory, SHARDS_DIRNAME])
+            return self._requests_download_api.download_shards(
+                url, path, sorted(self._shard_names), cache_dir=cache_dir)
+        elif filename in INCREMENTAL_REPODATA_FORMATS:
+            return self._requests_download_api.download_incremental(url, path)
+        return self._download_api.download(url, path)
+
+    def _download_repodata(self, channels, latest_only=False):
+        """
+        Download the repodata of `channels`.
+
+        A single conditional GET per channel tells at once if the channel is
+        valid, if the local copy is up to date and, if not, its new content.
+        The best format published by the channel is used, formats found
+        missing are remembered so they are not asked for again.
+        """
         self._repodata_files = []
-        self.__counter = -1
-
-        if checked_repos:
-            for repo in checked_repos:
-                path = self._repo_url_to_path(repo)
-                self._files_downloaded.append(path)
-                self._repodata_files.append(path)
-                worker = self.download_async(repo, path)
-                worker.url = repo
-                worker.path = path
-                worker.sig_finished.connect(self._repodata_downloaded)
+        self._repodata_invalid = []
+        self._repodata_pending = {}
+
+        if channels:
+            self._download_repodata_formats(
+                [(channel, self._repodata_candidates(channel, latest_only))
+                 for channel in channels])
         else:
-            # Empty, maybe there is no internet connection
-            # Load information from conda-meta and save that file
-            path = self._get_repodata_from_meta()
-            self._repodata_files = [path]
             self._repodata_downloaded()
 
+    def _download_repodata_formats(self, channel_candidates):
+        """Download the first of the candidate repodata urls per channel."""
+        items = []
+        for channel, candidates in channel_candidates:
+            url = candidates[0]
+            self._repodata_pending[url] = (channel, candidates[1:])
+            items.append((url, self._repo_url_to_path(url)))
+
+        # Channels are downloaded concurrently, notify once all are done
+        batch = self._download_scheduler.download(items)
+        batch.sig_finished.connect(self._repodata_downloaded)
+        self._repodata_batch = batch
+
     def _get_repodata_from_meta(self):
         """Generate repodata from local meta files."""
         path = os.sep.join([self.ROOT_PREFIX, 'conda-meta'])
@@ -200,20 +314,57 @@ class _ManagerAPI(QObject):
 
         return meta_repodata_path
 
-    def _repodata_downloaded(self, worker=None, output=None, error=None):
+    def _repodata_downloaded(self, batch=None, paths=None, errors=None):
         """Callback for _download_repodata."""
-        if worker:
-            self._files_downloaded.remove(worker.path)
-
-            if worker.path in self._files_downloaded:
-                self._files_downloaded.remove(worker.path)
+        if batch is not None:
+            if batch is not self._repodata_batch:
+                # Superseded by a newer update
+                return
+
+            retry = []
+            for url, path in paths.items():
+                channel, candidates = self._repodata_pending.pop(url)
+                status = batch.statuses.get(url)
+                if status in MISSING_STATUS_CODES and candidates:
+                    # The channel does not publish this format
+                    missing = self._channel_formats().setdefault(channel, {})
+                    missing[url.split('/')[-1]] = time.time()
+                    retry.append((channel, candidates))
+                elif status is not None and status >= 400:
+                    self._repodata_invalid.append(channel)
+                elif os.path.isfile(path):
+                    # Up to date, or downloaded
+                    self._repodata_files.append(path)
+                else:
+                    # No connection, use a copy in another format if any
+                    for candidate in candidates:
+                        candidate_path = self._repo_url_to_path(candidate)
+                        if os.path.isfile(candidate_path):
+                            self._repodata_files.append(candidate_path)
+                            break
+
+            if retry:
+                self._download_repodata_formats(retry)
+                return
+
+            self._save_channel_formats()
+
+        self._repodata_batch = None
+
+        if self._repodata_invalid:
+            self.sig_repodata_invalid.emit(self._repodata_invalid)
+
+        if not self._repodata_files:
+            # Empty, maybe there is no internet connection
+            # Load information from conda-meta and save that file
+            self._repodata_files = [self._get_repodata_from_meta()]
 
-        if len(self._files_downloaded) == 0:
-            self.sig_repodata_updated.emit(list(set(self._repodata_files)))
+        self._conda_api.clear_solve_cache()
+        self.sig_repodata_updated.emit(list(set(self._repodata_files)))
 
     # --- Public API
     # -------------------------------------------------------------------------
-    def repodata_files(self, channels=None):
+    def repodata_files(self, channels=None, latest_only=False):
         """
         Return the repodata paths based on `channels` and the `data_directory`.
 
@@ -222,7 +373,8 @@ class _ManagerAPI(QObject):
         if channels is None:
             channels = self.conda_get_condarc_channels()
 
-        repodata_urls = self._set_repo_urls_from_channels(channels)
+        repodata_urls = self._set_repo_urls_from_channels(
+            channels, latest_only=latest_only)
 
         repopaths = []
 
@@ -236,12 +388,68 @@ class _ManagerAPI(QObject):
         """Set the directory where repodata and metadata are stored."""
         self._data_directory = data_directory
 
-    def update_repodata(self, channels=None):
-        """Update repodata from channels or use condarc channels if None."""
+    def update_repodata(self, channels=None, latest_only=False, names=None):
+        """
+        Update repodata from channels or use condarc channels if None.
+
+        With `latest_only` the smaller current repodata, with only the latest
+        version of each package, is downloaded where channels publish it.
+
+        In sharded mode, the packages in `names` are added to the packages
+        fetched from the channels that publish shards.
+        """
+        if names:
+            self._shard_names.update(names)
+
+        # Solves made with the previous channels and repodata are outdated
+        self._conda_api.clear_solve_cache()
         norm_channels = self.conda_get_condarc_channels(channels=channels,
                                                         normalize=True)
-        repodata_urls = self._set_repo_urls_from_channels(norm_channels)
-        self._check_repos(repodata_urls)
+        self._download_repodata(norm_channels, latest_only=latest_only)
+
+    def set_incremental_updates(self, value):
+        """
+        Patch the repodata from the jlap logs of channels that publish one.
+
+        Disabled by default, needs blake2b hashes.
+        """
+        self._incremental = bool(value) and JLAP_AVAILABLE
+
+    def set_sharded_repodata(self, value):
+        """
+        Fetch only the repodata of some packages from channels with shards.
+
+        Instead of the full repodata of channels, only the shards of the
+        packages given to `update_repodata` (and of their dependencies) are
+        fetched. The packages not fetched yet are listed by
+        `sharded_package_names`. Disabled by default, needs msgpack and zstd.
+        """
+        self._sharded = bool(value) and SHARDS_AVAILABLE
+
+    def sharded_repodata(self):
+        """Return True if only the shards of some packages are fetched."""
+        return self._sharded
+
+    def sharded_package_names(self, channels=None):
+        """
+        Return the names of the packages published in the shards of channels.
+
+        Only channels whose shard index was already downloaded are included.
+        """
+        channels = self.conda_get_condarc_channels(channels=channels,
+                                                   normalize=True)
+        platform = self._conda_api.get_platform()
+        names = set()
+        for channel in channels:
+            url = '{0}/{1}/{2}'.format(channel, platform,
+                                       SHARDS_INDEX_FILENAME)
+            path = index_path(self._repo_url_to_path(url))
+            if os.path.isfile(path):
+                try:
+                    names.update(load_index(path)[1])
+                except Exception as error:
+                    logger.error(str((path, error)))
+        return names
 
     def update_metadata(self):
         """
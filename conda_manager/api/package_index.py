@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Compact storage for the merged package index.
+
+Instead of a dictionary of dictionaries per package, versions are stored once
+in a table of interned strings and each package is a slice of flat arrays of
+version ids and sizes. App metadata, which only a few packages have, is kept
+in sparse side tables.
+
+A `PackageIndex` behaves like the `{name: package_data}` dictionary used by
+the models and widgets, where `package_data` is built on access.
+
+The names and versions are the hot part of the index, needed to populate the
+packages table. The size of each version and the app metadata are details
+only needed by some dialogs, so they can be written to a separate file and
+read back one package at a time when they are first needed.
+"""
+
+# Standard library imports
+from array import array
+
+# Local imports
+from conda_manager.utils.logs import logger
+from conda_manager.utils.py3compat import pickle
+
+
+# Array type codes, sizes are stored as doubles as 'q' is not available on
+# Python 2 and 'l' is only 32 bits on Windows
+_ID_TYPECODE = 'l'
+_SIZE_TYPECODE = 'd'
+
+# Stored instead of sizes that are missing from the repodata
+_NO_SIZE = -1
+
+
+class InternTable(object):
+    """Table of unique strings addressed by their position."""
+
+    def __init__(self):
+        """Table of unique strings addressed by their position."""
+        self._strings = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, string_id):
+        return self._strings[string_id]
+
+    def intern(self, string):
+        """Return the id of `string`, adding it to the table if needed."""
+        try:
+            return self._ids[string]
+        except KeyError:
+            string_id = self._ids[string] = len(self._strings)
+            self._strings.append(string)
+            return string_id
+
+    def strings(self, string_ids):
+        """Return the list of strings for the given `string_ids`."""
+        return list(map(self._strings.__getitem__, string_ids))
+
+    def find(self, string):
+        """Return the id of `string` or `None` if not in the table."""
+        return self._ids.get(string)
+
+
+class DetailsFile(object):
+    """File with the details of the packages, stored at known offsets."""
+
+    def __init__(self, path):
+        """File with the details of the packages, stored at known offsets."""
+        self.path = path
+
+    @staticmethod
+    def write(f, token):
+        """Write the header of a details file identified by `token`."""
+        pickle.dump(token, f, pickle.HIGHEST_PROTOCOL)
+
+    def token(self):
+        """Return the token of the file or `None` if it can not be read."""
+        try:
+            with open(self.path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def read(self, token, offset, count=1):
+        """
+        Read `count` records from `offset` if the file is identified by
+        `token`.
+        """
+        with open(self.path, 'rb') as f:
+            if pickle.load(f) != token:
+                raise ValueError('Details file was replaced')
+            f.seek(offset)
+            return [pickle.load(f) for __ in range(count)]
+
+
+class SizesView(object):
+    """Read only `{version: size}` mapping of a package in the index."""
+
+    __slots__ = ('_index', '_position')
+
+    def __init__(self, index, position):
+        """Read only `{version: size}` mapping of a package in the index."""
+        self._index = index
+        self._position = position
+
+    def _find(self, version):
+        index = self._index
+        version_id = index._versions.find(version)
+        if version_id is not None:
+            start, end = index._bounds(self._position)
+            ids = index._version_ids[start:end]
+            sizes = index._details(self._position)[0]
+            if version_id in ids and len(sizes) == len(ids):
+                size = sizes[ids.index(version_id)]
+                return True, _NO_SIZE if size == _NO_SIZE else int(size)
+        return False, None
+
+    def __getitem__(self, version):
+        found, size = self._find(version)
+        if not found:
+            raise KeyError(version)
+        return u'' if size == _NO_SIZE else size
+
+    def __contains__(self, version):
+        return self._find(version)[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        start, end = self._index._bounds(self._position)
+        return end - start
+
+    def get(self, version, default=None):
+        """Return the size of `version` or `default`."""
+        found, size = self._find(version)
+        if not found:
+            return default
+        return u'' if size == _NO_SIZE else size
+
+    def keys(self):
+        """Return the versions of the package."""
+        return self._index._package_versions(self._position)
+
+    def values(self):
+        """Return the sizes of the package versions."""
+        return [self[version] for version in self.keys()]
+
+    def items(self):
+        """Return the `(version, size)` pairs of the package."""
+        return [(version, self[version]) for version in self.keys()]
+
+
+class PackageEntry(dict):
+    """
+    Package data built from the index.
+
+    The entry is a plain dictionary, but the first time an item is set or
+    deleted the entry is stored in the index, so that changes made by the
+    callers are kept.
+    """
+
+    def __init__(self, index, name, *args, **kwargs):
+        """Package data built from the index."""
+        super(PackageEntry, self).__init__(*args, **kwargs)
+        self._index = index
+        self._name = name
+
+    def _detach(self):
+        if self._index is not None:
+            self._index._overlay[self._name] = self
+            self._index = None
+
+    def __setitem__(self, key, value):
+        self._detach()
+        super(PackageEntry, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._detach()
+        super(PackageEntry, self).__delitem__(key)
+
+    def __reduce__(self):
+        return (dict, (dict(self), ))
+
+
+class PackageIndex(object):
+    """
+    Compact `{name: package_data}` mapping of packages.
+
+    `package_data` is a dictionary with the `versions` list (sorted), the
+    `size` of each version and the `type`, `app_entry` and `app_type` of the
+    app versions, plus the `home`, `license`, `summary` and `latest_version`
+    of the packages with metadata.
+
+    Packages set or modified by callers are kept in an overlay, the compact
+    tables are never modified once built and are shared between copies.
+
+    Once `write_details` has been called, the sizes and app metadata are not
+    pickled with the index. An unpickled index reads them from the file
+    given to `attach_details` when they are first needed.
+    """
+
+    def __init__(self, versions=None, metadata=None):
+        """Compact `{name: package_data}` mapping of packages."""
+        self._versions = versions if versions is not None else InternTable()
+        self._metadata = metadata if metadata else {}
+
+        # Compact tables
+        self._names = []
+        self._positions = {}
+        self._offsets = array(_ID_TYPECODE, [0])
+        self._version_ids = array(_ID_TYPECODE)
+        self._app_names = set()
+
+        # Details, in memory or read from a file on demand
+        self._sizes = array(_SIZE_TYPECODE)
+        self._apps = {}
+        self._details_offsets = None
+        self._details_token = None
+        self._details_file = None
+        self._details_cache = {}
+
+        # Changes made by the callers
+        self._overlay = {}
+        self._removed = set()
+
+    @classmethod
+    def from_packages(cls, packages, versions=None):
+        """Build an index from a `{name: package_data}` dictionary."""
+        index = cls(versions=versions)
+        for name in packages:
+            index._add(name, packages[name])
+        return index
+
+    # --- Building
+    # -------------------------------------------------------------------------
+    def _add(self, name, package):
+        """Add `package` data to the compact tables."""
+        sizes = package.get('size', {})
+        intern = self._versions.intern
+        for version in package.get('versions', []):
+            size = sizes.get(version, _NO_SIZE)
+            self._version_ids.append(intern(version))
+            self._sizes.append(size if isinstance(size, (int, float))
+                               else _NO_SIZE)
+        self._append_name(name)
+
+        types = package.get('type')
+        if types:
+            app_entry = package.get('app_entry', {})
+            app_type = package.get('app_type', {})
+            self._apps[name] = dict((version, (types[version],
+                                               app_entry.get(version),
+                                               app_type.get(version)))
+                                    for version in types)
+            self._app_names.add(name)
+
+    def _copy(self, index, name):
+        """Copy the data of `name` from another `index` with the same table."""
+        position = index._positions[name]
+        start, end = index._bounds(position)
+        sizes, apps = index._details(position)
+        if len(sizes) != end - start:
+            sizes = [_NO_SIZE] * (end - start)
+
+        self._version_ids.extend(index._version_ids[start:end])
+        self._sizes.extend(sizes)
+        self._append_name(name)
+        if apps:
+            self._apps[name] = apps
+            self._app_names.add(name)
+
+    def _append_name(self, name):
+        self._positions[name] = len(self._names)
+        self._names.append(name)
+        self._offsets.append(len(self._version_ids))
+
+    def replace(self, names, index):
+        """
+        Return a new index where packages in `names` are taken from `index`.
+
+        Packages in `names` missing from `index` are removed. Both indexes
+        must share the same version table.
+        """
+        names = set(names)
+        self.load_details()
+        index.load_details()
+
+        new = PackageIndex(versions=self._versions, metadata=self._metadata)
+        for name in self._names:
+            if name not in names:
+                new._copy(self, name)
+        for name in index._names:
+            if name in names:
+                new._copy(index, name)
+        return new
+
+    def copy(self, metadata=None):
+        """
+        Return a copy sharing the compact tables, with its own overlay.
+
+        If `metadata` is given, it is used for the `home`, `license`,
+        `summary` and `latest_version` of the packages.
+        """
+        new = PackageIndex.__new__(PackageIndex)
+        new.__dict__.update(self.__dict__)
+        if metadata is not None:
+            new._metadata = metadata
+        new._overlay = dict((name, dict(package)) for name, package
+                            in self._overlay.items())
+        new._removed = set(self._removed)
+        return new
+
+    @property
+    def version_table(self):
+        """The `InternTable` of versions used by the index."""
+        return self._versions
+
+    # --- Details
+    # -------------------------------------------------------------------------
+    def write_details(self, f, token):
+        """
+        Write the details of every package to the open file `f`.
+
+        `token` identifies the details file, see `DetailsFile`. The index
+        keeps its details in memory, but they will not be pickled anymore.
+        """
+        offsets = array(_ID_TYPECODE)
+        for position in range(len(self._names)):
+            offsets.append(f.tell())
+            pickle.dump(self._details(position), f, pickle.HIGHEST_PROTOCOL)
+        self._details_offsets = offsets
+        self._details_token = token
+
+    @property
+    def details_token(self):
+        """The token of the details file written by `write_details`."""
+        return self._details_token
+
+    def attach_details(self, details_file):
+        """Read the details not kept in memory from `details_file`."""
+        self._details_file = details_file
+        self._details_cache = {}
+
+    def load_details(self):
+        """Read all the details kept in the details file in memory."""
+        if self._sizes is not None:
+            return
+
+        sizes, apps = array(_SIZE_TYPECODE), {}
+        if self._names:
+            records = self._details_file.read(self._details_token,
+                                              self._details_offsets[0],
+                                              count=len(self._names))
+            for name, (package_sizes, package_apps) in zip(self._names,
+                                                           records):
+                sizes.extend(package_sizes)
+                if package_apps:
+                    apps[name] = package_apps
+
+        self._sizes, self._apps = sizes, apps
+
+    def _details(self, position):
+        """Return the `(sizes, apps)` details of the package at `position`."""
+        if self._sizes is not None:
+            start, end = self._bounds(position)
+            return (self._sizes[start:end],
+                    self._apps.get(self._names[position]))
+
+        try:
+            return self._details_cache[position]
+        except KeyError:
+            pass
+
+        try:
+            offset = self._details_offsets[position]
+            details = self._details_file.read(self._details_token, offset)[0]
+        except Exception as error:
+            logger.error(str(error))
+            details = ([], None)
+
+        self._details_cache[position] = details
+        return details
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._details_offsets is not None:
+            state['_sizes'] = None
+            state['_apps'] = None
+        state['_details_file'] = None
+        state['_details_cache'] = {}
+        state['_metadata'] = {}
+        return state
+
+    # --- Helpers
+    # -------------------------------------------------------------------------
+    def _bounds(self, position):
+        return self._offsets[position], self._offsets[position + 1]
+
+    def _package_versions(self, position):
+        start, end = self._bounds(position)
+        return self._versions.strings(self._version_ids[start:end])
+
+    def _entry(self, name):
+        """Build the package data of `name` from the compact tables."""
+        position = self._positions[name]
+        types, app_entries, app_types = {}, {}, {}
+        if name in self._app_names:
+            apps = self._details(position)[1] or {}
+            for version, app in apps.items():
+                types[version], app_entries[version], app_types[version] = app
+
+        entry = PackageEntry(self, name,
+                             versions=self._package_versions(position),
+                             size=SizesView(self, position),
+                             type=types,
+                             app_entry=app_entries,
+                             app_type=app_types,
+                             )
+
+        metadata = self._metadata.get(name)
+        if metadata is not None:
+            dict.update(entry,
+                        home=metadata.get('home', ''),
+                        license=metadata.get('license', ''),
+                        summary=metadata.get('summary', ''),
+                        latest_version=metadata.get('version'))
+        return entry
+
+    def sizes(self, name):
+        """Return the `{version: size}` mapping of `name`."""
+        if name in self._overlay:
+            return self._overlay[name].get('size', {})
+        elif name in self._positions and name not in self._removed:
+            return SizesView(self, self._positions[name])
+        raise KeyError(name)
+
+    # --- Mapping API
+    # -------------------------------------------------------------------------
+    def __getitem__(self, name):
+        if name in self._overlay:
+            return self._overlay[name]
+        elif name in self._positions and name not in self._removed:
+            return self._entry(name)
+        raise KeyError(name)
+
+    def __setitem__(self, name, package):
+        self._overlay[name] = package
+        self._removed.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._overlay.pop(name, None)
+        self._removed.add(name)
+
+    def __contains__(self, name):
+        return name in self._overlay or (name in self._positions and
+                                         name not in self._removed)
+
+    def __iter__(self):
+        for name in self._names:
+            if name not in self._removed or name in self._overlay:
+                yield name
+        for name in self._overlay:
+            if name not in self._positions:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _name in self)
+
+    def get(self, name, default=None):
+        """Return the package data of `name` or `default`."""
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def pop(self, name, *default):
+        """Remove `name` and return its package data."""
+        try:
+            package = self[name]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[name]
+        return package
+
+    def keys(self):
+        """Return the package names."""
+        return list(self)
+
+    def values(self):
+        """Return the package data of every package."""
+        return [self[name] for name in self]
+
+    def items(self):
+        """Return the `(name, package_data)` pairs."""
+        return [(name, self[name]) for name in self]
@@ -0,0 +1,712 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+# Copyright © 2014-2015 Gonzalo Peña-Castellanos (@goanpeca)
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""Streaming reader and merge helpers for conda repodata files."""
+
+# Standard library imports
+import atexit
+import bz2
+import codecs
+from itertools import chain
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+# Local imports
+from conda_manager.api.package_index import (DetailsFile, InternTable,
+                                              PackageIndex)
+from conda_manager.utils import sort_versions
+from conda_manager.utils.logs import logger
+from conda_manager.utils.py3compat import pickle
+
+# Optional zstd support, for `repodata.json.zst`
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+
+# Size of the compressed chunks read from disk at a time
+CHUNK_SIZE = 256 * 1024
+
+# Files are parsed in worker processes when they add up to this many bytes
+PARALLEL_MIN_SIZE = 4 * 1024 * 1024
+
+# Pool of worker processes parsing repodata files, started once when needed
+_POOL = None
+_POOL_LOCK = threading.Lock()
+WHITESPACE = u' \t\n\r'
+
+# Bump when the layout of the cached index changes
+INDEX_CACHE_VERSION = 4
+INDEX_CACHE_FILENAME = 'index.cache'
+INDEX_DETAILS_SUFFIX = '.details'
+
+# Repodata files published by channels, in order of preference. Zstd
+# compressed files are smaller than bz2 ones and much faster to decompress
+ZSTD_AVAILABLE = zstandard is not None or zstd is not None
+REPODATA_FORMATS = (['repodata.json.zst'] if ZSTD_AVAILABLE else []) + [
+    'repodata.json.bz2']
+
+# Only the latest version of each package, enough to list what is available
+CURRENT_REPODATA_FORMATS = ['current_repodata.json']
+
+# Plain repodata, kept up to date with the patches of its jlap log
+INCREMENTAL_REPODATA_FORMATS = ['repodata.json']
+
+
+class RepodataError(Exception):
+    """Malformed or truncated repodata file."""
+
+    pass
+
+
+class JSONStream(object):
+    """
+    Incremental JSON reader over a (possibly compressed) file.
+
+    Only the text needed for the value being decoded is kept in memory, so
+    objects with many members (like the repodata `packages` mapping) can be
+    walked one member at a time.
+    """
+
+    def __init__(self, fileobj, decompressor=None, chunk_size=CHUNK_SIZE):
+        """Incremental JSON reader over a (possibly compressed) file."""
+        self._file = fileobj
+        self._decompressor = decompressor
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._chunk_size = chunk_size
+        self._buffer = u''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Append the next chunk of text to the buffer, False at the end."""
+        if self._eof:
+            return False
+
+        raw = self._file.read(self._chunk_size)
+        if raw:
+            if self._decompressor is not None:
+                raw = self._decompressor.decompress(raw)
+            text = self._decoder.decode(raw)
+        else:
+            self._eof = True
+            text = self._decoder.decode(b'', True)
+
+        # Drop the text that was already consumed
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Return the next non whitespace character without consuming it."""
+        while True:
+            buf, pos = self._buffer, self._pos
+            size = len(buf)
+            while pos < size and buf[pos] in WHITESPACE:
+                pos += 1
+            self._pos = pos
+
+            if pos < size:
+                return buf[pos]
+            elif not self._fill():
+                raise RepodataError('Unexpected end of data')
+
+    def _expect(self, char):
+        """Consume `char` or raise an error if found something else."""
+        found = self._peek()
+        if found != char:
+            raise RepodataError('Expected {0!r} but found {1!r}'.format(
+                char, found))
+        self._pos += 1
+
+    def value(self):
+        """Decode and consume the next JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                # Incomplete value, read some more data and try again
+                if not self._fill():
+                    raise RepodataError('Invalid or truncated JSON data')
+                continue
+
+            # A number at the end of the buffer might be cut in half
+            if end == len(self._buffer) and self._fill():
+                continue
+
+            self._pos = end
+            return value
+
+    def keys(self):
+        """
+        Iterate over the keys of the next JSON object.
+
+        After receiving a key, its value must be consumed with `value`, `keys`
+        or `skip` before asking for the next one.
+        """
+        self._expect(u'{')
+        if self._peek() == u'}':
+            self._pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self._expect(u':')
+            yield key
+
+            char = self._peek()
+            self._pos += 1
+            if char == u'}':
+                return
+            elif char != u',':
+                raise RepodataError('Expected "," or "}}" but found '
+                                    '{0!r}'.format(char))
+
+    def skip(self):
+        """Consume the next JSON value, walking objects member by member."""
+        if self._peek() == u'{':
+            for _key in self.keys():
+                self.skip()
+        else:
+            self.value()
+
+
+def repodata_formats(latest_only=False, incremental=False):
+    """
+    Return the repodata filenames to look for in a channel, best first.
+
+    With `latest_only` the smaller current repodata is preferred, with the
+    full repodata as a fallback. With `incremental` the full repodata is
+    preferably patched from its jlap log instead of downloaded again.
+    """
+    formats = list(REPODATA_FORMATS)
+    if incremental:
+        formats = INCREMENTAL_REPODATA_FORMATS + formats
+    if latest_only:
+        formats = CURRENT_REPODATA_FORMATS + formats
+    return formats
+
+
+def zstd_decompressor():
+    """Return an incremental zstd decompressor, None if not available."""
+    if zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    elif zstd is not None:
+        return zstd.ZstdDecompressor()
+    return None
+
+
+def _decompressor(filepath):
+    """Return an incremental decompressor for `filepath`, by extension."""
+    if filepath.endswith('.bz2'):
+        return bz2.BZ2Decompressor()
+    elif filepath.endswith('.zst'):
+        decompressor = zstd_decompressor()
+        if decompressor is None:
+            raise RepodataError('zstd is not available to read ' + filepath)
+        return decompressor
+    return None
+
+
+def iter_repodata_packages(filepath, chunk_size=CHUNK_SIZE):
+    """Yield `(filename, record)` for each package in a repodata file."""
+    decompressor = _decompressor(filepath)
+
+    with open(filepath, 'rb') as f:
+        stream = JSONStream(f, decompressor=decompressor,
+                            chunk_size=chunk_size)
+        for key in stream.keys():
+            if key == 'packages':
+                for filename in stream.keys():
+                    yield filename, stream.value()
+            else:
+                stream.skip()
+
+
+def parse_repodata_file(filepath):
+    """
+    Reduce a repodata file to the information used by the package manager.
+
+    Returns a `(sizes, apps, versions)` tuple where `sizes` maps each package
+    name to a `{version: size}` dictionary, `apps` maps each app name to a
+    `{version: (type, app_entry, app_type)}` dictionary and `versions` maps
+    each package name to its sorted list of versions. If the file is missing
+    or cannot be read `None` is returned.
+
+    Versions are sorted here, in the worker process parsing the file, so
+    that merging only needs to sort again the packages found in more than
+    one file.
+    """
+    if not os.path.isfile(filepath):
+        return None
+
+    sizes = {}
+    apps = {}
+    try:
+        for filename, data in iter_repodata_packages(filepath):
+            name, version, _build = tuple(filename.rsplit('-', 2))
+
+            if name not in sizes:
+                sizes[name] = {}
+            sizes[name][version] = data.get('size', '')
+
+            # Only the latest builds will have the correct metadata for
+            # apps, so only store apps that have the app metadata
+            if data.get('type'):
+                if name not in apps:
+                    apps[name] = {}
+                apps[name][version] = (data.get('type'),
+                                       data.get('app_entry'),
+                                       data.get('app_type'))
+        versions = dict((name, sort_versions(sizes[name])) for name in sizes)
+    except Exception as error:
+        logger.error(str((filepath, error)))
+        return None
+
+    return sizes, apps, versions
+
+
+def _close_pool():
+    """Stop the worker processes of the parsing pool."""
+    global _POOL
+
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.terminate()
+            _POOL.join()
+            _POOL = None
+
+
+def _get_pool():
+    """
+    Return the pool of worker processes, started on first use, or None.
+
+    Workers are spawned, not forked, as the calling process runs Qt threads.
+    None is returned if spawning is not supported (Python 2) or fails.
+    """
+    global _POOL
+
+    with _POOL_LOCK:
+        if _POOL is None:
+            try:
+                cpus = multiprocessing.cpu_count()
+            except NotImplementedError:
+                cpus = 1
+
+            if cpus < 2 or not hasattr(multiprocessing, 'get_context'):
+                return None
+
+            try:
+                context = multiprocessing.get_context('spawn')
+                _POOL = context.Pool(cpus)
+            except Exception as error:
+                logger.error(str(error))
+                return None
+            atexit.register(_close_pool)
+        return _POOL
+
+
+def _total_size(filepaths):
+    """Return the size of the existing files of `filepaths`."""
+    return sum(os.path.getsize(path) for path in filepaths
+               if os.path.isfile(path))
+
+
+def parse_repodata_files(filepaths, parallel=True):
+    """
+    Yield the `parse_repodata_file` result of each path, in order.
+
+    With `parallel`, files are parsed in a persistent pool of worker
+    processes and the results are yielded in the original order as they
+    become available, so merging stays deterministic. Files are parsed
+    in-process when there is a single file, when they are small (below
+    `PARALLEL_MIN_SIZE` in total) or if the pool can not be started.
+    """
+    pool = None
+    if (parallel and len(filepaths) > 1 and
+            _total_size(filepaths) >= PARALLEL_MIN_SIZE):
+        pool = _get_pool()
+
+    if pool is None:
+        for path in filepaths:
+            yield parse_repodata_file(path)
+        return
+
+    for partial in pool.imap(parse_repodata_file, filepaths):
+        yield partial
+
+
+def merge_repodata(partials, names=None, version_table=None):
+    """
+    Merge the parsed repodata files into a single set of packages and apps.
+
+    `partials` is an ordered sequence of `parse_repodata_file` results; when
+    a version is found in more than one file, the last one wins. If `names`
+    is given, only those packages are merged.
+
+    Returns two `PackageIndex`, for packages and apps, that share the
+    `version_table` (a new one if not given).
+    """
+    all_packages = {}
+
+    for partial in partials:
+        if partial is None:
+            continue
+
+        sizes, apps, versions = partial
+        for name in (sizes if names is None else names):
+            if name not in sizes:
+                continue
+            elif name not in all_packages:
+                all_packages[name] = {'versions': [],
+                                      'size': {},
+                                      'type': {},
+                                      'app_entry': {},
+                                      'app_type': {},
+                                      }
+            package = all_packages[name]
+            package['versions'].append(versions[name])
+            package['size'].update(sizes[name])
+
+            for version, app in apps.get(name, {}).items():
+                type_, app_entry, app_type = app
+                package['type'][version] = type_
+                package['app_entry'][version] = app_entry
+                package['app_type'][version] = app_type
+
+    all_apps = {}
+    for name in all_packages:
+        package = all_packages[name]
+        sorted_versions = package['versions']
+        if len(sorted_versions) == 1:
+            package['versions'] = list(sorted_versions[0])
+        else:
+            package['versions'] = sort_versions(set(chain(*sorted_versions)))
+
+        # Has type in this case implies being an app
+        types = package['type']
+        if types:
+            all_apps[name] = package.copy()
+            # Remove all versions that are not apps!
+            all_apps[name]['versions'] = [v for v in package['versions']
+                                          if v in types]
+
+    if version_table is None:
+        version_table = InternTable()
+    return (PackageIndex.from_packages(all_packages, versions=version_table),
+            PackageIndex.from_packages(all_apps, versions=version_table))
+
+
+# --- Index cache
+# -----------------------------------------------------------------------------
+def file_fingerprint(filepath):
+    """Return a `(path, size, mtime)` tuple identifying a file on disk."""
+    path = os.path.abspath(filepath)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, stat.st_size, stat.st_mtime)
+
+
+def _replace_file(src, dst):
+    """Move `src` over `dst` in a single step where the os supports it."""
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2
+        if os.name == 'nt' and os.path.isfile(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def load_index_cache(cache_path, fingerprints):
+    """
+    Load a cached `(all_packages, all_apps)` index.
+
+    Returns `None` if there is no cache or if it was built from different
+    source files than the ones given by `fingerprints`.
+    """
+    if not cache_path or not os.path.isfile(cache_path):
+        return None
+
+    try:
+        with open(cache_path, 'rb') as f:
+            header = pickle.load(f)
+            if (header.get('version') != INDEX_CACHE_VERSION or
+                    header.get('fingerprints') != list(fingerprints)):
+                return None
+            return pickle.load(f)
+    except Exception as error:
+        logger.error(str((cache_path, error)))
+        return None
+
+
+def save_index_cache(cache_path, fingerprints, index):
+    """Store the `(all_packages, all_apps)` index built from `fingerprints`."""
+    if not cache_path:
+        return
+
+    header = {'version': INDEX_CACHE_VERSION,
+              'fingerprints': list(fingerprints)}
+    folder = os.path.dirname(os.path.abspath(cache_path))
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        _replace_file(temp_path, cache_path)
+    except Exception as error:
+        logger.error(str((cache_path, error)))
+
+
+def _partial_cache_path(cache_dir, filepath):
+    """Return the path used to cache the parsed content of `filepath`."""
+    if cache_dir:
+        return os.path.join(cache_dir, os.path.basename(filepath) + '.index')
+
+
+class RepodataIndex(object):
+    """
+    Merged package index that keeps the parsed content of each file.
+
+    When the set of repodata files changes (a channel is enabled, disabled or
+    downloaded again), only the packages found in the files that were added
+    or removed are merged again.
+    """
+
+    def __init__(self):
+        """Merged package index that keeps the parsed content of each file."""
+        self._lock = threading.Lock()
+        self._fingerprints = []
+        self._partials = {}
+        self._packages = PackageIndex()
+        self._apps = PackageIndex()
+
+    def _cached_partial(self, fingerprint, cache_dir):
+        """Return the parsed content of a file from memory or disk."""
+        if fingerprint in self._partials:
+            return self._partials[fingerprint]
+
+        cache_path = _partial_cache_path(cache_dir, fingerprint[0])
+        partial = load_index_cache(cache_path, [fingerprint])
+        if partial is not None:
+            self._partials[fingerprint] = partial
+        return partial
+
+    def _load_partials(self, filepaths, fingerprints, cache_dir, parallel):
+        """Make sure the parsed content of all `filepaths` is available."""
+        missing = []
+        for path, fingerprint in zip(filepaths, fingerprints):
+            if (self._cached_partial(fingerprint, cache_dir) is None and
+                    fingerprint not in self._partials):
+                missing.append((path, fingerprint))
+
+        paths = [path for path, _fingerprint in missing]
+        partials = parse_repodata_files(paths, parallel=parallel)
+        for (path, fingerprint), partial in zip(missing, partials):
+            self._partials[fingerprint] = partial
+            if partial is not None:
+                save_index_cache(_partial_cache_path(cache_dir, path),
+                                 [fingerprint], partial)
+
+    def _update(self, filepaths, fingerprints, cache_dir, parallel):
+        """Merge the files given by `fingerprints`, reusing the last merge."""
+        old = self._fingerprints
+        added = [fp for fp in fingerprints if fp not in old]
+        removed = [fp for fp in old if fp not in fingerprints]
+
+        # The content of the removed files is needed to know what to undo
+        removed_partials = [self._cached_partial(fp, cache_dir)
+                            for fp in removed]
+        incremental = (bool(old) and
+                       [fp for fp in old if fp in fingerprints] ==
+                       [fp for fp in fingerprints if fp in old] and
+                       all(fp in self._partials for fp in removed))
+
+        self._load_partials(filepaths, fingerprints, cache_dir, parallel)
+        partials = [self._partials[fp] for fp in fingerprints]
+
+        if incremental:
+            names = set()
+            for partial in removed_partials + [self._partials[fp]
+                                               for fp in added]:
+                if partial is not None:
+                    names.update(partial[0])
+
+            version_table = self._packages.version_table
+            packages, apps = merge_repodata(partials, names=names,
+                                            version_table=version_table)
+            self._packages = self._packages.replace(names, packages)
+            self._apps = self._apps.replace(names, apps)
+        else:
+            self._packages, self._apps = merge_repodata(partials)
+
+        self._fingerprints = fingerprints
+        self._partials = dict((fp, self._partials[fp]) for fp in fingerprints)
+
+    @staticmethod
+    def _load_cache(cache_path, fingerprints):
+        """Load the merged index, its details are read when first needed."""
+        index = load_index_cache(cache_path, fingerprints)
+        if index is not None:
+            details = DetailsFile(cache_path + INDEX_DETAILS_SUFFIX)
+            token = details.token()
+            if token is None or any(item.details_token != token
+                                    for item in index):
+                return None
+
+            for item in index:
+                item.attach_details(details)
+        return index
+
+    def _save_cache(self, cache_path, fingerprints):
+        """Store the merged index, with its details in a separate file."""
+        if not cache_path:
+            return
+
+        token = uuid.uuid4().hex
+        folder = os.path.dirname(os.path.abspath(cache_path))
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                DetailsFile.write(f, token)
+                self._packages.write_details(f, token)
+                self._apps.write_details(f, token)
+            _replace_file(temp_path, cache_path + INDEX_DETAILS_SUFFIX)
+        except Exception as error:
+            logger.error(str((cache_path, error)))
+            return
+
+        save_index_cache(cache_path, fingerprints,
+                         (self._packages, self._apps))
+
+    def load(self, filepaths, metadata=None, cache_path=None, parallel=True):
+        """
+        Load and merge `filepaths` into a single set of packages and apps.
+
+        If `cache_path` is given the merged index is stored there and reused
+        as long as none of the source files change (path, size and mtime).
+        Sizes and app metadata are stored next to it and only read back when
+        a package needs them. The content of each file is also cached next to
+        it, so that the index can be updated incrementally later on. Use
+        `parallel=False` to parse all the files in the calling process.
+        """
+        fingerprints = [file_fingerprint(path) for path in filepaths]
+        cache_dir = os.path.dirname(cache_path) if cache_path else None
+
+        with self._lock:
+            if fingerprints != self._fingerprints:
+                index = self._load_cache(cache_path, fingerprints)
+                if index is None:
+                    self._update(filepaths, fingerprints, cache_dir, parallel)
+                    self._save_cache(cache_path, fingerprints)
+                else:
+                    self._packages, self._apps = index
+                    self._fingerprints = fingerprints
+                    self._partials = dict((fp, self._partials[fp])
+                                          for fp in fingerprints
+                                          if fp in self._partials)
+
+            # Callers are free to modify what they get
+            metadata = metadata if metadata else {}
+            all_packages = self._packages.copy(metadata=metadata)
+            all_apps = self._apps.copy(metadata=metadata)
+
+        return all_packages, all_apps
+
+
+def load_repodata(filepaths, metadata=None, cache_path=None, parallel=True):
+    """
+    Load and merge `filepaths` into a single set of packages and apps.
+
+    See `RepodataIndex.load`.
+    """
+    index = RepodataIndex()
+    return index.load(filepaths, metadata=metadata, cache_path=cache_path,
+                      parallel=parallel)
+
+
+# --- Local testing
+# -----------------------------------------------------------------------------
+def _write_formats(filepath, folder):  # pragma: no cover
+    """Write the repodata of `filepath` in every format, return the paths."""
+    data = {'packages': dict(iter_repodata_packages(filepath))}
+    raw = json.dumps(data).encode('utf-8')
+
+    # Only the latest version of each package
+    latest = {}
+    for filename, record in data['packages'].items():
+        name = record.get('name')
+        if name not in latest or sort_versions(
+                [latest[name][1]['version'], record['version']])[-1] == \
+                record['version']:
+            latest[name] = (filename, record)
+    current = json.dumps({'packages': dict(latest.values())}).encode('utf-8')
+
+    formats = [('repodata.json', raw),
+               ('repodata.json.bz2', bz2.compress(raw)),
+               ('current_repodata.json', current)]
+    if zstandard is not None:
+        formats.append(('repodata.json.zst',
+                        zstandard.ZstdCompressor(level=16).compress(raw)))
+    elif zstd is not None:
+        formats.append(('repodata.json.zst', zstd.compress(raw, level=16)))
+
+    paths = []
+    for filename, content in formats:
+        path = os.path.join(folder, filename)
+        with open(path, 'wb') as f:
+            f.write(content)
+        paths.append(path)
+    return paths
+
+
+def test():  # pragma: no cover
+    """
+    Time a cold and a warm load of the repodata files given as args.
+
+    The first file is also written in every repodata format, to compare
+    their sizes and decode times.
+    """
+    import sys
+
+    filepaths = sys.argv[1:]
+    cache_path = os.path.join(tempfile.mkdtemp(), INDEX_CACHE_FILENAME)
+
+    for label in ('cold', 'warm'):
+        start = time.time()
+        all_packages, _all_apps = load_repodata(filepaths,
+                                                cache_path=cache_path)
+        print(label, len(all_packages), time.time() - start)
+
+    for path in _write_formats(filepaths[0], tempfile.mkdtemp()):
+        start = time.time()
+        parse_repodata_file(path)
+        print('{0:>22} {1:>10} bytes {2:.2f}s'.format(
+            os.path.basename(path), os.path.getsize(path),
+            time.time() - start))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    test()
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Sharded repodata, fetched one package name at a time.
+
+A channel may publish, next to its full repodata, a shard index::
+
+    repodata_shards.msgpack.zst
+    {"info": {"subdir": ..., "base_url": ..., "shards_base_url": ...},
+     "shards": {<package name>: <sha256 of the shard>, ...}}
+
+Each shard is a zstd compressed msgpack file, named after its sha256, with
+the `packages` and `packages.conda` records of a single package name. Only
+the shards of the packages asked for (and of their dependencies) are
+fetched, so the index of a huge channel is available right away.
+
+Shards never change once published, they are kept in an on disk cache
+shared by all channels and only downloaded once. The records fetched for a
+channel are written as a plain repodata file, that the repodata loader reads
+like any other.
+"""
+
+# Standard library imports
+import binascii
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import tempfile
+
+try:
+    from urllib.parse import urljoin
+except ImportError:  # Python 2
+    from urlparse import urljoin
+
+# Third party imports
+import requests
+
+# Local imports
+from conda_manager.api import http_cache
+from conda_manager.api.repodata import ZSTD_AVAILABLE, zstd_decompressor
+from conda_manager.utils.logs import logger
+
+# Optional msgpack support, shards are msgpack files
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+SHARDS_AVAILABLE = msgpack is not None and ZSTD_AVAILABLE
+
+# Published shard index, and the plain repodata written from the shards
+SHARDS_INDEX_FILENAME = 'repodata_shards.msgpack.zst'
+SHARDS_REPODATA_FILENAME = 'repodata_shards.json'
+SHARD_SUFFIX = '.msgpack.zst'
+
+# Shards downloaded at the same time
+MAX_SHARD_DOWNLOADS = 8
+
+# Records of a shard
+SHARD_KEYS = ('packages', 'packages.conda')
+
+
+class ShardError(Exception):
+    """Invalid shard index or shard."""
+
+    pass
+
+
+def index_path(path):
+    """Return the path of the shard index of the repodata at `path`."""
+    return path[:-len(SHARDS_REPODATA_FILENAME)] + SHARDS_INDEX_FILENAME
+
+
+def shard_cache_path(cache_dir, digest):
+    """Return the path of the shard with hexadecimal sha256 `digest`."""
+    return os.path.join(cache_dir, digest + SHARD_SUFFIX)
+
+
+def _unpack(data):
+    """Decompress and decode the msgpack.zst `data`."""
+    try:
+        data = zstd_decompressor().decompress(data)
+        return msgpack.unpackb(data, raw=False)
+    except Exception as error:
+        raise ShardError(str(error))
+
+
+def _hex(digest):
+    """Return the bytes or string `digest` as an hexadecimal string."""
+    if isinstance(digest, bytes):
+        return binascii.hexlify(digest).decode('ascii')
+    return digest
+
+
+def load_index(path):
+    """
+    Load the shard index at `path`.
+
+    Returns the `info` of the channel and the hexadecimal digest of the
+    shard of each package name.
+    """
+    with open(path, 'rb') as f:
+        index = _unpack(f.read())
+
+    try:
+        shards = dict((name, _hex(digest))
+                      for name, digest in index['shards'].items())
+    except (KeyError, AttributeError, TypeError):
+        raise ShardError('Invalid shard index ' + path)
+    return index.get('info', {}), shards
+
+
+def shard_url(url, info, digest):
+    """Return the url of a shard from the shard index `url` and `info`."""
+    base_url = info.get('shards_base_url') or ''
+    if base_url and not base_url.endswith('/'):
+        base_url += '/'
+    return urljoin(urljoin(url, base_url), digest + SHARD_SUFFIX)
+
+
+def _write_file(path, data):
+    """Write `data` to `path` atomically."""
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp',
+                                     prefix=os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        http_cache.replace_file(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def _load_shard(url, digest, cache_dir, session, **kwargs):
+    """Return the shard `digest`, from the cache or downloaded."""
+    path = shard_cache_path(cache_dir, digest)
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() == digest:
+            return _unpack(data)
+        logger.error(str((path, 'corrupt shard')))
+
+    r = session.get(url, **kwargs)
+    try:
+        if r.status_code != 200:
+            raise http_cache.HTTPStatusError(url, r.status_code)
+        data = r.content
+    finally:
+        r.close()
+
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ShardError('Shard does not match its hash ' + url)
+
+    shard = _unpack(data)
+    _write_file(path, data)
+    return shard
+
+
+def dependency_names(shard):
+    """Return the names of the packages the records of `shard` depend on."""
+    names = set()
+    for key in SHARD_KEYS:
+        for record in shard.get(key, {}).values():
+            for spec in record.get('depends', []):
+                names.add(spec.split()[0])
+    return names
+
+
+def fetch_shards(url, info, index, names, cache_dir, session=None,
+                 dependencies=True, **kwargs):
+    """
+    Return the shards of `names` given the shard `index` at `url`.
+
+    With `dependencies` the shards of the packages they depend on are
+    fetched too, recursively. Names missing from the index are ignored.
+    Shards are downloaded concurrently and kept in `cache_dir`.
+    """
+    session = session if session is not None else requests
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    def load(name):
+        digest = index[name]
+        return name, _load_shard(shard_url(url, info, digest), digest,
+                                 cache_dir, session, **kwargs)
+
+    shards = {}
+    pending = set(name for name in names if name in index)
+    pool = ThreadPool(MAX_SHARD_DOWNLOADS)
+    try:
+        while pending:
+            found = pool.map(load, sorted(pending))
+            shards.update(found)
+            pending = set()
+            if dependencies:
+                for __, shard in found:
+                    pending.update(dependency_names(shard))
+                pending = set(name for name in pending
+                              if name in index and name not in shards)
+    finally:
+        pool.close()
+        pool.join()
+
+    return shards
+
+
+def _jsonable(value):
+    """Return `value` with bytes (like hashes) as hexadecimal strings."""
+    if isinstance(value, bytes):
+        return _hex(value)
+    elif isinstance(value, dict):
+        return dict((key, _jsonable(item)) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+def load_names(path):
+    """Return the package names asked for in the repodata at `path`."""
+    if not os.path.isfile(path):
+        return set()
+
+    try:
+        with open(path, 'r') as f:
+            return set(json.load(f).get('shard_names', []))
+    except Exception as error:
+        logger.error(str((path, error)))
+        return set()
+
+
+def write_repodata(path, info, names, shards):
+    """
+    Write the records of `shards` as plain repodata to `path`.
+
+    The records keep the `packages` and `packages.conda` keys of the shards,
+    like a full repodata file, and the package `names` asked for are kept to
+    fetch them again on the next update.
+    """
+    repodata = {'info': _jsonable(info),
+                'shard_names': sorted(names)}
+    for key in SHARD_KEYS:
+        packages = {}
+        for shard in shards.values():
+            packages.update(shard.get(key, {}))
+        repodata[key] = _jsonable(packages)
+
+    _write_file(path, json.dumps(repodata).encode('utf-8'))
+
+
+def fetch(url, path, names=(), cache_dir=None, session=None,
+          dependencies=True, **kwargs):
+    """
+    Update the repodata at `path` with the shards of `names`.
+
+    The shard index `url` is revalidated first, and the shards of `names`,
+    of the names asked for in previous updates and, with `dependencies`,
+    of the packages they depend on are fetched. Returns True if the local
+    repodata changed. An HTTPStatusError is raised if the channel has no
+    shard index.
+
+    `cache_dir` is where shards are kept, next to `path` by default.
+    `session` is used to make the requests (`requests` module by default)
+    and `kwargs` are passed to its `get` method.
+    """
+    if not SHARDS_AVAILABLE:
+        raise ShardError('msgpack and zstd are needed for sharded repodata')
+
+    session = session if session is not None else requests
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(path), 'shards')
+
+    shards_index_path = index_path(path)
+    changed = http_cache.fetch(url, shards_index_path, session=session,
+                               raise_errors=True, **kwargs)
+
+    previous_names = load_names(path)
+    names = previous_names.union(names)
+    if not changed and names == previous_names and os.path.isfile(path):
+        return False
+
+    info, index = load_index(shards_index_path)
+    shards = fetch_shards(url, info, index, names, cache_dir,
+                          session=session, dependencies=dependencies,
+                          **kwargs)
+    write_repodata(path, info, names, shards)
+    return True
+
+
+# --- Local testing
+# -----------------------------------------------------------------------------
+def _compress(data):  # pragma: no cover
+    """Compress `data` with zstd."""
+    from conda_manager.api import repodata
+
+    if repodata.zstandard is not None:
+        return repodata.zstandard.ZstdCompressor().compress(data)
+    return repodata.zstd.compress(data)
+
+
+def _pack(data):  # pragma: no cover
+    """Encode and compress `data` as msgpack.zst."""
+    return _compress(msgpack.packb(data))
+
+
+def _write_channel(folder, packages):  # pragma: no cover
+    """Write the shards and the shard index of the repodata `packages`."""
+    by_name = {}
+    for filename, record in packages.items():
+        by_name.setdefault(record['name'], {})[filename] = record
+
+    os.makedirs(os.path.join(folder, 'shards'))
+    index = {}
+    for name, records in by_name.items():
+        data = _pack({'packages': records})
+        digest = hashlib.sha256(data).digest()
+        index[name] = digest
+        with open(os.path.join(folder, 'shards',
+                               _hex(digest) + SHARD_SUFFIX), 'wb') as f:
+            f.write(data)
+
+    info = {'subdir': 'noarch', 'shards_base_url': './shards/'}
+    with open(os.path.join(folder, SHARDS_INDEX_FILENAME), 'wb') as f:
+        f.write(_pack({'version': 1, 'info': info, 'shards': index}))
+
+
+def test(n_packages=30000):  # pragma: no cover
+    """Time a sharded first open against the full index of a channel."""
+    import random
+    import time
+
+    from conda_manager.api.repodata import load_repodata
+
+    served = tempfile.mkdtemp()
+    rnd = random.Random(0)
+    packages = {}
+    for i in range(n_packages):
+        for version in range(3):
+            # Like in real channels, most packages depend on a few core ones
+            depends = ['pkg{0}'.format(rnd.randrange(min(i, 100) or 1))
+                       for __ in range(rnd.randint(0, 2))]
+            packages['pkg{0}-{1}.0-py_0.tar.bz2'.format(i, version)] = {
+                'name': 'pkg{0}'.format(i), 'version': '{0}.0'.format(version),
+                'build': 'py_0', 'size': rnd.randint(1000, 10 ** 7),
+                'depends': depends}
+
+    with open(os.path.join(served, 'repodata.json.zst'), 'wb') as f:
+        f.write(_compress(json.dumps({'packages': packages}).encode('utf-8')))
+    _write_channel(served, packages)
+
+    server = http_cache._serve(served)
+    base = 'http://127.0.0.1:{0}/'.format(server.server_port)
+    downloads = tempfile.mkdtemp()
+
+    t0 = time.time()
+    path = os.path.join(downloads, 'repodata.json.zst')
+    http_cache.fetch(base + 'repodata.json.zst', path)
+    all_packages, __ = load_repodata([path], parallel=False)
+    print('full index: {0:.2f}s, {1} packages'.format(time.time() - t0,
+                                                      len(all_packages)))
+
+    for label in ['sharded, cold', 'sharded, warm']:
+        t0 = time.time()
+        path = os.path.join(downloads, SHARDS_REPODATA_FILENAME)
+        fetch(base + SHARDS_INDEX_FILENAME, path,
+              names=['pkg1', 'pkg2', 'pkg3'])
+        all_packages, __ = load_repodata([path], parallel=False)
+        print('{0}: {1:.2f}s, {2} packages'.format(label, time.time() - t0,
+                                                   len(all_packages)))
+    server.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    test()
@@ -428,6 +428,54 @@ class CondaPackagesModel(QAbstractTableModel):
 
         return versions
 
+    def update_data(self, packages, data):
+        """
+        Replace the packages and rows, only notifying the rows that changed.
+
+        Rows are matched by package name. The actions selected on the rows
+        that are kept are preserved.
+        """
+        self._packages = packages
+        new_rows = dict((row[C.COL_NAME], row) for row in data)
+
+        # Removed rows, by runs of consecutive rows from the end
+        end = len(self._rows) - 1
+        while end >= 0:
+            if self._rows[end][C.COL_NAME] in new_rows:
+                end -= 1
+                continue
+            start = end
+            while start > 0 and self._rows[start - 1][C.COL_NAME] not in \
+                    new_rows:
+                start -= 1
+            self.beginRemoveRows(QModelIndex(), start, end)
+            del self._rows[start:end + 1]
+            self.endRemoveRows()
+            end = start - 1
+
+        # Changed rows
+        last_column = self.columnCount() - 1
+        for i, row in enumerate(self._rows):
+            new_row = new_rows.pop(row[C.COL_NAME])
+            for column in C.ACTION_COLUMNS:
+                if column in row:
+                    new_row[column] = row[column]
+            if new_row != row:
+                self._rows[i] = new_row
+                self.dataChanged.emit(self.index(i, 0),
+                                      self.index(i, last_column))
+
+        # Added rows, in the order of `data`
+        added = [row for row in data if row[C.COL_NAME] in new_rows]
+        if added:
+            first = len(self._rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            self._rows.extend(added)
+            self.endInsertRows()
+
+        self._name_to_index = dict((r[C.COL_NAME], i)
+                                   for i, r in enumerate(self._rows))
+
     def get_package_version(self, name):
         """  """
         if name in self._name_to_index:
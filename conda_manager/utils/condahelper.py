@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Serve conda commands to the conda manager over stdin and stdout.
+
+Run with the python of a root prefix, conda is imported once and each
+request runs a conda command in process. Requests and responses are JSON
+documents, one per line::
+
+    -> {"id": 1, "args": ["install", "--json", "--name", "env", "numpy"]}
+    <- {"id": 1, "stdout": "..."}
+    <- {"id": 1, "stderr": "..."}
+    <- {"id": 1, "done": true, "returncode": 0, "error": null}
+
+The output of a command is sent as it is written. Requests are served one
+at a time, in order, each with the configuration and caches of conda
+reset as in a new process. Once conda is imported a
+`{"id": null, "ready": true}` line is written, or a
+`{"id": null, "error": "..."}` line if conda could not be imported.
+"""
+
+# Standard library imports
+import importlib
+import json
+import os.path as osp
+import sys
+import traceback
+
+HELPER_SCRIPT = osp.realpath(__file__).replace('.pyc', '.py')
+
+# Classes of conda keeping repodata, package caches and environments loaded
+CONDA_CACHES = [('conda.core.subdir_data', 'SubdirData'),
+                ('conda.core.prefix_data', 'PrefixData'),
+                ('conda.core.package_cache_data', 'PackageCacheData')]
+
+
+class RequestStream(object):
+    """File like object sending what is written as output of a request."""
+
+    def __init__(self, out, request_id, name):
+        """File like object sending what is written as output of a request."""
+        self._out = out
+        self._request_id = request_id
+        self._name = name
+
+    def write(self, text):
+        """Send `text` as output of the request."""
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        if text:
+            send(self._out, {'id': self._request_id, self._name: text})
+
+    def writelines(self, lines):
+        """Send `lines` as output of the request."""
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Output is sent as it is written."""
+        pass
+
+    def isatty(self):
+        """Not a terminal, so conda does not show progress bars."""
+        return False
+
+
+def send(out, message):
+    """Write a message line to `out`."""
+    out.write(json.dumps(message) + '\n')
+    out.flush()
+
+
+def reset_caches():
+    """
+    Forget what conda kept in memory from the previous commands.
+
+    The configuration files are read again, and repodata, package caches
+    and environments are loaded again from disk. What a conda version does
+    not have is skipped.
+    """
+    try:
+        from conda.base.context import reset_context
+        reset_context()
+    except Exception:
+        pass
+
+    for module_name, class_name in CONDA_CACHES:
+        try:
+            module = importlib.import_module(module_name)
+            getattr(module, class_name)._cache_.clear()
+        except Exception:
+            pass
+
+
+def run(run_command, request, out):
+    """Run the conda command of `request`, returns the return code."""
+    args = request['args']
+    stdout = RequestStream(out, request['id'], 'stdout')
+    stderr = RequestStream(out, request['id'], 'stderr')
+
+    reset_caches()
+    sys_stdout, sys_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = stdout, stderr
+    try:
+        return run_command(args[0], *args[1:], stdout=stdout, stderr=stderr,
+                           use_exception_handler=True)[-1]
+    except SystemExit as error:
+        return error.code
+    finally:
+        sys.stdout, sys.stderr = sys_stdout, sys_stderr
+
+
+def main():
+    """Serve conda commands until stdin is closed."""
+    out = sys.stdout
+    try:
+        from conda.cli.python_api import run_command
+    except Exception:
+        send(out, {'id': None, 'error': traceback.format_exc()})
+        return 1
+
+    send(out, {'id': None, 'ready': True})
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+
+        request = json.loads(line)
+        returncode, error = None, None
+        try:
+            returncode = run(run_command, request, out)
+        except Exception:
+            error = traceback.format_exc()
+
+        send(out, {'id': request['id'], 'done': True,
+                   'returncode': returncode, 'error': error})
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
@@ -2,6 +2,7 @@
 
 # Standard library imports
 import logging.handlers
+import multiprocessing
 import os
 
 # Local imports
@@ -19,6 +20,12 @@ def setup():
     logger = logging.getLogger('condamanager')
     logger.setLevel(logging.DEBUG)
 
+    # Worker processes (like the repodata parsing pool) import this module
+    # too, they must not truncate the log of the application
+    if multiprocessing.current_process().name != 'MainProcess':
+        logger.addHandler(logging.NullHandler())
+        return logger
+
 #    ch = logging.handlers.RotatingFileHandler(logfile, maxBytes=2*1024*1024,
 #                                              backupCount=5, mode='w')
     ch = logging.FileHandler(logfile, mode='w')
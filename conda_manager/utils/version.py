@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# -----------------------------------------------------------------------------
+# Copyright © 2015- The Spyder Development Team
+#
+# Licensed under the terms of the MIT License
+# -----------------------------------------------------------------------------
+"""
+Version ordering following the rules of conda's `VersionOrder`.
+
+A version string is split into an optional epoch (``1!``), the version and
+an optional local version (``+local``). Each part is split in components
+(on ``.`` and ``_``) and each component in numbers and strings, so that::
+
+    1.1dev1 < 1.1_ < 1.1a1 < 1.1.0dev1 == 1.1.dev1 < 1.1.a1 < 1.1.0rc1
+    < 1.1.0 == 1.1 < 1.1.0post1 == 1.1.post1 < 1.1post1
+
+Missing components and elements count as zero, strings sort before numbers,
+``dev`` sorts before any other string and ``post`` after any number.
+
+The comparison is encoded in plain (nested) tuples, so keys are compared
+natively by Python. Keys are memoized per version string and shared by
+every caller.
+"""
+
+# Standard library imports
+import re
+
+
+VERSION_SPLIT_RE = re.compile(r'([0-9]+|[*]+|[^0-9*]+)')
+
+# Element tokens, compared as tuples: (rank, value)
+_DEV = (-1, u'')
+_POST = (2, 0)
+_ZERO = (1, 0)
+
+# A zero followed only by zeros, i.e. the end of a component
+_END = _ZERO + (0,)
+
+# A component made only of zeros
+_ZERO_COMPONENT = (_END,)
+
+# Maximum number of memoized keys before the cache is cleared
+MAX_CACHED_KEYS = 2 ** 18
+_KEYS = {}
+_COMPONENTS = {}
+
+
+def _seal(tokens, zero):
+    """
+    Make a token list comparable as a tuple, with `zero` as the fill value.
+
+    Trailing zeros are dropped and an end marker is appended. A zero in the
+    middle also records whether what follows it is lower or greater than
+    zero, which is what decides the comparison against a shorter sequence.
+    """
+    while tokens and tokens[-1] == zero:
+        tokens.pop()
+
+    if zero in tokens:
+        sign = 0
+        for i in range(len(tokens) - 1, -1, -1):
+            if tokens[i] == zero:
+                tokens[i] = zero + (sign,)
+            else:
+                sign = 1 if tokens[i] > zero else -1
+
+    tokens.append(zero + (0,))
+    return tuple(tokens)
+
+
+def _component_key(component):
+    """Return the memoized key of a single version component (e.g. '1rc2')."""
+    try:
+        return _COMPONENTS[component]
+    except KeyError:
+        pass
+
+    if component.isdigit():
+        number = int(component)
+        key = ((1, number), _END) if number else _ZERO_COMPONENT
+    else:
+        tokens = []
+        for item in VERSION_SPLIT_RE.findall(component):
+            if item.isdigit():
+                number = int(item)
+                tokens.append((1, number) if number else _ZERO)
+            elif item == u'post':
+                tokens.append(_POST)
+            elif item == u'dev':
+                tokens.append(_DEV)
+            else:
+                tokens.append((0, item))
+
+        # Keep numbers and strings in phase, '1.a1' == '1.0a1'
+        if tokens and tokens[0][0] != 1:
+            tokens.insert(0, _ZERO)
+
+        key = _seal(tokens, _ZERO)
+
+    if len(_COMPONENTS) < MAX_CACHED_KEYS:
+        _COMPONENTS[component] = key
+    return key
+
+
+def _part_key(part):
+    """Return the key of a version without epoch or local version."""
+    if part.endswith(u'_'):
+        # A trailing underscore is kept, '1.0.1_' is a patched '1.0.1'
+        part = part[:-1].replace(u'_', u'.') + u'_'
+    else:
+        part = part.replace(u'_', u'.')
+
+    components = [_component_key(c) for c in part.split(u'.')] if part else []
+    return _seal(components, _ZERO_COMPONENT)
+
+
+_NO_LOCAL = _part_key(u'')
+
+
+def _version_key(version):
+    """Compute the ordering key for the `version` string."""
+    version = version.strip().lower()
+
+    epoch = 0
+    if u'!' in version:
+        epoch, version = version.split(u'!', 1)
+        epoch = int(epoch) if epoch.isdigit() else 0
+
+    local = _NO_LOCAL
+    if u'+' in version:
+        version, local = version.split(u'+', 1)
+        local = _part_key(local)
+
+    if u'-' in version and u'_' not in version:
+        version = version.replace(u'-', u'_')
+
+    return (epoch, _part_key(version), local)
+
+
+def version_key(version):
+    """
+    Return the memoized sort key for the `version` string.
+
+    Equivalent spellings of the same version (like '1.0' and '1') get the
+    same ordering and are told apart by the string itself, so sorting is
+    always deterministic.
+    """
+    try:
+        return _KEYS[version]
+    except KeyError:
+        pass
+
+    if len(_KEYS) >= MAX_CACHED_KEYS:
+        _KEYS.clear()
+
+    key = _KEYS[version] = _version_key(version) + (version,)
+    return key
+
+
+def sort_versions(versions=(), reverse=False):
+    """Sort a list of version strings from lowest to highest."""
+    return sorted(versions, key=version_key, reverse=reverse)
+
+
+# --- Local testing
+# -----------------------------------------------------------------------------
+def _sample_versions(n_packages=25000, n_versions=20, seed=0):
+    """Generate `n_packages` groups of realistic version strings."""
+    import random
+
+    rnd = random.Random(seed)
+    suffixes = [u'', u'', u'', u'', u'rc1', u'a2', u'b1', u'.post1', u'.dev0',
+                u'_1', u'+cuda']
+    groups = []
+    for __ in range(n_packages):
+        versions = set()
+        while len(versions) < n_versions:
+            if rnd.random() < 0.05:
+                base = u'{0}.{1:02d}.{2:02d}'.format(rnd.randint(2010, 2020),
+                                                     rnd.randint(1, 12),
+                                                     rnd.randint(1, 28))
+            else:
+                parts = [rnd.randint(0, 20) for __ in range(rnd.randint(1, 4))]
+                base = u'.'.join(str(p) for p in parts)
+            versions.add(base + rnd.choice(suffixes))
+        groups.append(list(versions))
+    return groups
+
+
+def test():  # pragma: no cover
+    """Time sorting the versions of a large index, per package."""
+    import time
+
+    groups = _sample_versions()
+    count = sum(len(g) for g in groups)
+
+    for label in ['cold', 'warm']:
+        t0 = time.time()
+        for versions in groups:
+            sort_versions(versions)
+        print('{0}: {1} versions in {2:.2f}s'.format(label, count,
+                                                   time.time() - t0))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    test()
@@ -12,6 +12,7 @@
 # Standard library imports
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals, with_statement)
+from functools import partial
 import gettext
 
 # Third party imports
@@ -28,6 +29,9 @@ from conda_manager.api import ManagerAPI
 
 _ = gettext.gettext
 
+# Versions on each side of the selected one solved in the background
+PREFETCH_VERSIONS = 1
+
 
 class CondaPackageActionDialog(QDialog):
     """ """
@@ -37,6 +41,8 @@ class CondaPackageActionDialog(QDialog):
         self._parent = parent
         self._prefix = prefix
         self._version_text = None
+        self._request = None
+        self._prefetch_workers = []
         self._name = name
         self._dependencies_dic = {}
         self._active_channels = active_channels
@@ -163,15 +169,42 @@ class CondaPackageActionDialog(QDialog):
         self._version_text = to_text_string(version)
         self._get_dependencies(install_dependencies)
 
+    def _solve(self, version, dependencies=True):
+        """Solve the install of `version`, the result is cached by the api."""
+        package_name = [self._name + '=' + version]
+
+        return self.api.conda_dependencies(prefix=self._prefix,
+                                           pkgs=package_name,
+                                           dep=dependencies,
+                                           channels=self._active_channels)
+
     def _get_dependencies(self, dependencies=True):
         """ """
-        package_name = [self._name + '=' + self._version_text]
-
-        worker = self.api.conda_dependencies(prefix=self._prefix,
-                                             pkgs=package_name,
-                                             dep=dependencies,
-                                             channels=self._active_channels)
-        worker.sig_finished.connect(self._on_process_finished)
+        self._request = (self._version_text, dependencies)
+        worker = self._solve(self._version_text, dependencies)
+        worker.sig_finished.connect(partial(self._on_process_finished,
+                                            self._request))
+
+    def _prefetch_dependencies(self):
+        """Solve the versions next to the selected one in the background."""
+        index = self.combobox_version.currentIndex()
+        dependencies = self._request[1]
+        self._prefetch_workers = [w for w in self._prefetch_workers
+                                  if not w.is_finished()]
+        for offset in range(1, PREFETCH_VERSIONS + 1):
+            for i in [index - offset, index + offset]:
+                if 0 <= i < self.combobox_version.count():
+                    version = self.combobox_version.itemText(i)
+                    worker = self._solve(to_text_string(version),
+                                         dependencies)
+                    self._prefetch_workers.append(worker)
+
+    def _cancel_prefetch(self):
+        """Cancel the background solves, so they do not delay the action."""
+        workers, self._prefetch_workers = self._prefetch_workers, []
+        for worker in workers:
+            if not worker.is_finished():
+                self.api.conda_cancel(worker)
 
     def _changed_checkbox(self, state):
         """ """
@@ -180,13 +213,15 @@ class CondaPackageActionDialog(QDialog):
         else:
             self._changed_version(self._version_text, dependencies=False)
 
-    def _on_process_finished(self, worker, output, error):
+    def _on_process_finished(self, request, worker, output, error):
         """ """
-        if self.isVisible():
+        # Results of a previous selection are ignored
+        if self.isVisible() and request == self._request:
             dic = output
             self.dependencies_dic = dic
             self._set_dependencies_table()
             self._set_gui_disabled(False)
+            self._prefetch_dependencies()
 
     def _set_dependencies_table(self):
         """ """
@@ -210,6 +245,15 @@ class CondaPackageActionDialog(QDialog):
         for widget in self.widgets:
             widget.setDisabled(value)
 
+    def accept(self):
+        self._cancel_prefetch()
+        super(CondaPackageActionDialog, self).accept()
+
     def reject(self):
+        self._cancel_prefetch()
         self.api.conda_terminate()
         super(CondaPackageActionDialog, self).reject()
+
+    def closeEvent(self, event):
+        self._cancel_prefetch()
+        super(CondaPackageActionDialog, self).closeEvent(event)
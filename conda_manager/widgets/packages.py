@@ -19,13 +19,14 @@ import os.path as osp
 import sys
 
 # Third party imports
-from qtpy.QtCore import QEvent, QSize, Qt, Signal
+from qtpy.QtCore import QEvent, QSize, Qt, QTimer, Signal
 from qtpy.QtWidgets import (QDialog, QDialogButtonBox, QHBoxLayout,
                             QMessageBox, QPushButton, QVBoxLayout, QWidget,
                             QToolButton)
 
 # Local imports
 from conda_manager.api import ManagerAPI
+from conda_manager.api.conda_api import PROGRESS_FETCH, PROGRESS_LINK
 from conda_manager.utils import get_conf_path, get_module_data_path
 from conda_manager.utils import constants as C
 from conda_manager.utils.logs import logger
@@ -127,6 +128,11 @@ class CondaPackagesWidget(QWidget):
     # file inside DATA_PATH with metadata for conda packages
     DATABASE_FILE = 'packages.ini'
 
+    # With sharded repodata, delay in ms before the shards of the packages
+    # matching a search are fetched, and most matches fetched at once
+    SHARD_SEARCH_DELAY = 500
+    SHARD_SEARCH_LIMIT = 10
+
     sig_worker_ready = Signal()
     sig_packages_ready = Signal()
     sig_environment_created = Signal(object, object)
@@ -147,7 +153,8 @@ class CondaPackagesWidget(QWidget):
                  conda_api_url='https://api.anaconda.org',
                  setup=True,
                  data_directory=None,
-                 extra_metadata={}):
+                 extra_metadata={},
+                 sharded_repodata=False):
 
         super(CondaPackagesWidget, self).__init__(parent)
 
@@ -167,6 +174,13 @@ class CondaPackagesWidget(QWidget):
         self._metadata_links = {}        # Bundled metadata
         self.api = ManagerAPI()
         self.busy = False
+        self._background_update = False  # Repodata being updated in place
+        self._revalidate = False         # Update repodata once shown
+        self._sharded = False
+        self._shard_names = set()        # Packages whose shards are fetched
+        self._shard_requests = set()     # Packages waiting to be fetched
+        self._shards_fetching = False
+        self._unfetched_names = set()    # Listed from the shard index only
         self.data_directory = data_directory
         self.conda_url = conda_url
         self.conda_api_url = conda_api_url
@@ -212,6 +226,7 @@ class CondaPackagesWidget(QWidget):
         self.status_bar = LabelPackageStatus(self)
         self.table = TableCondaPackages(self)
         self.textbox_search = LineEditSearch(self)
+        self._search_timer = QTimer(self)
         self.widgets = [self.button_update, self.button_channels,
                         self.combobox_filter, self.textbox_search, self.table,
                         self.button_ok, self.button_apply, self.button_clear,
@@ -249,6 +264,8 @@ class CondaPackagesWidget(QWidget):
         self.table_last_row.setMaximumHeight(0)
         self.table_last_row.setVisible(False)
         self.table_first_row.setVisible(False)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(self.SHARD_SEARCH_DELAY)
 
         # Layout
         top_layout = QHBoxLayout()
@@ -301,6 +318,8 @@ class CondaPackagesWidget(QWidget):
         self.table.sig_actions_updated.connect(self.update_actions)
         self.table.sig_pip_action_requested.connect(self._run_pip_action)
         self.table.sig_status_updated.connect(self.update_status)
+        self.table.sig_package_expanded.connect(self._package_expanded)
+        self._search_timer.timeout.connect(self._search_shards)
         self.table.sig_next_focus.connect(self.table_last_row.handle_tab)
         self.table.sig_previous_focus.connect(
             lambda: self.table_first_row.widget_before.setFocus())
@@ -312,6 +331,7 @@ class CondaPackagesWidget(QWidget):
         self.api.set_data_directory(self.data_directory)
         self._load_bundled_metadata()
         self.update_actions(0)
+        self.set_sharded_repodata(sharded_repodata)
 
         if setup:
             self.set_environment(name=name, prefix=prefix)
@@ -401,6 +421,19 @@ class CondaPackagesWidget(QWidget):
             logger.debug('')
 
         packages, apps = output
+        in_place = getattr(worker, 'in_place', False)
+
+        if self._sharded:
+            # The packages without fetched shards are listed from the shard
+            # index, their versions are fetched once needed
+            self._unfetched_names = set()
+            for name in self.api.sharded_package_names(self._active_channels):
+                if name not in packages:
+                    packages[name] = {'versions': []}
+                    self._unfetched_names.add(name)
+            self._fetch_shards(self._unfetched_names.intersection(
+                self._installed_names()))
+
 #        worker = self.api.pip_list(prefix=self.prefix)
 #        worker.sig_finished.connect(self._pip_list_ready)
         logins = self.get_logged_user_list_channels()
@@ -409,6 +442,7 @@ class CondaPackagesWidget(QWidget):
         worker.sig_finished.connect(self._user_private_packages_ready)
         worker.packages = packages
         worker.apps = apps
+        worker.in_place = in_place
 
     def _user_private_packages_ready(self, worker, output, error):
         if error:
@@ -418,10 +452,12 @@ class CondaPackagesWidget(QWidget):
 
         packages = worker.packages
         apps = worker.apps
+        in_place = worker.in_place
         worker = self.api.pip_list(prefix=self.prefix)
         worker.sig_finished.connect(self._pip_list_ready)
         worker.packages = packages
         worker.apps = apps
+        worker.in_place = in_place
 
 #        private_packages = {}
 #        if output:
@@ -468,25 +504,57 @@ class CondaPackagesWidget(QWidget):
                 if package == data[i][C.COL_NAME]:
                     data.pop(i)
 
-        self.table.setup_model(packages, data, self._metadata_links)
-        self.combobox_filter.setCurrentIndex(combobox_index)
-        self.filter_package(status)
+        if worker.in_place:
+            # Newer repodata found in the background, only the rows that
+            # changed are updated and the table stays usable
+            self.table.update_model(packages, data, self._metadata_links)
+            if not self.busy:
+                self.filter_package(status)
+        else:
+            self.table.setup_model(packages, data, self._metadata_links)
+            self.combobox_filter.setCurrentIndex(combobox_index)
+            self.filter_package(status)
 
-        if self._current_model_index:
-            self.table.setCurrentIndex(self._current_model_index)
-            self.table.verticalScrollBar().setValue(self._current_table_scroll)
+            if self._current_model_index:
+                self.table.setCurrentIndex(self._current_model_index)
+                self.table.verticalScrollBar().setValue(
+                    self._current_table_scroll)
 
         if error:
             self.update_status(str(error), False)
         self.sig_packages_ready.emit()
-        self.table.setFocus()
 
-    def _repodata_updated(self, paths):
+        if not worker.in_place:
+            self.table.setFocus()
+
+        if self._shards_fetching:
+            self._shards_fetching = False
+            self.status_bar.setText(self.message)
+
+        if self._revalidate:
+            self._revalidate_index()
+        elif self._shard_requests:
+            self._fetch_shards(())
+
+    def _revalidate_index(self):
+        """Check for newer metadata and repodata in the background."""
+        self._revalidate = False
+        self._background_update = True
+        worker = self.api.update_metadata()
+        worker.sig_finished.connect(self._metadata_updated)
+
+    def _repodata_updated(self, paths, in_place=None):
         """
         """
+        if in_place is None:
+            in_place = self._background_update
+        self._background_update = False
+
         worker = self.api.client_load_repodata(paths, extra_data={},
-                                               metadata=self._metadata)
+                                               metadata=self._metadata,
+                                               cache_dir=self.data_directory)
         worker.paths = paths
+        worker.in_place = in_place
         worker.sig_finished.connect(self._prepare_model_data)
 
     def _metadata_updated(self, worker, path, error):
@@ -506,7 +574,68 @@ class CondaPackagesWidget(QWidget):
                 self._metadata = {}
         else:
             self._metadata = {}
-        self.api.update_repodata(self._channels)
+        self._update_repodata()
+
+    def _installed_names(self):
+        """Return the names of the packages linked in the current prefix."""
+        if not self.prefix:
+            return set()
+        linked = self.api.conda_linked(prefix=self.prefix)
+        return set(cname.rsplit('-', 2)[0] for cname in linked)
+
+    def _update_repodata(self, names=()):
+        """
+        Update the repodata of the channels.
+
+        In sharded mode, the shards of the installed packages and of `names`
+        are fetched.
+        """
+        names = set(names)
+        if self._sharded:
+            names.update(self._installed_names())
+            self._shard_names.update(names)
+        self.api.update_repodata(self._channels,
+                                 names=sorted(names) if names else None)
+
+    # --- Sharded repodata
+    # -------------------------------------------------------------------------
+    def _fetch_shards(self, names):
+        """
+        Fetch in the background the shards of the packages `names`.
+
+        Names asked for while the widget is busy or fetching are fetched
+        afterwards.
+        """
+        self._shard_requests.update(set(names) - self._shard_names)
+        if (not self._shard_requests or self.busy or self._shards_fetching or
+                self._background_update):
+            return
+
+        names = sorted(self._shard_requests)
+        self._shard_requests = set()
+        self._shards_fetching = True
+        self.status_bar.setText(_('Fetching {0}...').format(', '.join(names)))
+        self._background_update = True
+        self._update_repodata(names)
+
+    def _package_expanded(self, name):
+        """Fetch the versions of package `name` if not fetched yet."""
+        if self._sharded and name in self._unfetched_names:
+            self._fetch_shards([name])
+
+    def _search_shards(self):
+        """Fetch the packages matching the search, if not fetched yet."""
+        text = self.textbox_search.text().strip().lower()
+        tokens = text.split()
+        if not self._sharded or not tokens:
+            return
+
+        names = [name for name in self._unfetched_names
+                 if all(token in name.lower() for token in tokens)]
+        if len(names) > self.SHARD_SEARCH_LIMIT:
+            # Too many matches, only the package named as searched is fetched
+            names = [name for name in names if name.lower() == text]
+        self._fetch_shards(names)
 
     # ---
     # -------------------------------------------------------------------------
@@ -528,7 +657,7 @@ class CondaPackagesWidget(QWidget):
             self.update_status(status)
             worker = func()
             worker.sig_finished.connect(self._run_multiple_actions)
-            worker.sig_partial.connect(self._partial_output_ready)
+            worker.sig_progress.connect(self._progress_ready)
         else:
             if self.conda_errors and self.message_box_error:
                 text = "The following errors occured:"
@@ -584,27 +713,19 @@ class CondaPackagesWidget(QWidget):
 
         self.setup()
 
-    def _partial_output_ready(self, worker, output, error):
+    def _progress_ready(self, worker, event):
         """
         """
         message = None
-        progress = (0, 0)
-
-        if isinstance(output, dict):
-            progress = (output.get('progress', None),
-                        output.get('maxval', None))
-            name = output.get('name', None)
-            fetch = output.get('fetch', None)
 
-            if fetch:
-                message = "Downloading <b>{0}</b>...".format(fetch)
-
-            if name:
-                self._current_action_name = name
-                message = "Linking <b>{0}</b>...".format(name)
+        if event.kind == PROGRESS_FETCH:
+            message = "Downloading <b>{0}</b>...".format(event.name)
+        elif event.kind == PROGRESS_LINK:
+            self._current_action_name = event.name
+            message = "Linking <b>{0}</b>...".format(event.name)
 
         logger.debug(message)
-        self.update_status(message, progress=progress)
+        self.update_status(message, progress=(event.progress, event.maxval))
 
     def _run_pip_action(self, package_name, action):
         """
@@ -711,7 +832,7 @@ class CondaPackagesWidget(QWidget):
             worker = self.api.conda_remove(name=name, all_=True)
 
         worker.sig_finished.connect(self._conda_process_ready)
-        worker.sig_partial.connect(self._partial_output_ready)
+        worker.sig_progress.connect(self._progress_ready)
         self.update_status(hide=True, message=status, progress=None)
         self._temporal_action_dic = dic
         return worker
@@ -745,7 +866,8 @@ class CondaPackagesWidget(QWidget):
 
     # --- Non UI API
     # -------------------------------------------------------------------------
-    def setup(self, check_updates=False, blacklist=[], metadata={}):
+    def setup(self, check_updates=False, blacklist=[], metadata={},
+              background=False):
         """
         Setup packages.
 
@@ -761,6 +883,11 @@ class CondaPackagesWidget(QWidget):
         blacklist: list of str
             List of conda package names to be excluded from the actual package
             manager view.
+        background : bool
+            If `True` and `check_updates`, the packages are shown right away
+            from the last downloaded repodata, and the latest repodata is
+            checked in the background. Only the packages that changed are
+            then updated in the view.
         """
         self.sig_packages_busy.emit()
 
@@ -779,13 +906,20 @@ class CondaPackagesWidget(QWidget):
         self._current_model_index = self.table.currentIndex()
         self._current_table_scroll = self.table.verticalScrollBar().value()
         self.update_status('Updating package index', True)
+        self._background_update = False
+
+        paths = self.api.repodata_files(channels=self._active_channels)
+        if check_updates and background and \
+                any(osp.isfile(path) for path in paths):
+            # Stale while revalidate
+            self._revalidate = True
+            check_updates = False
 
         if check_updates:
             worker = self.api.update_metadata()
             worker.sig_finished.connect(self._metadata_updated)
         else:
-            paths = self.api.repodata_files(channels=self._active_channels)
-            self._repodata_updated(paths)
+            self._repodata_updated(paths, in_place=False)
 
     def update_domains(self, anaconda_api_url=None, conda_url=None):
         """
@@ -824,6 +958,17 @@ class CondaPackagesWidget(QWidget):
     def set_token(self, token):
         self.token = token
 
+    def set_sharded_repodata(self, value):
+        """
+        Fetch only the shards of the packages shown from channels with shards.
+
+        The shards of the installed packages are fetched with the index, the
+        shards of other packages once searched for or expanded. This does not
+        update the package manager!
+        """
+        self.api.set_sharded_repodata(value)
+        self._sharded = self.api.sharded_repodata()
+
     def update_channels(self, channels, active_channels):
         """
         """
@@ -835,7 +980,12 @@ class CondaPackagesWidget(QWidget):
             self._active_channels = active_channels
             self.sig_channels_updated.emit(tuple(channels),
                                            tuple(active_channels))
-            self.setup(check_updates=True)
+
+            # Only go online if some active channel was never downloaded,
+            # the index is then updated with just the toggled channels
+            paths = self.api.repodata_files(channels=self._active_channels)
+            missing = [path for path in paths if not osp.isfile(path)]
+            self.setup(check_updates=bool(missing))
 
     def update_style_sheet(self, style_sheet=None, extra_dialogs={},
                            palette={}):
@@ -896,6 +1046,8 @@ class CondaPackagesWidget(QWidget):
     def search_package(self, text):
         """ """
         self.table.search_string_changed(text)
+        if self._sharded:
+            self._search_timer.start()
 
     def apply_multiple_actions(self):
         """
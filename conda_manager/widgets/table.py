@@ -87,6 +87,7 @@ class TableCondaPackages(QTableView):
     sig_actions_updated = Signal(int)
     sig_next_focus = Signal()
     sig_previous_focus = Signal()
+    sig_package_expanded = Signal(str)  # Versions of a package are needed
 
     def __init__(self, parent):
         super(TableCondaPackages, self).__init__(parent)
@@ -181,6 +182,28 @@ class TableCondaPackages(QTableView):
         self.refresh_actions()
         self.source_model.update_style_palette(self._palette)
 
+    def update_model(self, packages, data, metadata_links={}):
+        """
+        Update the current model in place with new packages and rows.
+
+        Only the rows that changed are updated, so the selection, scroll
+        position and selected actions are kept.
+        """
+        if self.source_model is None:
+            self.setup_model(packages, data, metadata_links)
+            return
+
+        self.source_model.update_data(packages, data)
+        self.metadata_links = metadata_links
+
+        packages_sizes = {}
+        for name in packages:
+            packages_sizes[name] = packages[name].get('size')
+        self._packages_sizes = packages_sizes
+
+        self.resize_rows()
+        self.refresh_actions()
+
     def update_style_palette(self, palette={}):
         self._palette = palette
 
@@ -459,8 +482,13 @@ class TableCondaPackages(QTableView):
                 name = row_data[const.COL_NAME]
                 version = self.source_model.get_package_version(name)
                 versions = self.source_model.get_package_versions(name)
+                status = row_data[const.COL_STATUS]
 
-                if not versions:
+                if not versions and status == const.NOT_INSTALLED:
+                    # The versions of the package are not fetched yet
+                    self.sig_package_expanded.emit(name)
+                    return
+                elif not versions:
                     versions = [version]
 
                 action = actions.get(column, None)
@@ -502,6 +530,12 @@ class TableCondaPackages(QTableView):
 
 #        if column in [const.COL_ACTION, const.COL_VERSION, const.COL_NAME]:
         if column in [const.COL_ACTION] and not right_click:
+            status = row_data[const.COL_STATUS]
+            if not versions and status == const.NOT_INSTALLED:
+                # The versions of the package are not fetched yet
+                self.sig_package_expanded.emit(name)
+                return
+
             is_installable = self.source_model.is_installable(model_index)
             is_removable = self.source_model.is_removable(model_index)
             is_upgradable = self.source_model.is_upgradable(model_index)